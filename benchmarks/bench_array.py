@@ -0,0 +1,39 @@
+"""
+ZarrProtocolV3 array reads on a MemoryStoreV3: full array, single chunk and
+a strided slab.
+
+    $ python benchmarks/bench_array.py
+"""
+import timeit
+
+import numpy as np
+
+from zarr3 import ZarrProtocolV3
+
+
+def main():
+    protocol = ZarrProtocolV3()
+    shape, chunks = (2048, 2048), (128, 128)
+    protocol.create_array("a", shape=shape, chunk_shape=chunks)
+    data = np.random.default_rng(0).random(shape)
+    protocol.write_array("a", data)
+
+    cases = [
+        ("full array", Ellipsis),
+        ("single chunk", (slice(128, 256), slice(256, 384))),
+        ("strided slab", (slice(100, 1900, 7), slice(0, 2048, 3))),
+    ]
+    for name, selection in cases:
+        read = lambda: protocol.read_array("a", selection)
+        np.testing.assert_array_equal(read(), data[selection])
+        t = min(timeit.repeat(read, number=3, repeat=3)) / 3
+        nbytes = data[selection].nbytes
+        print(f"{name:14} {t * 1e3:9.2f} ms  {nbytes / t / 2 ** 20:9.1f} MiB/s")
+
+    write = lambda: protocol.write_array("a", data)
+    t = min(timeit.repeat(write, number=1, repeat=3))
+    print(f"{'full write':14} {t * 1e3:9.2f} ms  {data.nbytes / t / 2 ** 20:9.1f} MiB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""
+Per-call overhead of AutoSync generated sync wrappers.
+
+Compares starting a fresh `trio.run` for every call (the previous behavior)
+with submitting to the persistent background loop.
+
+    $ python benchmarks/bench_autosync.py
+"""
+import timeit
+
+import trio
+
+from zarr3 import MemoryStoreV3
+from zarr3.utils import nested_run
+
+
+def main(n=5000):
+    store = MemoryStoreV3()
+    store.set("data/a", bytes(1024))
+
+    def fresh_run():
+        with nested_run():
+            return trio.run(store.async_get, "data/a")
+
+    def background():
+        return store.get("data/a")
+
+    for name, fn in [("trio.run per call", fresh_run), ("background loop", background)]:
+        fn()
+        t = min(timeit.repeat(fn, number=n, repeat=3)) / n
+        print(f"{name:20} {t * 1e6:8.1f} us/call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Write and read uncompressed 8MiB chunks through the v3 store API, copying
+them to `bytes` first (previous behavior) vs handing the NumPy array over as
+is and reading back with `get_buffer`.
+
+`MemoryStoreV3` keeps the values it is given, so it still copies an array
+(see `zarr3.utils.frozen`); `V3DirectoryStore` writes the array's buffer
+without the intermediate copy.
+
+    $ python benchmarks/bench_buffers.py
+"""
+import tempfile
+import time
+
+import numpy as np
+
+from zarr3 import MemoryStoreV3, V3DirectoryStore
+
+
+def bench(label, n, fn):
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn()
+    dt = (time.perf_counter() - t0) / n
+    print(f"{label:40} {dt * 1e3:8.2f} ms/chunk")
+
+
+def main():
+    chunk = np.random.default_rng(0).standard_normal(2 ** 20)  # 8MiB
+    key = "data/root/a/c0"
+
+    with tempfile.TemporaryDirectory() as root:
+        for name, store in [
+            ("memory", MemoryStoreV3()),
+            ("directory", V3DirectoryStore(root)),
+        ]:
+            cases = [
+                ("set(chunk.tobytes())", lambda: store.set(key, chunk.tobytes())),
+                ("set(chunk)", lambda: store.set(key, chunk)),
+                ("frombuffer(get())", lambda: np.frombuffer(store.get(key))),
+                (
+                    "frombuffer(get_buffer())",
+                    lambda: np.frombuffer(store.get_buffer(key)),
+                ),
+            ]
+            for label, fn in cases:
+                bench(f"{name} {label}", 50, fn)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Read a compressed array from a V3DirectoryStore one chunk at a time (I/O and
+decompression serialised) vs with the concurrent codec pipeline (I/O in
+store threads overlapped with decompression in codec threads).
+
+    $ python benchmarks/bench_codecs.py [--root PATH]
+"""
+import argparse
+import functools
+import tempfile
+import time
+
+import numpy as np
+
+from zarr3 import ZarrProtocolV3, V3DirectoryStore
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root", default=None)
+    args = parser.parse_args()
+
+    shape, chunks = (4096, 4096), (64, 256)  # 4096 chunks of 128KiB
+    data = np.random.default_rng(0).standard_normal(shape).round(2)
+    with tempfile.TemporaryDirectory(dir=args.root) as root:
+        protocol = ZarrProtocolV3(functools.partial(V3DirectoryStore, root))
+        for compressor in [None, {"id": "zstd", "level": 3}, {"id": "blosc"}]:
+            name = compressor["id"] if compressor else "none"
+            protocol.create_array(
+                name, shape=shape, chunk_shape=chunks, compressor=compressor
+            )
+            protocol.write_array(name, data)
+            for limit in [1, 64]:
+                t0 = time.perf_counter()
+                res = protocol.read_array(name, limit=limit)
+                dt = time.perf_counter() - t0
+                assert (res == data).all()
+                print(
+                    f"{name:6} chunks in flight={limit:3} "
+                    f"{data.nbytes / dt / 2 ** 20:8.1f} MiB/s"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Read throughput of V3DirectoryStore with 1, 8 and 64 concurrent readers,
+with file I/O in worker threads vs blocking the event loop.
+
+Numbers on a warm page cache mostly measure overhead; point `--root` at a
+cold disk or a network filesystem to see the overlap.
+
+    $ python benchmarks/bench_directory_io.py [--root PATH]
+"""
+import argparse
+import tempfile
+import time
+
+import trio
+
+from zarr3 import V3DirectoryStore
+
+
+class BlockingDirectoryStore(V3DirectoryStore):
+    """previous behavior: read inline in the event loop."""
+
+    async def _get(self, key):
+        return self._read(key)
+
+
+async def read_all(store, keys, readers):
+    await store.async_get_many(keys, limit=readers)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root", default=None)
+    parser.add_argument("--n", type=int, default=512)
+    parser.add_argument("--size", type=int, default=256 * 1024)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.root) as root:
+        keys = [f"data/root/a/c{i}" for i in range(args.n)]
+        V3DirectoryStore(root).set_many({k: bytes(args.size) for k in keys})
+        total = args.n * args.size / 2 ** 20
+        for klass in [BlockingDirectoryStore, V3DirectoryStore]:
+            store = klass(root, io_threads=64)
+            for readers in [1, 8, 64]:
+                t0 = time.perf_counter()
+                trio.run(read_all, store, keys, readers)
+                dt = time.perf_counter() - t0
+                print(
+                    f"{klass.__name__:24} readers={readers:3} {total / dt:9.1f} MiB/s"
+                )
+
+
+if __name__ == "__main__":
+    main()
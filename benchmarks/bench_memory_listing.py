@@ -0,0 +1,45 @@
+"""
+Prefix and directory listing on a MemoryStoreV3 holding 1e6 chunk keys,
+using the sorted key index vs a linear scan of every key.
+
+    $ python benchmarks/bench_memory_listing.py
+"""
+import timeit
+
+from zarr3 import MemoryStoreV3
+
+
+def scan_prefix(store, prefix):
+    return [k for k in store._backend.keys() if k.startswith(prefix)]
+
+
+def scan_dir(store, prefix):
+    trail = {k[len(prefix) :].split("/", 1)[0] for k in scan_prefix(store, prefix)}
+    return [prefix + k for k in trail]
+
+
+def main(n_arrays=1000, n_chunks=1000):
+    store = MemoryStoreV3()
+    store.set_many(
+        {
+            f"data/root/a{i}/c{j}/0": b""
+            for i in range(n_arrays)
+            for j in range(n_chunks)
+        }
+    )
+    prefix = "data/root/a500/"
+    cases = [
+        ("list_prefix", lambda: store.list_prefix(prefix), lambda: scan_prefix(store, prefix)),
+        ("list_dir", lambda: store.list_dir(prefix), lambda: scan_dir(store, prefix)),
+        ("list_dir root", lambda: store.list_dir("data/root/"), lambda: scan_dir(store, "data/root/")),
+    ]
+    print(f"{n_arrays * n_chunks} keys")
+    for name, indexed, scan in cases:
+        assert sorted(indexed()) == sorted(scan())
+        ti = min(timeit.repeat(indexed, number=5, repeat=3)) / 5
+        ts = min(timeit.repeat(scan, number=1, repeat=3))
+        print(f"{name:15} index {ti * 1e3:9.2f} ms   scan {ts * 1e3:9.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+Read one row out of each 8MiB uncompressed chunk of an array stored in a
+V3DirectoryStore, with chunk files read whole vs memory-mapped.
+
+    $ python benchmarks/bench_mmap.py [--root PATH]
+"""
+import argparse
+import functools
+import tempfile
+import time
+
+import numpy as np
+
+from zarr3 import ZarrProtocolV3, V3DirectoryStore
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root", default=None)
+    args = parser.parse_args()
+
+    shape, chunks = (4096, 4096), (1024, 1024)  # 16 chunks of 8MiB
+    data = np.random.default_rng(0).standard_normal(shape)
+    with tempfile.TemporaryDirectory(dir=args.root) as root:
+        for use_mmap in [False, True]:
+            protocol = ZarrProtocolV3(
+                functools.partial(V3DirectoryStore, root, use_mmap=use_mmap)
+            )
+            if not use_mmap:
+                protocol.create_array("a", shape=shape, chunk_shape=chunks)
+                protocol.write_array("a", data)
+            t0 = time.perf_counter()
+            for _ in range(10):
+                res = protocol.read_array("a", (slice(None), 17))
+            dt = (time.perf_counter() - t0) / 10
+            assert (res == data[:, 17]).all()
+            print(f"use_mmap={use_mmap!s:5} column read {dt * 1e3:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Scan a zarr v2 array row block by row block through V2from3Adapter, on a
+store with a simulated round trip latency, with and without read-ahead.
+
+    $ python benchmarks/bench_prefetch.py [--latency MS] [--window N]
+"""
+import argparse
+import time
+
+import numpy as np
+import trio
+import zarr
+
+from zarr3 import MemoryStoreV3, V2from3Adapter
+from zarr3.prefetch import PrefetchingStoreV3
+
+
+class LatencyStore(MemoryStoreV3):
+    latency = 0.002
+
+    async def _get(self, key):
+        await trio.sleep(self.latency)
+        return await super()._get(key)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=2.0)
+    parser.add_argument("--window", type=int, default=16)
+    args = parser.parse_args()
+    LatencyStore.latency = args.latency / 1e3
+
+    backend = LatencyStore()
+    shape, chunks = (2048, 1024), (64, 256)  # 32 x 4 chunks of 128KiB
+    data = np.random.default_rng(0).standard_normal(shape)
+    z = zarr.open_array(
+        V2from3Adapter(backend), mode="w", shape=shape, chunks=chunks
+    )
+    z[:] = data
+
+    for name, store in [
+        ("direct", backend),
+        (f"read-ahead window={args.window}", PrefetchingStoreV3(backend, args.window)),
+    ]:
+        if isinstance(store, PrefetchingStoreV3):
+            store.start_background_prefetcher()
+        z = zarr.open_array(V2from3Adapter(store), mode="r")
+        t0 = time.perf_counter()
+        for start in range(0, shape[0], chunks[0]):
+            block = z[start : start + chunks[0]]
+        dt = time.perf_counter() - t0
+        assert (block == data[-chunks[0] :]).all()
+        n_chunks = np.prod([s // c for s, c in zip(shape, chunks)])
+        print(
+            f"{name:24} {dt * 1e3:8.1f} ms  {dt / n_chunks * 1e3:6.2f} ms/chunk "
+            f"({args.latency} ms latency)"
+        )
+        if isinstance(store, PrefetchingStoreV3):
+            print(" " * 24, store.prefetch_stats())
+
+
+if __name__ == "__main__":
+    main()
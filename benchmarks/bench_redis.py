@@ -0,0 +1,101 @@
+"""
+RedisStore throughput for 1KB and 1MB values, with concurrent single-key
+operations pipelined over the connection pool vs one connection context per
+command (the previous behavior).
+
+Against a running server, by default on localhost:
+
+    $ redis-server &
+    $ python benchmarks/bench_redis.py [--url redis://localhost/]
+
+or in process, against the fake server of the test suite, which answers
+each round trip after 10ms over at most `pool_size` connections; this
+measures how many round trips are saved:
+
+    $ python benchmarks/bench_redis.py --in-process
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import trio
+
+from zarr3 import RedisStore, _RedisPipeline
+from zarr3.utils import map_concurrently
+
+
+class UnpipelinedRedisStore(RedisStore):
+    async def _get(self, key):
+        return await self._backend().get(key)
+
+    async def _set(self, key, value):
+        return await self._backend().set(key, value)
+
+
+def in_process(klass):
+    sys.path.insert(0, str(Path(__file__).parent.parent / "tests"))
+    from test_redis import FakeDB, FakeRedis
+
+    class PooledDB(FakeDB):
+        async def _run(self):
+            async with self.server.pool:
+                return await super()._run()
+
+    class PooledRedis(FakeRedis):
+        # at most `pool_size` connections, as with redio's pool.
+        def __init__(self, pool_size):
+            super().__init__()
+            self.pool = trio.Semaphore(pool_size)
+
+        def __call__(self):
+            return PooledDB(self)
+
+    class InProcess(klass):
+        def _connect(self):
+            self._backend = PooledRedis(self.pool_size)
+            self._pipeline = _RedisPipeline(self._backend, self.pool_size)
+
+    InProcess.__name__ = klass.__name__
+    return InProcess
+
+
+async def run(store, n, size, concurrency):
+    await store.async_initialize()
+    value = bytes(size)
+    keys = [f"data/root/a/c{i}" for i in range(n)]
+
+    async def set_one(key):
+        await store._set(key, value)
+
+    t0 = time.perf_counter()
+    await map_concurrently(set_one, keys, concurrency)
+    t_set = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    await map_concurrently(store._get, keys, concurrency)
+    t_get = time.perf_counter() - t0
+    return n / t_set, n / t_get
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="redis://localhost/")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--in-process", action="store_true")
+    args = parser.parse_args()
+
+    for size, n in [(1024, 20000), (2 ** 20, 200)]:
+        for klass in [UnpipelinedRedisStore, RedisStore]:
+            if args.in_process:
+                klass = in_process(klass)
+            store = klass(args.url)
+            sets, gets = trio.run(run, store, n, size, args.concurrency)
+            print(
+                f"{klass.__name__:22} {size:8} B  "
+                f"set {sets:9.0f} ops/s  get {gets:9.0f} ops/s"
+            )
+
+
+if __name__ == "__main__":
+    main()
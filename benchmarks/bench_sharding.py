@@ -0,0 +1,47 @@
+"""
+Write and read an array of 64x64 small chunks in a V3DirectoryStore, one
+file per chunk vs shards of 16x16 chunks.
+
+    $ python benchmarks/bench_sharding.py [--root PATH]
+"""
+import argparse
+import functools
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from zarr3 import ZarrProtocolV3, V3DirectoryStore
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root", default=None)
+    args = parser.parse_args()
+
+    shape, chunks = (2048, 2048), (32, 32)  # 4096 chunks of 8KiB
+    data = np.random.default_rng(0).standard_normal(shape)
+    for shards in [None, (16, 16)]:
+        with tempfile.TemporaryDirectory(dir=args.root) as root:
+            protocol = ZarrProtocolV3(
+                functools.partial(V3DirectoryStore, root, use_mmap=True)
+            )
+            protocol.create_array(
+                "a", shape=shape, chunk_shape=chunks, chunks_per_shard=shards
+            )
+            t0 = time.perf_counter()
+            protocol.write_array("a", data)
+            t1 = time.perf_counter()
+            protocol.clear_shard_index_cache()
+            assert (protocol.read_array("a") == data).all()
+            t2 = time.perf_counter()
+            files = sum(len(f) for _, _, f in os.walk(os.path.join(root, "data")))
+            print(
+                f"chunks_per_shard={shards!s:9} files={files:5} "
+                f"write {t1 - t0:6.3f}s read {t2 - t1:6.3f}s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import numpy as np
+import pytest
+
+from zarr3 import ZarrProtocolV3
+from zarr3.indexing import normalize_selection, chunk_selections
+
+
+SELECTIONS = [
+    Ellipsis,
+    (slice(None),),
+    (3, slice(2, 9)),
+    (slice(1, 10, 3), slice(None, None, 4)),
+    (slice(0, 7), -1),
+    (slice(2, 2),),
+    (4, 5),
+]
+
+
+def test_chunk_selections_cover_selection():
+    ranges, dropped = normalize_selection((slice(1, 10, 3), 4), (11, 7))
+    assert dropped == {1}
+    touched = list(chunk_selections(ranges, (4, 3)))
+    assert [coords for coords, _, _ in touched] == [(0, 1), (1, 1)]
+    assert touched[0][1] == (slice(1, 2, 3), slice(1, 2, 1))
+
+    with pytest.raises(IndexError):
+        normalize_selection((slice(None, None, -1),), (3,))
+    with pytest.raises(IndexError):
+        normalize_selection((0, 0, 0), (3, 3))
+
+
+@pytest.mark.parametrize("selection", SELECTIONS)
+async def test_read_write_roundtrip(selection):
+    protocol = ZarrProtocolV3()
+    await protocol.async_create_array(
+        "g1/arr", shape=(11, 7), dtype="<i4", chunk_shape=(4, 3), fill_value=-1
+    )
+    expected = np.full((11, 7), -1, dtype="<i4")
+    np.testing.assert_array_equal(await protocol.async_read_array("g1/arr"), expected)
+
+    value = np.arange(expected[selection].size).reshape(expected[selection].shape)
+    expected[selection] = value
+    await protocol.async_write_array("g1/arr", value, selection)
+    np.testing.assert_array_equal(await protocol.async_read_array("g1/arr"), expected)
+    np.testing.assert_array_equal(
+        protocol.read_array("g1/arr", selection), expected[selection]
+    )
+
+    # edge chunks are stored padded to the full chunk shape.
+    data = protocol._store.get_many(protocol._store.list_prefix("data/root/g1/arr/"))
+    assert {len(v) for v in data.values()} <= {4 * 3 * 4}
+
+
+async def test_write_broadcast_and_nan_fill():
+    protocol = ZarrProtocolV3()
+    await protocol.async_create_array("a", shape=(5, 5), chunk_shape=(2, 2))
+    await protocol.async_write_array("a", 1.5, (slice(0, 2), slice(None)))
+    assert protocol._store.list_prefix("data/root/a/c0/") == [
+        "data/root/a/c0/0",
+        "data/root/a/c0/1",
+        "data/root/a/c0/2",
+    ]
+    res = await protocol.async_read_array("a", (slice(1, 3), 0))
+    assert res[0] == 1.5 and np.isnan(res[1])
+
+
+@pytest.mark.parametrize(
+    "compressor",
+    [None, {"id": "gzip", "level": 1}, {"id": "zstd", "level": 1}, {"id": "blosc"}],
+)
+async def test_compressed_roundtrip(compressor):
+    protocol = ZarrProtocolV3()
+    metadata = await protocol.async_create_array(
+        "a",
+        shape=(20, 20),
+        dtype="<i8",
+        chunk_shape=(8, 8),
+        fill_value=0,
+        compressor=compressor,
+    )
+    data = np.arange(400).reshape(20, 20)
+    await protocol.async_write_array("a", data)
+    await protocol.async_write_array("a", -1, (slice(3, 5), slice(7, 9)))
+    data[3:5, 7:9] = -1
+    np.testing.assert_array_equal(await protocol.async_read_array("a"), data)
+
+    stored = protocol._store.get("data/root/a/c0/0")
+    if compressor is None:
+        assert metadata["compressor"]["codec"] == "https://none"
+        assert len(stored) == 8 * 8 * 8
+    else:
+        assert metadata["compressor"]["codec"].endswith(f"/{compressor['id']}/1.0")
+        assert len(stored) < 8 * 8 * 8
+
+
+@pytest.mark.parametrize("compressor", [None, {"id": "zlib", "level": 1}])
+def test_sharded_roundtrip(compressor):
+    from zarr3.sharding import MISSING, decode_index
+
+    protocol = ZarrProtocolV3()
+    protocol.create_array(
+        "s",
+        shape=(10, 9),
+        chunk_shape=(2, 3),
+        dtype="<i4",
+        fill_value=-1,
+        compressor=compressor,
+        chunks_per_shard=(2, 2),
+    )
+    data = np.arange(90, dtype="<i4").reshape(10, 9)
+    protocol.write_array("s", data[:4], (slice(0, 4),))
+    keys = protocol._store.list_prefix("data/")
+    # 2 shard rows, 2 shard columns (the second one half full).
+    assert sorted(keys) == ["data/root/s/c0/0", "data/root/s/c0/1"]
+
+    expected = np.full((10, 9), -1, dtype="<i4")
+    expected[:4] = data[:4]
+    assert (protocol.read_array("s") == expected).all()
+
+    # partial update of a shard keeps the other chunks.
+    protocol.write_array("s", 100, (slice(1, 3), slice(2, 5)))
+    expected[1:3, 2:5] = 100
+    protocol.clear_shard_index_cache()
+    assert (protocol.read_array("s") == expected).all()
+    res = protocol.read_array("s", (3, slice(None, None, 2)))
+    assert (res == expected[3, ::2]).all()
+
+    index = decode_index(protocol._store.get("data/root/s/c0/1"), 4)
+    # chunk (0, 3) is outside the array.
+    assert index[1].tolist() == [MISSING, MISSING]
+
+
+def test_uncompressed_partial_reads():
+    from zarr3 import MemoryStoreV3
+
+    class CountingStore(MemoryStoreV3):
+        transferred = 0
+
+        async def _get_range(self, key, offset, length):
+            data = await super()._get_range(key, offset, length)
+            CountingStore.transferred += len(data)
+            return data
+
+    protocol = ZarrProtocolV3(CountingStore)
+    protocol.create_array("a", shape=(100, 100), chunk_shape=(50, 50), dtype="<f8")
+    data = np.arange(100 * 100, dtype="<f8").reshape(100, 100)
+    protocol.write_array("a", data)
+    assert (protocol.read_array("a", (slice(10, 12),)) == data[10:12]).all()
+    # two rows of two chunks, instead of two whole chunks.
+    assert CountingStore.transferred == 2 * (50 + 50) * 8
+    CountingStore.transferred = 0
+    assert (protocol.read_array("a", (slice(None), 3)) == data[:, 3]).all()
+    assert CountingStore.transferred == 2 * (49 * 50 + 1) * 8
+
+
+def test_stored_chunks_do_not_alias_the_source():
+    protocol = ZarrProtocolV3()
+    protocol.create_array("a", shape=(4, 4), chunk_shape=(4, 4), dtype="<i8")
+    data = np.arange(16, dtype="<i8").reshape(4, 4)
+    protocol.write_array("a", data)
+    data[:] = 0
+    np.testing.assert_array_equal(
+        protocol.read_array("a"), np.arange(16).reshape(4, 4)
+    )
+
+
+@pytest.mark.parametrize("chunks_per_shard", [None, (2, 1)])
+def test_fill_chunks_are_elided(chunks_per_shard):
+    protocol = ZarrProtocolV3()
+    protocol.create_array(
+        "a",
+        shape=(8, 4),
+        chunk_shape=(2, 4),
+        dtype="<f4",
+        chunks_per_shard=chunks_per_shard,
+    )
+    data = np.full((8, 4), np.nan, dtype="<f4")
+    data[2:4] = 1
+    protocol.write_array("a", data)
+    assert protocol.elided_chunks == 3
+    # the second chunk, alone in its shard when sharded.
+    assert len(protocol._store.list_prefix("data/")) == 1
+    np.testing.assert_array_equal(protocol.read_array("a"), data)
+    assert protocol.filled_chunks == 3
+
+    # overwriting a stored chunk with the fill value deletes it.
+    protocol.write_array("a", np.nan, (slice(2, 4),))
+    assert protocol._store.list_prefix("data/") == []
+    assert np.isnan(protocol.read_array("a")).all()
+
+    protocol.write_empty_chunks = True
+    protocol.write_array("a", np.nan)
+    n_keys = 4 if chunks_per_shard is None else 2
+    assert len(protocol._store.list_prefix("data/")) == n_keys
@@ -0,0 +1,63 @@
+import trio
+
+from zarr3 import MemoryStoreV3
+from zarr3.caching import CachingStoreV3
+
+
+class CountingStore(MemoryStoreV3):
+    def __init__(self):
+        super().__init__()
+        self.gets = 0
+
+    async def _get(self, key):
+        self.gets += 1
+        return await super()._get(key)
+
+
+async def test_cache_hits_and_invalidation():
+    backend = CountingStore()
+    store = CachingStoreV3(backend, max_bytes=25, max_meta_bytes=100)
+    await store.async_set("meta/root/a.array", b"{}")
+    for i in range(4):
+        await store.async_set(f"data/root/a/c{i}", bytes(10))
+
+    # write-through populated the cache; only the last two chunks fit.
+    assert await store.async_get("meta/root/a.array") == b"{}"
+    assert await store.async_get("data/root/a/c3") == bytes(10)
+    assert backend.gets == 0
+    stats = store.cache_stats()
+    assert stats["data"]["evictions"] == 2
+    assert stats["data"]["bytes"] == 20
+    assert stats["meta"]["bytes"] == 2
+
+    # chunk scans do not evict metadata.
+    await store.async_get_many([f"data/root/a/c{i}" for i in range(4)])
+    assert store.cache_stats()["meta"]["entries"] == 1
+
+    await store.async_set("data/root/a/c3", b"new")
+    assert await store.async_get("data/root/a/c3") == b"new"
+    await store.async_delete("data/root/a/c3")
+    assert store.cache_stats()["data"]["entries"] == 2
+    assert store.list_prefix("data/root/a/") == [
+        "data/root/a/c0",
+        "data/root/a/c1",
+        "data/root/a/c2",
+    ]
+
+
+async def test_concurrent_write_is_not_overwritten_by_stale_read():
+    class SlowStore(MemoryStoreV3):
+        async def _get(self, key):
+            value = await super()._get(key)
+            await trio.sleep(0.01)
+            return value
+
+    store = CachingStoreV3(SlowStore())
+    await store.async_set("data/a", b"old")
+    store.clear_cache()
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(store.async_get, "data/a")
+        await trio.sleep(0)
+        await store.async_set("data/a", b"new")
+    assert await store.async_get("data/a") == b"new"
@@ -0,0 +1,93 @@
+import pytest
+
+from zarr3 import MemoryStoreV3, V3DirectoryStore
+from zarr3.dedupe import DedupeStoreV3, DEDUPE_PREFIX
+
+
+@pytest.fixture(params=["memory", "directory"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return MemoryStoreV3()
+    return V3DirectoryStore(str(tmp_path))
+
+
+async def test_identical_chunks_are_stored_once(backend):
+    store = DedupeStoreV3(backend)
+    mask, other = bytes(1000), b"x" * 1000
+    for i in range(4):
+        await store.async_set(f"data/root/a/c{i}", mask)
+    await store.async_set("data/root/a/c4", other)
+    await store.async_set("data/root/a/small", b"tiny")
+    await store.async_set("meta/root/a.array", b"{}")
+
+    assert store.duplicates == 3
+    assert store.bytes_saved == 3000
+    blobs = backend.list_prefix(DEDUPE_PREFIX + "blobs/")
+    assert len(blobs) == 2
+    assert backend.get("data/root/a/small") == b"tiny"
+    assert DEDUPE_PREFIX not in "".join(store.list())
+    assert sorted(store.list_dir("data/")) == ["data/root"]
+    assert len(store.list_prefix("data/root/a/")) == 6
+
+    assert await store.async_get("data/root/a/c2") == mask
+    assert bytes(await store.async_get_buffer("data/root/a/c4")) == other
+    assert bytes(await store.async_get_range("data/root/a/c1", 10, 5)) == bytes(5)
+    assert await store.async_get_many(
+        ["data/root/a/c0", "data/root/a/c4", "data/root/a/small", "data/missing"]
+    ) == {"data/root/a/c0": mask, "data/root/a/c4": other, "data/root/a/small": b"tiny"}
+
+    # overwrites and deletes release the references.
+    await store.async_set("data/root/a/c0", other)
+    for i in range(1, 4):
+        await store.async_delete(f"data/root/a/c{i}")
+    assert backend.list_prefix(DEDUPE_PREFIX + "blobs/") == [
+        DEDUPE_PREFIX + "blobs/" + store._digest_of(backend.get("data/root/a/c0"))
+    ]
+    await store.async_delete("data/root/a/c0")
+    await store.async_delete("data/root/a/c4")
+    assert backend.list_prefix(DEDUPE_PREFIX) == []
+    with pytest.raises(KeyError):
+        await store.async_delete("data/root/a/c0")
+
+
+async def test_reference_counts_are_persisted():
+    backend = MemoryStoreV3()
+    store = DedupeStoreV3(backend)
+    await store.async_set_many({f"data/c{i}": bytes(200) for i in range(10)})
+    assert len(backend.list_prefix(DEDUPE_PREFIX + "blobs/")) == 1
+
+    # a new wrapper reads the counts back from the store.
+    store = DedupeStoreV3(backend)
+    await store.async_delete_many([f"data/c{i}" for i in range(9)])
+    assert len(backend.list_prefix(DEDUPE_PREFIX + "blobs/")) == 1
+    await store.async_delete("data/c9")
+    assert backend.list_prefix(DEDUPE_PREFIX) == []
+
+
+async def test_plain_values_are_never_read_as_references():
+    from zarr3.dedupe import _MAGIC
+
+    backend = MemoryStoreV3()
+    store = DedupeStoreV3(backend)
+    await store.async_set("data/c0", b"x" * 200)
+    reference = backend.get("data/c0")
+    # a small chunk with the exact content of a reference, and a longer one.
+    await store.async_set("data/c1", reference)
+    await store.async_set("data/c2", _MAGIC + b"\x00" * 10)
+    assert await store.async_get("data/c1") == reference
+    assert bytes(await store.async_get_buffer("data/c1")) == reference
+    assert bytes(await store.async_get_range("data/c1", 2, 3)) == reference[2:5]
+    assert await store.async_get_many(["data/c1", "data/c2"]) == {
+        "data/c1": reference,
+        "data/c2": _MAGIC + b"\x00" * 10,
+    }
+    await store.async_delete("data/c1")
+    assert await store.async_get("data/c0") == b"x" * 200
+
+
+async def test_dedupe_keys_are_reserved():
+    store = DedupeStoreV3(MemoryStoreV3())
+    with pytest.raises(AssertionError):
+        await store.async_set(DEDUPE_PREFIX + "blobs/x", b"spam")
+    with pytest.raises(AssertionError):
+        await store.async_get(DEDUPE_PREFIX + "refs/x")
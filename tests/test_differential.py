@@ -0,0 +1,89 @@
+import pytest
+
+from zarr3 import MemoryStoreV3
+from zarr3.differential import AsyncStoreComparer
+
+
+class CorruptStore(MemoryStoreV3):
+    async def _get(self, key):
+        value = await super()._get(key)
+        return value[::-1] if key.startswith("data/") else value
+
+
+def populate(store):
+    store.set_many({f"data/root/a/c{i}": bytes([i, 0]) for i in range(100)})
+    store.set("meta/root/a.array", b'{"shape": [100]}')
+
+
+def test_comparer_agrees():
+    comparer = AsyncStoreComparer(MemoryStoreV3(), MemoryStoreV3())
+    populate(comparer)
+    assert comparer.get("data/root/a/c3") == bytes([3, 0])
+    assert len(comparer.get_many([f"data/root/a/c{i}" for i in range(5)])) == 5
+    with pytest.raises(KeyError):
+        comparer.get("data/root/a/c100")
+    assert comparer.contains("meta/root/a.array")
+    assert comparer.count() == 101
+    assert len(comparer.list_prefix("data/")) == 100
+    assert comparer.delete_many(["data/root/a/c0", "data/root/a/c100"]) == [
+        "data/root/a/c100"
+    ]
+
+    latency = comparer.latency()
+    assert latency["get"]["data"]["reference"]["count"] == 2
+    assert latency["get"]["data"]["tested"]["count"] == 2
+    assert "ratio" in latency["set_many"]["data"]
+
+
+def test_comparer_detects_differences():
+    comparer = AsyncStoreComparer(MemoryStoreV3(), CorruptStore())
+    populate(comparer)
+    with pytest.raises(AssertionError):
+        comparer.get("data/root/a/c1")
+    assert comparer.get("meta/root/a.array")
+
+    comparer.tested.delete("data/root/a/c7")
+    comparer.reference.delete("data/root/a/c8")
+    assert comparer.compare_listing("data/") == (
+        ["data/root/a/c7"],
+        ["data/root/a/c8"],
+    )
+    with pytest.raises(AssertionError):
+        comparer.list()
+
+
+def test_comparer_sampling():
+    comparer = AsyncStoreComparer(MemoryStoreV3(), CorruptStore(), sample=0.0)
+    populate(comparer)
+    # data keys are not read from the tested store, metadata always is.
+    assert comparer.get("data/root/a/c1") == bytes([1, 0])
+    comparer.tested.set("meta/root/a.array", b'{"shape": [10]}')
+    with pytest.raises(AssertionError):
+        comparer.get("meta/root/a.array")
+
+    comparer = AsyncStoreComparer(MemoryStoreV3(), MemoryStoreV3(), sample=0.25)
+    populate(comparer)
+    keys = [f"data/root/a/c{i}" for i in range(100)]
+    comparer.get_many(keys)
+    assert 0 < comparer.verified < 100
+    assert comparer.verified + comparer.skipped == 100
+    verified = comparer.verified
+    comparer.get_many(keys)
+    assert comparer.verified == 2 * verified
+    # only the sample is recorded as read from the tested store.
+    stats = comparer.tested_stats.snapshot()["ops"]["get_many"]["data"]
+    assert stats["keys"] == 2 * verified
+
+
+def test_comparer_lists_each_store_once():
+    class CountingStore(MemoryStoreV3):
+        listings = 0
+
+        async def async_list_prefix(self, prefix):
+            CountingStore.listings += 1
+            return await super().async_list_prefix(prefix)
+
+    comparer = AsyncStoreComparer(CountingStore(), MemoryStoreV3())
+    populate(comparer)
+    assert len(comparer.list_prefix("data/")) == 100
+    assert CountingStore.listings == 1
@@ -0,0 +1,46 @@
+import pytest
+
+from zarr3 import MemoryStoreV3, StoreInstrumentation
+
+
+async def test_instrumentation_counters():
+    store = MemoryStoreV3()
+    assert store.instrumentation is None
+    store.instrumentation = stats = StoreInstrumentation(recent=3)
+
+    await store.async_set("data/a/0", bytes(10))
+    await store.async_set("data/a/1", bytes(5))
+    await store.async_get("data/a/0")
+    with pytest.raises(KeyError):
+        await store.async_get("data/a/2")
+    await store.async_get_many(["data/a/0", "data/a/1", "data/a/2"])
+    await store.async_delete("data/a/1")
+
+    snap = stats.snapshot()
+    assert snap["ops"]["set"]["data"]["count"] == 2
+    assert snap["ops"]["set"]["data"]["bytes"] == 15
+    assert snap["ops"]["get"]["data"]["count"] == 2
+    assert snap["ops"]["get"]["data"]["errors"] == 1
+    assert snap["ops"]["get_many"]["data"]["keys"] == 3
+    assert snap["ops"]["get_many"]["data"]["bytes"] == 15
+    assert sum(snap["ops"]["get"]["data"]["histogram"].values()) == 2
+    assert [r["op"] for r in snap["recent"]] == ["get", "get_many", "delete"]
+    assert snap["recent"][0]["error"] == "KeyError"
+
+
+def test_chunk_reads_are_sized():
+    import numpy as np
+    from zarr3 import ZarrProtocolV3
+
+    protocol = ZarrProtocolV3(MemoryStoreV3)
+    protocol.create_array("a", shape=(8, 8), chunk_shape=(4, 4), dtype="<f8")
+    protocol.write_array("a", np.ones((8, 8)))
+    protocol._store.instrumentation = stats = StoreInstrumentation()
+    protocol.read_array("a", (slice(0, 2),))
+    protocol._store.get_buffer("data/root/a/c0/0")
+
+    ops = stats.snapshot()["ops"]
+    read = sum(ops[op].get("data", {"bytes": 0})["bytes"] for op in ops)
+    # two rows of two chunks, then a whole chunk.
+    assert read == 2 * (4 + 4) * 8 + 4 * 4 * 8
+    assert ops["get_buffer"]["data"]["bytes"] == 4 * 4 * 8
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+import zarr
+
+from zarr3 import MemoryStoreV3, V2from3Adapter
+from zarr3.migrate import V2_METADATA, migrate
+
+
+def make_v2():
+    source = {}
+    root = zarr.group(store=source)
+    a = root.create_dataset("a", shape=(10, 10), chunks=(3, 3), dtype="i4")
+    a[:] = np.arange(100).reshape(10, 10)
+    a.attrs["spam"] = "ham"
+    root.create_group("g").attrs["eggs"] = 42
+    return source
+
+
+class FailingSource(dict):
+    def __getitem__(self, key):
+        if key == "a/2.2":
+            raise OSError("disk on fire")
+        return super().__getitem__(key)
+
+
+def test_migrate():
+    source = make_v2()
+    target = MemoryStoreV3()
+    report = migrate(source, target, limit=4)
+    assert report.keys + report.metadata == len(source)
+    assert report.bytes == sum(
+        len(v) for k, v in source.items() if not k.endswith(V2_METADATA)
+    )
+
+    root = zarr.open_group(V2from3Adapter(target), mode="r")
+    assert (root["a"][:] == np.arange(100).reshape(10, 10)).all()
+    assert root["a"].attrs["spam"] == "ham"
+    assert root["g"].attrs["eggs"] == 42
+
+
+def test_migrate_resume(tmp_path):
+    source = make_v2()
+    checkpoint = tmp_path / "progress.txt"
+    target = MemoryStoreV3()
+    with pytest.raises(OSError):
+        migrate(FailingSource(source), target, limit=1, checkpoint=checkpoint)
+    done = checkpoint.read_text().split()
+    assert done and "a/2.2" not in done
+    # metadata is written last, the array is not visible yet.
+    assert not target.contains("meta/root/a/.array")
+
+    report = migrate(source, target, checkpoint=checkpoint)
+    assert report.skipped == len(done)
+    assert report.keys + report.metadata + report.skipped == len(source)
+    a = zarr.open_array(V2from3Adapter(target), mode="r", path="a")
+    assert (a[:] == np.arange(100).reshape(10, 10)).all()
@@ -0,0 +1,148 @@
+import pytest
+import trio
+
+from zarr3 import MemoryStoreV3
+from zarr3.prefetch import PrefetchingStoreV3, _Stream, _parse_chunk_key
+
+
+class SlowStore(MemoryStoreV3):
+    def __init__(self):
+        super().__init__()
+        self.gets = []
+
+    async def _get(self, key):
+        self.gets.append(key)
+        await trio.sleep(0.01)
+        return await super()._get(key)
+
+    async def _get_range(self, key, offset, length):
+        await trio.sleep(0.01)
+        return await super()._get_range(key, offset, length)
+
+
+def test_sequential_pattern_detection():
+    assert _parse_chunk_key("data/root/g/a/c1/2") == ("data/root/g/a/c", "/", (1, 2))
+    assert _parse_chunk_key("data/root/a/3.0") == ("data/root/a/", ".", (3, 0))
+    assert _parse_chunk_key("meta/root/a.array") is None
+
+    stream = _Stream((0, 0))
+    stream.step((0, 1))
+    assert stream.sequential
+    assert stream.upcoming(2) == [(0, 2), (0, 3)]
+    stream.step((0, 2))
+    stream.step((1, 0))
+    assert stream.sequential and stream.extents == {1: 3}
+    assert stream.upcoming(4) == [(1, 1), (1, 2), (2, 0), (2, 1)]
+    stream.step((5, 0))
+    assert not stream.sequential
+
+
+async def test_sequential_scan_is_read_ahead(autojump_clock):
+    backend = SlowStore()
+    keys = [f"data/root/a/c{i}/{j}" for i in range(4) for j in range(3)]
+    for key in keys:
+        await backend.async_set(key, key.encode())
+    store = PrefetchingStoreV3(backend, window=4)
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(store.run_prefetcher)
+        start = trio.current_time()
+        for key in keys:
+            assert await store.async_get(key) == key.encode()
+        elapsed = trio.current_time() - start
+        nursery.cancel_scope.cancel()
+
+    stats = store.prefetch_stats()
+    # the first two reads, then the first read past the learned row end.
+    assert stats["misses"] == 3
+    assert stats["hits"] == len(keys) - 3
+    assert elapsed < 0.01 * len(keys) / 2
+    assert stats["buffered_bytes"] == 0
+
+
+async def test_plan_window_and_writes(autojump_clock):
+    backend = SlowStore()
+    keys = [f"data/k{i}" for i in range(10)]
+    await backend.async_set_many({k: bytes(100) for k in keys})
+    store = PrefetchingStoreV3(backend, window=8, max_bytes=250)
+    plan = keys[::-1]
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(store.run_prefetcher)
+        await store.async_set_plan(plan)
+        await trio.sleep(0.05)
+        # one value, then as many as the budget allows at the size of the first.
+        assert store.prefetch_stats()["buffered_bytes"] == 300
+        assert len(backend.gets) == 3
+
+        await store.async_set(plan[0], b"new")
+        assert await store.async_get(plan[0]) == b"new"
+        for key in plan[1:]:
+            assert await store.async_get(key) == bytes(100)
+        nursery.cancel_scope.cancel()
+
+    assert store.prefetch_stats()["misses"] == 1
+    assert backend.gets.count(plan[1]) == 1
+
+
+async def test_keys_being_written_are_not_read_ahead(autojump_clock):
+    class SlowWrites(SlowStore):
+        async def _set(self, key, value):
+            await trio.sleep(0.05)
+            await super()._set(key, value)
+
+    backend = SlowWrites()
+    await backend.async_set_many({"data/a": b"old", "data/b": b"old"})
+    store = PrefetchingStoreV3(backend, window=2)
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(store.run_prefetcher)
+        await store.async_set_plan(["data/a", "data/b"])
+        await store.async_set("data/a", b"new")
+        assert await store.async_get("data/a") == b"new"
+        nursery.cancel_scope.cancel()
+
+
+async def test_ranges_and_failed_fetches(autojump_clock):
+    backend = SlowStore()
+    keys = [f"data/root/s/c{i}" for i in range(4)]
+    await backend.async_set_many({k: k.encode() for k in keys})
+    store = PrefetchingStoreV3(backend, window=2)
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(store.run_prefetcher)
+        await store.async_set_plan(keys + ["data/root/s/c9"])
+        await trio.sleep(0.05)
+        for key in keys:
+            # an index, then a chunk, of each shard.
+            assert bytes(await store.async_get_range(key, 0, 4)) == b"data"
+            assert bytes(await store.async_get_range(key, 5)) == key.encode()[5:]
+        with pytest.raises(KeyError):
+            await store.async_get("data/root/s/c9")
+        nursery.cancel_scope.cancel()
+
+    stats = store.prefetch_stats()
+    # a failed fetch is a miss.
+    assert stats["misses"] == 1
+    assert stats["hits"] == 2 * len(keys)
+    assert backend.gets.count(keys[1]) == 1
+
+
+async def test_cancelled_fetches_fall_back_to_the_store(autojump_clock):
+    backend = SlowStore()
+    keys = [f"data/k{i}" for i in range(3)]
+    await backend.async_set_many({k: k.encode() for k in keys})
+    store = PrefetchingStoreV3(backend, window=2)
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(store.run_prefetcher)
+        await store.async_set_plan(keys)
+        await trio.sleep(0.005)
+        assert store.prefetch_stats()["pending"] == 1
+        nursery.cancel_scope.cancel()
+
+    assert store.prefetch_stats()["pending"] == 0
+    with trio.fail_after(1):
+        for key in keys:
+            assert await store.async_get(key) == key.encode()
+    assert store.prefetch_stats()["misses"] == len(keys)
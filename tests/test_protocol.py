@@ -1,5 +1,6 @@
+import json
 import pytest
-from zarr3 import MemoryStoreV3, ZarrProtocolV3, RedisStore
+from zarr3 import MemoryStoreV3, ZarrProtocolV3, RedisStore, V3DirectoryStore
 
 
 async def test_scenario():
@@ -53,3 +54,434 @@ def test_misc(klass):
             "meta/root.group": b'{\n    "zarr_format": "https://purl.org/zarr/spec/protocol/core/3.0"\n}'
         }
     assert store[".zgroup"] == b'{\n    "zarr_format": 2\n}'
+
+
+@pytest.mark.parametrize("klass", [MemoryStoreV3, V3DirectoryStore])
+async def test_batched(klass, tmp_path):
+    store = klass(tmp_path) if klass is V3DirectoryStore else klass()
+
+    await store.async_set_many({f"data/a/c{i}": bytes([i]) for i in range(10)})
+    keys = [f"data/a/c{i}" for i in range(12)]
+    res = await store.async_get_many(keys, limit=3)
+    assert list(res) == keys[:10]
+    assert res["data/a/c4"] == bytes([4])
+    assert store.get_many(["data/a/c1", "data/a/missing"]) == {"data/a/c1": b"\x01"}
+
+    with pytest.raises(ValueError):
+        await store.async_get_many(["data/a/c1", "arbitrary"])
+
+    assert await store.async_delete_many(["data/a/c1", "data/a/c11"]) == [
+        "data/a/c11"
+    ]
+    assert "data/a/c1" not in await store.async_get_many(keys)
+
+
+async def test_memory_sorted_listing():
+    store = MemoryStoreV3()
+    for key in [
+        "data/root/a/c0/0",
+        "data/root/a/c0/1",
+        "data/root/a/c1/0",
+        "data/root/a.b",
+        "data/root/ab/c0",
+        "data/root/b",
+    ]:
+        await store.async_set(key, b"")
+
+    assert await store.async_list_prefix("data/root/a/") == [
+        "data/root/a/c0/0",
+        "data/root/a/c0/1",
+        "data/root/a/c1/0",
+    ]
+    assert await store.async_list_dir("data/root/") == [
+        "data/root/a.b",
+        "data/root/a",
+        "data/root/ab",
+        "data/root/b",
+    ]
+    await store.async_delete("data/root/a/c1/0")
+    await store.async_delete_many(["data/root/a.b"])
+    assert await store.async_list_dir("data/root/a/") == ["data/root/a/c0"]
+    assert await store.async_list_dir("data/root/") == [
+        "data/root/a",
+        "data/root/ab",
+        "data/root/b",
+    ]
+
+
+async def test_directory_listing(tmp_path):
+    store = V3DirectoryStore(tmp_path)
+    keys = [
+        "data/root/a/c0/0",
+        "data/root/a/c0/1",
+        "data/root/ab/c0",
+        "meta/root/a.array",
+        "meta/root/g1/b.array",
+        "zarr.json",
+    ]
+    for key in keys:
+        await store._set(key, b"")
+    await store.async_delete("data/root/ab/c0")
+    keys.remove("data/root/ab/c0")
+
+    assert sorted(await store.async_list()) == sorted(keys)
+    assert await store.async_list_prefix("meta/root/g1/") == ["meta/root/g1/b.array"]
+    assert await store.async_list_prefix("data/root/a") == [
+        "data/root/a/c0/0",
+        "data/root/a/c0/1",
+    ]
+    assert [k async for k in store.async_iter_prefix("meta/")] == [
+        "meta/root/a.array",
+        "meta/root/g1/b.array",
+    ]
+    assert await store.async_list_dir("data/root/") == ["data/root/a"]
+    assert await store.async_list_dir("meta/root/") == [
+        "meta/root/a.array",
+        "meta/root/g1",
+    ]
+    assert await store.async_list_prefix("data/missing/") == []
+
+
+@pytest.mark.parametrize(
+    "mode, expected", [("strict", [2, 4, 6]), ("once", [2, 3, 5]), ("off", [1, 2, 3])]
+)
+async def test_validation_modes(mode, expected):
+    class CountingStore(MemoryStoreV3):
+        gets = 0
+
+        async def _get(self, key):
+            self.gets += 1
+            return await super()._get(key)
+
+    store = CountingStore()
+    store.validation = mode
+    await store.async_set("meta/root/a.array", b"{}")
+    counts = []
+    for _ in range(2):
+        await store.async_get("meta/root/a.array")
+        counts.append(store.gets)
+    # a write invalidates the cached verification.
+    await store.async_set("meta/root/a.array", b"{}")
+    await store.async_get("meta/root/a.array")
+    counts.append(store.gets)
+    assert counts == expected
+
+    if mode != "off":
+        await store.async_set("meta/root/a.group", b"{}")
+        with pytest.raises(AssertionError):
+            await store.async_get("meta/root/a.array")
+
+
+def test_adapter_compressor_metadata():
+    import zarr
+    import numcodecs
+    from zarr3 import V2from3Adapter
+
+    store = V2from3Adapter(MemoryStoreV3())
+    z = zarr.open_array(
+        store, mode="w", shape=(4,), chunks=(2,), compressor=numcodecs.GZip(2)
+    )
+    z[:] = 1
+    v3 = json.loads(store._v3store.get("meta/root.array").decode())
+    assert v3["compressor"] == {
+        "codec": "https://purl.org/zarr/spec/codec/gzip/1.0",
+        "configuration": {"level": 2},
+    }
+    assert zarr.open_array(store).compressor == numcodecs.GZip(2)
+
+
+def test_consolidated_metadata():
+    import zarr
+    from zarr3 import V2from3Adapter, CONSOLIDATED_KEY
+
+    protocol = ZarrProtocolV3(MemoryStoreV3, consolidated=True)
+    protocol.create_group("g")
+    protocol.create_array("g/a", shape=(4,), chunk_shape=(2,))
+    assert not protocol._store.contains(CONSOLIDATED_KEY)
+    doc = protocol.save_consolidated()
+    assert doc == protocol._store.get_consolidated_metadata()
+    assert doc["zarr_consolidated_format"] == 1
+    assert set(doc["metadata"]) == {
+        "zarr.json",
+        "meta/g.group",
+        "meta/g/a.array",
+    }
+    assert protocol.save_consolidated() is None
+
+    # later updates are applied to the loaded document, the stale stored
+    # copy is removed until they are saved.
+    protocol.create_array("g/b", shape=(4,), chunk_shape=(2,))
+    protocol.create_array("g/c", shape=(4,), chunk_shape=(2,))
+    assert not protocol._store.contains(CONSOLIDATED_KEY)
+    doc = protocol.save_consolidated()
+    assert "meta/g/c.array" in doc["metadata"]
+    assert protocol._store.consolidate_metadata() == doc
+
+    v3store = MemoryStoreV3()
+    z = zarr.open_array(
+        V2from3Adapter(v3store), mode="w", path="a", shape=(4,), chunks=(2,)
+    )
+    z[:] = 1
+    z.attrs["spam"] = "ham"
+
+    class CountingStore(MemoryStoreV3):
+        gets = []
+
+        async def _get(self, key):
+            self.gets.append(key)
+            return await super()._get(key)
+
+    counting = CountingStore()
+    counting._backend = v3store._backend
+    counting._index = v3store._index
+    store = V2from3Adapter(counting, consolidated=True)
+    CountingStore.gets.clear()
+    assert "a/.zarray" in store.keys()
+    a = zarr.open_array(store, mode="r", path="a")
+    assert a.attrs["spam"] == "ham"
+    assert (a[:] == 1).all()
+    assert not [k for k in CountingStore.gets if k.startswith("meta/")]
+
+    a = zarr.open_array(store, mode="r+", path="a")
+    a.attrs["eggs"] = 42
+    assert not v3store.contains(CONSOLIDATED_KEY)
+    store.close()
+    doc = v3store.get_consolidated_metadata()["metadata"]
+    assert doc["meta/root/a/.array"]["attributes"] == {"spam": "ham", "eggs": 42}
+    assert CONSOLIDATED_KEY not in store.keys()
+
+    # the document is not a v2 key, for adapters not using it either.
+    plain = V2from3Adapter(v3store)
+    assert len(plain) == len(list(plain.keys())) == len(store)
+
+
+def test_consolidated_listings_come_from_the_document():
+    import zarr
+    from zarr3 import V2from3Adapter, CONSOLIDATED_KEY
+
+    class CountingStore(MemoryStoreV3):
+        calls = []
+
+        def __getattribute__(self, name):
+            if name in ("count", "contains", "list_prefix", "list_dir"):
+                CountingStore.calls.append(name)
+            return super().__getattribute__(name)
+
+    v3store = CountingStore()
+    g = zarr.open_group(V2from3Adapter(v3store), mode="w")
+    g.create_group("sub").zeros("x", shape=(4,), chunks=(2,))[:] = 1
+    g.zeros("y", shape=(4,), chunks=(2,))[:] = 1
+
+    # opening for reading does not store a document.
+    store = V2from3Adapter(v3store, consolidated=True)
+    assert not v3store.contains(CONSOLIDATED_KEY)
+    CountingStore.calls.clear()
+    assert store.listdir("") == [".zgroup", "sub", "y"]
+    assert store.listdir("sub") == [".zgroup", "x"]
+    assert CountingStore.calls == []
+    assert store.listdir("y") == [".zarray", "0", "1"]
+
+    # chunk keys are listed once, then follow the writes through the adapter.
+    CountingStore.calls.clear()
+    group = zarr.open_group(store, mode="r+")
+    assert sorted(group.keys()) == ["sub", "y"]
+    assert sorted(group["sub"].keys()) == ["x"]
+    assert CountingStore.calls == ["list_prefix"]
+    group["y"].resize(6)
+    group["y"][4:] = 2
+    del store["sub/x/0"]
+    assert "y/2" in store.keys() and "sub/x/0" not in store.keys()
+    assert len(store) == len(store.keys())
+    assert CountingStore.calls.count("list_prefix") == 2
+
+    store.consolidate()
+    assert v3store.contains(CONSOLIDATED_KEY)
+
+
+@pytest.mark.parametrize("store", [MemoryStoreV3, "directory"])
+def test_contains_and_count(store, tmp_path):
+    from zarr3 import V2from3Adapter
+
+    store = V3DirectoryStore(tmp_path) if store == "directory" else store()
+    store.set("data/root/a/0", b"x")
+    store.set("meta/root/a/.array", b"{}")
+    assert store.contains("data/root/a/0")
+    assert not store.contains("data/root/a/1")
+    assert not store.contains("data/root/a")
+    assert store.count() == 2
+
+    adapter = V2from3Adapter(store)
+    assert "a/.zarray" in adapter
+    assert "a/0" in adapter
+    assert "b/.zgroup" not in adapter
+    assert len(adapter) == 2
+
+
+def test_adapter_metadata_cache():
+    import zarr
+    from zarr3 import V2from3Adapter
+
+    class CountingStore(MemoryStoreV3):
+        gets = 0
+
+        async def _get(self, key):
+            if key.startswith("meta/"):
+                CountingStore.gets += 1
+            return await super()._get(key)
+
+    v3store = CountingStore()
+    store = V2from3Adapter(v3store)
+    z = zarr.open_array(store, mode="w", path="a", shape=(4,), chunks=(2,))
+    z.attrs["spam"] = "ham"
+    CountingStore.gets = 0
+    for _ in range(10):
+        a = zarr.open_array(store, mode="r", path="a")
+        assert a.attrs["spam"] == "ham"
+        assert a.shape == (4,)
+    assert CountingStore.gets == 0
+
+    # writes through the adapter invalidate the rendered documents.
+    z.attrs["spam"] = "eggs"
+    assert zarr.open_array(store, mode="r", path="a").attrs["spam"] == "eggs"
+    assert json.loads(store["a/.zattrs"]) == {"spam": "eggs"}
+
+    # keys the store could not hold are simply absent.
+    assert "a/.zarray" in store
+    assert "bad key!" not in store
+    assert "/a/.zarray" not in store
+
+
+@pytest.mark.parametrize("store", [MemoryStoreV3, "directory"])
+def test_buffer_values(store, tmp_path):
+    import numpy as np
+
+    store = V3DirectoryStore(tmp_path) if store == "directory" else store()
+    chunk = np.arange(6, dtype="<f8").reshape(2, 3)
+    store.set("data/root/a/c0", chunk)
+    store.set("data/root/a/c1", bytearray(b"spam"))
+    store.set("data/root/a/c2", memoryview(b"eggs"))
+    store.set_many({"data/root/a/c3": chunk[:, 0]})
+    chunk[:] = -1
+    assert np.frombuffer(store.get("data/root/a/c0")).tolist() == list(range(6))
+    assert store.get("data/root/a/c1") == b"spam"
+    assert store.get("data/root/a/c2") == b"eggs"
+    assert np.frombuffer(store.get("data/root/a/c3")).tolist() == [0, 3]
+
+    view = store.get_buffer("data/root/a/c2")
+    assert isinstance(view, memoryview) and view.readonly
+    assert view == b"eggs"
+    with pytest.raises(TypeError):
+        store.set("data/root/a/c4", "not a buffer")
+
+
+def test_memory_buffer_zero_copy():
+    source = b"x" * 1000
+    store = MemoryStoreV3()
+    store.set("data/root/a/c0", memoryview(source))
+    assert store.get_buffer("data/root/a/c0").obj is source
+
+
+def test_directory_mmap(tmp_path):
+    import mmap
+    import numpy as np
+
+    store = V3DirectoryStore(tmp_path, use_mmap=True)
+    big = np.arange(2 ** 15, dtype="<f8")
+    store.set("data/root/a/c0", big)
+    store.set("data/root/a/c1", b"small")
+
+    request, small = ("data/root/a/c0", 0, None), ("data/root/a/c1", 0, None)
+    found = store.map_ranges([request, small, ("data/root/a/c9", 0, 1)])
+    view = found[request]
+    assert isinstance(view.obj, mmap.mmap) and view.readonly
+    assert (np.frombuffer(view) == big).all()
+    assert not isinstance(found[small].obj, mmap.mmap)
+    assert len(found) == 2
+    # only values used in place are mapped.
+    assert not isinstance(store.get_buffer("data/root/a/c0").obj, mmap.mmap)
+    assert not isinstance(store.get_range("data/root/a/c0", 0).obj, mmap.mmap)
+
+    # rewriting or deleting the key does not affect a live mapping.
+    arr = np.frombuffer(view)
+    store.set("data/root/a/c0", np.zeros(10))
+    assert (arr == big).all()
+    store.delete("data/root/a/c0")
+    assert (arr == big).all()
+    assert store.map_ranges([request]) == {}
+
+    # values being written are not listed.
+    (tmp_path / "data/root/a/c2~0123").write_bytes(b"partial")
+    assert store.list_prefix("data/") == ["data/root/a/c1"]
+
+    protocol = ZarrProtocolV3(lambda: V3DirectoryStore(tmp_path / "p", use_mmap=True))
+    protocol.create_array("x", shape=(300, 300), chunk_shape=(100, 100), dtype="<i8")
+    data = np.arange(300 * 300).reshape(300, 300)
+    protocol.write_array("x", data)
+    assert (protocol.read_array("x", (slice(50, 250), 7)) == data[50:250, 7]).all()
+
+
+@pytest.mark.parametrize("store", [MemoryStoreV3, "directory"])
+def test_get_range(store, tmp_path):
+    store = V3DirectoryStore(tmp_path) if store == "directory" else store()
+    store.set("data/root/a/c0", b"0123456789")
+    assert store.get_range("data/root/a/c0", 2, 3) == b"234"
+    assert store.get_range("data/root/a/c0", 8) == b"89"
+    assert store.get_range("data/root/a/c0", 8, 10) == b"89"
+    assert store.get_range("data/root/a/c0", 20, 1) == b""
+    assert store.get_range("data/root/a/c0", 2, 3).readonly
+    with pytest.raises(KeyError):
+        store.get_range("data/root/a/c1", 0, 1)
+    with pytest.raises(ValueError):
+        store.get_range("data/root/a/c0", -1, 1)
+    ranges = store.get_ranges(
+        [
+            ("data/root/a/c0", 0, 2),
+            ("data/root/a/c0", 5, None),
+            ("data/root/a/c1", 0, 1),
+        ]
+    )
+    assert ranges == {
+        ("data/root/a/c0", 0, 2): b"01",
+        ("data/root/a/c0", 5, None): b"56789",
+    }
+
+
+@pytest.mark.parametrize("dimension_separator", [".", "/"])
+def test_adapter_elides_fill_chunks(dimension_separator):
+    import zarr
+    import numcodecs
+    from zarr3 import V2from3Adapter
+
+    class CountingStore(MemoryStoreV3):
+        gets = 0
+
+        async def _get(self, key):
+            if key.startswith("meta/"):
+                CountingStore.gets += 1
+            return await super()._get(key)
+
+    store = V2from3Adapter(CountingStore(), write_empty_chunks=False)
+    z = zarr.open_array(
+        store,
+        mode="w",
+        path="a",
+        shape=(4, 4),
+        chunks=(2, 2),
+        fill_value=7,
+        compressor=numcodecs.Zlib(1),
+        dimension_separator=dimension_separator,
+        write_empty_chunks=True,
+    )
+    z[:] = 7
+    assert store.elided_chunks == 4
+    # the array of a chunk directory is looked up once, even when missing.
+    CountingStore.gets = 0
+    z[:] = 7
+    assert CountingStore.gets == 0
+    z[0, 0] = 1
+    assert store._v3store.list_prefix("data/") == [
+        f"data/root/a/0{dimension_separator}0"
+    ]
+    z[0, 0] = 7
+    assert store._v3store.list_prefix("data/") == []
+    assert (z[:] == 7).all()
@@ -0,0 +1,158 @@
+from fnmatch import fnmatchcase
+
+import pytest
+import trio
+
+from zarr3 import RedisStore, _RedisPipeline
+
+
+class FakeDB:
+    """Minimal in-process stand-in for a redio connection."""
+
+    def __init__(self, server):
+        self.server = server
+        self.commands = []
+
+    def __getattr__(self, name):
+        # redio's command methods: `db.get(key)`, `db.delete(key)`...
+        command = b"DEL" if name == "delete" else name.upper().encode()
+
+        def queue(*args):
+            self.commands.append((command, *args))
+            return self
+
+        return queue
+
+    def __await__(self):
+        return self._run().__await__()
+
+    async def _run(self):
+        await trio.sleep(0.01)
+        self.server.round_trips += 1
+        replies = []
+        for cmd, *args in self.commands:
+            if cmd == b"SET":
+                # redio checks the "OK" reply and leaves it out.
+                self.server.data[args[0]] = args[1]
+            elif cmd == b"FLUSHDB":
+                self.server.data.clear()
+            elif cmd == b"SCAN":
+                replies.append(self.server.scan(*args))
+            elif cmd == b"EXISTS":
+                replies.append(int(args[0] in self.server.data))
+            elif cmd == b"DBSIZE":
+                replies.append(len(self.server.data))
+            elif cmd == b"GETRANGE":
+                value = self.server.data.get(args[0], b"")
+                start, end = args[1], args[2]
+                replies.append(value[start : None if end == -1 else end + 1])
+            else:
+                replies.append(self.server.data.get(args[0]))
+        return replies if len(replies) != 1 else replies[0]
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+        self.round_trips = 0
+        self.scans = 0
+
+    def __call__(self):
+        return FakeDB(self)
+
+    def scan(self, cursor, _match, pattern, _count, count):
+        self.scans += 1
+        keys = sorted(self.data)
+        start = int(cursor)
+        page = keys[start : start + count]
+        end = start + count
+        cursor = b"0" if end >= len(keys) else str(end).encode()
+        return [cursor, [k.encode() for k in page if fnmatchcase(k, pattern)]]
+
+
+async def test_pipeline_coalesces_concurrent_commands():
+    server = FakeRedis()
+    pipeline = _RedisPipeline(server, connections=1)
+    await pipeline.execute([(b"SET", f"k{i}", i) for i in range(20)])
+    assert server.round_trips == 1
+
+    results = {}
+
+    async def get(i):
+        results[i] = await pipeline.run(b"GET", f"k{i}")
+
+    async with trio.open_nursery() as nursery:
+        for i in range(20):
+            nursery.start_soon(get, i)
+    assert results == {i: i for i in range(20)}
+    assert server.round_trips <= 3
+
+
+async def test_pipeline_times_out_on_hung_connection(autojump_clock):
+    class HungDB(FakeDB):
+        async def _run(self):
+            await trio.sleep_forever()
+
+    server = FakeRedis()
+    pipeline = _RedisPipeline(lambda: HungDB(server), connections=2, timeout=5)
+    errors = []
+
+    async def get():
+        try:
+            await pipeline.run(b"GET", "k")
+        except TimeoutError as e:
+            errors.append(e)
+
+    async with trio.open_nursery() as nursery:
+        # the leader is cancelled, the batch it carries still times out.
+        with trio.move_on_after(1):
+            nursery.start_soon(get)
+            await pipeline.run(b"GET", "k")
+    assert len(errors) == 1
+    assert trio.current_time() == pytest.approx(5)
+
+
+async def test_scan_listing():
+    server = FakeRedis()
+    server.data = {f"data/root/a/c{i}": b"" for i in range(25)}
+    server.data["meta/root/a.array"] = b""
+    store = RedisStore()
+    store._pipeline = _RedisPipeline(server, connections=1)
+    store.scan_count = 10
+
+    assert await store.async_list_prefix("meta/") == ["meta/root/a.array"]
+    assert server.scans == 3
+    assert len(await store.async_list()) == 26
+    assert await store.async_list_dir("data/root/") == ["data/root/a"]
+
+
+async def test_contains_and_count():
+    server = FakeRedis()
+    server.data = {"data/root/a/c0": b"", "meta/root/a.array": b""}
+    store = RedisStore()
+    store._pipeline = _RedisPipeline(server, connections=1)
+    assert await store.async_contains("data/root/a/c0")
+    assert not await store.async_contains("data/root/a/c1")
+    assert await store.async_count() == 2
+    assert server.scans == 0
+
+
+async def test_get_range():
+    server = FakeRedis()
+    server.data = {"data/root/a/c0": b"0123456789"}
+    store = RedisStore()
+    store._pipeline = _RedisPipeline(server, connections=1)
+    assert await store.async_get_range("data/root/a/c0", 2, 3) == b"234"
+    assert await store.async_get_range("data/root/a/c0", 8) == b"89"
+    assert await store.async_get_range("data/root/a/c0", 8, 0) == b""
+    with pytest.raises(KeyError):
+        await store.async_get_range("data/root/a/c1", 0, 1)
+    server.round_trips = 0
+    ranges = await store.async_get_ranges(
+        [("data/root/a/c0", 0, 2), ("data/root/a/c0", 5, 5), ("data/root/a/c1", 0, 1)]
+    )
+    assert ranges == {
+        ("data/root/a/c0", 0, 2): b"01",
+        ("data/root/a/c0", 5, 5): b"56789",
+    }
+    assert server.round_trips == 1
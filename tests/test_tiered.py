@@ -0,0 +1,133 @@
+import pytest
+import trio
+
+from zarr3 import MemoryStoreV3
+from zarr3.tiered import TieredStoreV3
+
+
+async def test_write_behind_and_fallback():
+    fast, slow = MemoryStoreV3(), MemoryStoreV3()
+    store = TieredStoreV3(fast, slow, flush_batch=2)
+    await slow.async_set("data/old", b"old")
+
+    await store.async_set("data/a", b"1")
+    await store.async_set("data/b", b"2")
+    await store.async_set("data/c", b"3")
+    assert await slow.async_list() == ["data/old"]
+    assert store.dirty_bytes == 3
+
+    assert await store.async_get("data/old") == b"old"
+    assert await fast.async_get("data/old") == b"old"
+    await store.async_delete("data/old")
+    with pytest.raises(KeyError):
+        await store.async_get("data/old")
+    with pytest.raises(KeyError):
+        await store.async_delete("data/missing")
+    assert sorted(await store.async_list()) == ["data/a", "data/b", "data/c"]
+
+    await store.async_flush()
+    assert store.dirty_bytes == 0
+    assert sorted(await slow.async_list()) == ["data/a", "data/b", "data/c"]
+
+
+async def test_backpressure_and_flusher():
+    slow = MemoryStoreV3()
+    store = TieredStoreV3(MemoryStoreV3(), slow, max_dirty_bytes=25, flush_interval=0)
+    for i in range(5):
+        await store.async_set(f"data/{i}", bytes(10))
+        assert store.dirty_bytes <= 25
+    assert len(await slow.async_list()) >= 3
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(store.run_flusher)
+        await store.async_set("data/5", bytes(10))
+        with trio.fail_after(1):
+            while store.dirty_bytes:
+                await trio.sleep(0.01)
+        nursery.cancel_scope.cancel()
+    assert len(await slow.async_list()) == 6
+
+
+async def test_flush_is_a_barrier_for_earlier_writes_only():
+    class SlowStore(MemoryStoreV3):
+        async def _set_many(self, mapping, limit):
+            await trio.sleep(0.01)
+            await super()._set_many(mapping, limit)
+
+    slow = SlowStore()
+    store = TieredStoreV3(MemoryStoreV3(), slow, flush_batch=2)
+    for i in range(4):
+        await store.async_set(f"data/{i}", b"x")
+
+    async def writer():
+        i = 4
+        while True:
+            await store.async_set(f"data/{i}", b"x")
+            await store.async_set("data/0", b"y")
+            i += 1
+            await trio.sleep(0.001)
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(writer)
+        with trio.fail_after(1):
+            await store.async_flush()
+        nursery.cancel_scope.cancel()
+    stored = await slow.async_get_many([f"data/{i}" for i in range(4)])
+    assert len(stored) == 4
+    assert store.dirty_bytes > 0
+
+
+def test_sync_and_async_apis_through_protocol():
+    import numpy as np
+    from zarr3 import ZarrProtocolV3
+
+    slow = MemoryStoreV3()
+    # small enough for writes to flush batches themselves, from both loops.
+    protocol = ZarrProtocolV3(
+        lambda: TieredStoreV3(
+            MemoryStoreV3(), slow, max_dirty_bytes=100, flush_interval=3600
+        )
+    )
+    store = protocol._store
+    protocol.create_array("a", shape=(8,), chunk_shape=(2,), dtype="<i8")
+    protocol.write_array("a", np.arange(8))
+
+    async def main():
+        await protocol.async_write_array("a", np.full(4, -1), (slice(0, 4),))
+        expected = [-1, -1, -1, -1, 4, 5, 6, 7]
+        assert (await protocol.async_read_array("a")).tolist() == expected
+        await store.async_flush()
+
+    trio.run(main)
+    protocol.write_array("a", np.full(2, 9), (slice(6, 8),))
+    # the loop which flushed first is gone, this one takes over.
+    store.flush()
+    assert store.dirty_bytes == 0
+    from_slow = ZarrProtocolV3(lambda: slow)
+    assert from_slow.read_array("a").tolist() == [-1, -1, -1, -1, 4, 5, 9, 9]
+
+
+async def test_flushes_are_handed_over_to_the_flushing_loop():
+    slow = MemoryStoreV3()
+    store = TieredStoreV3(MemoryStoreV3(), slow)
+    await store.async_set("data/a", b"1")
+    await store.async_flush()
+    # the sync API runs on the background loop.
+    await trio.to_thread.run_sync(store.set, "data/b", b"2")
+    await trio.to_thread.run_sync(store.flush)
+    assert await slow.async_get("data/b") == b"2"
+
+
+def test_background_flusher_flushes_at_exit():
+    import atexit
+
+    slow = MemoryStoreV3()
+    store = TieredStoreV3(MemoryStoreV3(), slow, flush_interval=3600)
+    store.start_background_flusher()
+    try:
+        store.set("data/a", b"1")
+        assert slow.list() == []
+        store._flush_at_exit()
+        assert slow.get("data/a") == b"1"
+    finally:
+        atexit.unregister(store._flush_at_exit)
@@ -0,0 +1,42 @@
+import threading
+
+import pytest
+
+from zarr3 import MemoryStoreV3
+from zarr3.utils import AutoSync, background_loop
+
+
+class Threaded(AutoSync):
+    async def async_thread(self):
+        return threading.current_thread()
+
+    async def async_nested(self):
+        # sync wrapper called from a coroutine running on the loop thread.
+        return self.thread()
+
+    async def async_kwargs(self, a, b=0):
+        return a - b
+
+
+def test_sync_calls_reuse_background_loop():
+    obj = Threaded()
+    t1 = obj.thread()
+    t2 = obj.thread()
+    assert t1 is t2
+    assert t1 is not threading.current_thread()
+    assert obj.kwargs(3, b=1) == 2
+
+
+def test_sync_call_from_loop_thread():
+    assert Threaded().nested() is background_loop._thread
+
+
+def test_exceptions_propagate_and_restart():
+    store = MemoryStoreV3()
+    with pytest.raises(KeyError):
+        store.get("data/missing")
+    background_loop.shutdown()
+    assert not background_loop.running
+    store.set("data/a", b"1")
+    assert background_loop.running
+    assert store.get("data/a") == b"1"
@@ -5,13 +5,22 @@ Zarr spec v3 draft implementation
 __version__ = "0.0.1"
 
 import os
+import sys
 import json
+import uuid
+from itertools import takewhile
+from collections import OrderedDict
 from collections.abc import MutableMapping
 from string import ascii_letters, digits
 from pathlib import Path
 
-from .utils import AutoSync
+from .utils import AutoSync, as_buffer, frozen, map_concurrently
 from .comparer import StoreComparer
+from .instrumentation import StoreInstrumentation
+from .codecs import get_codec, compressor_from_v2, compressor_to_v2
+
+#: key of the document consolidating all the metadata documents of a hierarchy.
+CONSOLIDATED_KEY = "meta/consolidated.json"
 
 RENAMED_MAP = {
     "dtype": "data_type",
@@ -54,17 +63,24 @@ class BaseV3Store(AutoSync):
         # todo likely more logics to add there.
         return True
 
-    async def async_get(self, key: str):
+    batch_concurrency = 64
+
+    #: How much metadata documents are verified on read and write:
+    #:  - "strict": every read and write (default).
+    #:  - "once": only the first read of a given key, until it (or its
+    #:    `.array`/`.group` sibling) is written or deleted through this store.
+    #:    Writes are still verified.
+    #:  - "off": no content verification, keys and value types are still checked.
+    validation = "strict"
+    #: maximum number of keys remembered as verified in "once" mode.
+    validation_cache_size = 10000
+    #: a `zarr3.instrumentation.StoreInstrumentation`, or None to disable.
+    instrumentation = None
+
+    async def _check_get(self, key: str, result):
         """
-        default implementation of async_get/get that validate the key, a
-        check that the return value by bytes. rely on `async def _get(key)`
-        to be implmented.
-
-        Will ensure that the following are correct:
-            - return group metadata objects are json and contain a signel `attributes` keys.
+        Verify a value just returned by `_get`.
         """
-        assert self._valid_path(key)
-        result = await self._get(key)
         assert isinstance(result, bytes), f"Expected bytes, got {result}"
         if key == "zarr.json":
             v = json.loads(result.decode())
@@ -88,16 +104,10 @@ class BaseV3Store(AutoSync):
                 assert False, f"expecting keyerror, got {res}"
             except KeyError:
                 pass
-        return result
 
-    async def async_set(self, key: str, value: bytes):
+    def _check_set(self, key: str, value):
         """
-        default implementation of async_set/set that validate the key, and
-        check that the return value by bytes. rely on `async def _set(key, value)`
-        to be implmented.
-
-        Will ensure that the following are correct:
-            - set group metadata objects are json and contain a signel `attributes` keys.
+        Verify a value before it is handed to `_set`.
         """
         if key == "zarr.json":
             v = json.loads(value.decode())
@@ -129,10 +139,296 @@ class BaseV3Store(AutoSync):
                 assert set(v.keys()) == {
                     "attributes"
                 }, f"got unexpected keys {v.keys()}"
-        if not isinstance(value, bytes):
-            raise TypeError(f"expected, bytes, or bytesarray, got {type(value)}")
+
+    @staticmethod
+    def _is_metadata(key: str) -> bool:
+        return key == "zarr.json" or key.endswith((".array", ".group"))
+
+    async def _validate_get(self, key: str, result):
+        """
+        Apply the `validation` policy to a value returned by `_get`.
+        """
+        mode = self.validation
+        if mode == "strict":
+            await self._check_get(key, result)
+        elif mode == "once":
+            if not self._is_metadata(key):
+                await self._check_get(key, result)
+                return
+            verified = self.__dict__.setdefault("_verified", OrderedDict())
+            if key in verified:
+                verified.move_to_end(key)
+                return
+            await self._check_get(key, result)
+            verified[key] = None
+            if len(verified) > self.validation_cache_size:
+                verified.popitem(last=False)
+        elif mode == "off":
+            assert isinstance(result, bytes), f"Expected bytes, got {result}"
+        else:
+            raise ValueError(f"unknown validation mode {mode!r}")
+
+    def _validate_set(self, key: str, value):
+        """
+        Apply the `validation` policy to a value before it is handed to `_set`,
+        and return it as `bytes` or a flat byte memoryview (see `as_buffer`).
+
+        Metadata documents are converted to `bytes`, chunks are not copied.
+        """
+        value = as_buffer(value)
+        if self._is_metadata(key) and not isinstance(value, bytes):
+            value = bytes(value)
+        if self.validation != "off":
+            self._check_set(key, value)
+        return value
+
+    def _invalidate(self, keys):
+        """
+        Forget that `keys` and their `.array`/`.group` siblings were verified.
+        """
+        verified = self.__dict__.get("_verified")
+        if not verified:
+            return
+        for key in keys:
+            verified.pop(key, None)
+            if key.endswith(".array"):
+                verified.pop(key[:-6] + ".group", None)
+            elif key.endswith(".group"):
+                verified.pop(key[:-6] + ".array", None)
+
+    async def async_get(self, key: str):
+        """
+        default implementation of async_get/get that validate the key, a
+        check that the return value by bytes. rely on `async def _get(key)`
+        to be implmented.
+
+        Will ensure that the following are correct:
+            - return group metadata objects are json and contain a signel `attributes` keys.
+        """
         assert self._valid_path(key)
-        await self._set(key, value)
+        if self.instrumentation is None:
+            result = await self._get(key)
+        else:
+            result = await self.instrumentation.observe("get", key, self._get(key))
+        await self._validate_get(key, result)
+        return result
+
+    async def async_set(self, key: str, value: bytes):
+        """
+        default implementation of async_set/set that validate the key, and
+        check that the return value by bytes. rely on `async def _set(key, value)`
+        to be implmented.
+
+        `value` can be `bytes` or any contiguous buffer (bytearray,
+        memoryview, NumPy array), which is handed to `_set` without copy; the
+        caller must not modify it until the call returns.
+
+        Will ensure that the following are correct:
+            - set group metadata objects are json and contain a signel `attributes` keys.
+        """
+        value = self._validate_set(key, value)
+        assert self._valid_path(key)
+        if self.instrumentation is None:
+            await self._set(key, value)
+        else:
+            await self.instrumentation.observe(
+                "set", key, self._set(key, value), nbytes=len(value)
+            )
+        self._invalidate([key])
+
+    async def async_get_buffer(self, key: str):
+        """
+        Like `async_get`, but return a read-only memoryview, which backends
+        able to (see `_get_buffer`) serve without copying the stored value.
+        """
+        assert self._valid_path(key)
+        if self.instrumentation is None:
+            result = await self._get_buffer(key)
+        else:
+            result = await self.instrumentation.observe(
+                "get_buffer", key, self._get_buffer(key)
+            )
+        assert isinstance(result, memoryview), f"Expected memoryview, got {result}"
+        if self._is_metadata(key):
+            await self._validate_get(key, bytes(result))
+        return result
+
+    async def _get_buffer(self, key):
+        return memoryview(await self._get(key))
+
+    async def async_get_range(self, key: str, offset: int, length=None):
+        """
+        Return `length` bytes of the value at `key` starting at `offset` (all
+        the remaining bytes if `length` is None) as a read-only memoryview,
+        shorter if the value ends before. Raise KeyError if `key` is missing.
+
+        Rely on `async def _get_range(key, offset, length)`, the default
+        slices the whole value; backends should override it to only
+        transfer the requested bytes.
+        """
+        assert self._valid_path(key)
+        if offset < 0 or (length is not None and length < 0):
+            raise ValueError(f"invalid range {offset}, {length}")
+        coro = self._get_range(key, offset, length)
+        if self.instrumentation is None:
+            return await coro
+        return await self.instrumentation.observe("get_range", key, coro)
+
+    async def _get_range(self, key, offset, length):
+        data = await self._get_buffer(key)
+        return data[offset : None if length is None else offset + length]
+
+    async def async_get_ranges(self, requests, limit=None):
+        """
+        Fetch several `(key, offset, length)` ranges at once, and return a
+        dict mapping each request to its memoryview. Requests on missing keys
+        are left out, as with `async_get_many`.
+
+        Rely on `async def _get_ranges(requests, limit)`, the default issues
+        concurrent `_get_range`.
+        """
+        return await self._ranges("get_ranges", self._get_ranges, requests, limit)
+
+    async def async_map_ranges(self, requests, limit=None):
+        """
+        Same as `async_get_ranges`, for bytes the caller uses as stored,
+        without decoding them (uncompressed chunks). Backends able to map
+        them in memory may return views of the mapping instead of reading.
+
+        Rely on `async def _map_ranges(requests, limit)`, the default is
+        `_get_ranges`.
+        """
+        return await self._ranges("map_ranges", self._map_ranges, requests, limit)
+
+    async def _ranges(self, op, fn, requests, limit):
+        requests = list(dict.fromkeys(tuple(r) for r in requests))
+        for key, offset, length in requests:
+            assert self._valid_path(key)
+            if offset < 0 or (length is not None and length < 0):
+                raise ValueError(f"invalid range {offset}, {length}")
+        coro = fn(requests, limit or self.batch_concurrency)
+        if self.instrumentation is None:
+            return await coro
+        keys = [key for key, _, _ in requests]
+        return await self.instrumentation.observe(op, keys, coro)
+
+    async def _get_ranges(self, requests, limit):
+        return await map_concurrently(
+            lambda request: self._get_range(*request), requests, limit
+        )
+
+    async def _map_ranges(self, requests, limit):
+        return await self._get_ranges(requests, limit)
+
+    async def async_contains(self, key: str) -> bool:
+        """
+        Return whether `key` exists in the store, without listing it.
+
+        Rely on `async def _contains(key)`, the default fetches the value;
+        backends should override it with a native existence check.
+        """
+        assert self._valid_path(key)
+        if self.instrumentation is None:
+            return await self._contains(key)
+        return await self.instrumentation.observe(
+            "contains", key, self._contains(key), nbytes=0
+        )
+
+    async def _contains(self, key):
+        try:
+            await self._get(key)
+        except KeyError:
+            return False
+        return True
+
+    async def async_count(self) -> int:
+        """
+        Return the number of keys in the store.
+
+        The default lists every key, backends which maintain a count should
+        override it.
+        """
+        return len(await self.async_list())
+
+    async def async_get_many(self, keys, limit=None):
+        """
+        Get several keys at once and return a dict of the values found.
+
+        Keys missing from the store are left out of the result instead of
+        raising a KeyError, so one missing chunk does not abort the batch.
+        All keys are validated before any of them is fetched.
+
+        Rely on `async def _get_many(keys, limit)`, the default issues
+        concurrent `_get` with at most `limit` (default `batch_concurrency`)
+        in flight; backends can override it with a native bulk operation.
+        """
+        keys = list(dict.fromkeys(keys))
+        for key in keys:
+            assert self._valid_path(key)
+        coro = self._get_many(keys, limit or self.batch_concurrency)
+        if self.instrumentation is None:
+            found = await coro
+        else:
+            found = await self.instrumentation.observe("get_many", keys, coro)
+        for key, value in found.items():
+            await self._validate_get(key, value)
+        return {k: found[k] for k in keys if k in found}
+
+    async def async_set_many(self, mapping, limit=None):
+        """
+        Set several keys at once from a `{key: value}` mapping.
+
+        All keys and values are validated before any of them is written.
+        Rely on `async def _set_many(mapping, limit)`, with the same defaults
+        as `async_get_many`.
+        """
+        mapping = {k: self._validate_set(k, v) for k, v in dict(mapping).items()}
+        for key in mapping:
+            assert self._valid_path(key)
+        coro = self._set_many(mapping, limit or self.batch_concurrency)
+        if self.instrumentation is None:
+            await coro
+        else:
+            nbytes = sum(len(v) for v in mapping.values())
+            await self.instrumentation.observe(
+                "set_many", list(mapping), coro, nbytes=nbytes
+            )
+        self._invalidate(mapping)
+
+    async def async_delete_many(self, keys, limit=None):
+        """
+        Delete several keys at once, and return the list of keys which were
+        not found in the store instead of raising a KeyError.
+        """
+        keys = list(dict.fromkeys(keys))
+        for key in keys:
+            assert self._valid_path(key)
+        coro = self._delete_many(keys, limit or self.batch_concurrency)
+        try:
+            if self.instrumentation is None:
+                return await coro
+            return await self.instrumentation.observe(
+                "delete_many", keys, coro, nbytes=0
+            )
+        finally:
+            self._invalidate(keys)
+
+    async def _get_many(self, keys, limit):
+        return await map_concurrently(self._get, keys, limit)
+
+    async def _set_many(self, mapping, limit):
+        async def set_one(key):
+            await self._set(key, mapping[key])
+
+        await map_concurrently(set_one, mapping, limit)
+
+    async def _delete_many(self, keys, limit):
+        async def delete_one(key):
+            await self._delete(key)
+            return True
+
+        deleted = await map_concurrently(delete_one, keys, limit)
+        return [k for k in keys if k not in deleted]
 
     async def async_initialize(self):
         """
@@ -146,119 +442,634 @@ class BaseV3Store(AutoSync):
     async def async_list_prefix(self, prefix):
         return [k for k in await self.async_list() if k.startswith(prefix)]
 
+    async def async_iter_prefix(self, prefix):
+        """
+        Async iterator over the keys starting with `prefix`.
+
+        The default implementation is backed by `async_list_prefix`, stores
+        able to discover keys incrementally should override it so that memory
+        stays flat on large hierarchies.
+        """
+        for key in await self.async_list_prefix(prefix):
+            yield key
+
+    async def async_list_dir(self, prefix):
+        """
+        List the direct children of `prefix`, ie. the keys starting with
+        `prefix` truncated after the next `/`.
+        """
+        all_keys = await self.async_list_prefix(prefix)
+        len_prefix = len(prefix)
+        trail = {k[len_prefix:].split("/", maxsplit=1)[0] for k in all_keys}
+        return [prefix + k for k in trail]
+
+    async def async_consolidate_metadata(self):
+        """
+        Gather `zarr.json` and every `.group`/`.array` document into a single
+        document stored under `CONSOLIDATED_KEY`, so that readers can resolve
+        the metadata of the whole hierarchy with one fetch.
+
+        Return the consolidated document.
+        """
+        consolidated = await self.async_build_consolidated_metadata()
+        await self.async_set(CONSOLIDATED_KEY, json.dumps(consolidated).encode())
+        return consolidated
+
+    async def async_build_consolidated_metadata(self):
+        """
+        Same document as `async_consolidate_metadata`, without storing it.
+        """
+        keys = ["zarr.json"] + [
+            k for k in await self.async_list_prefix("meta/") if self._is_metadata(k)
+        ]
+        docs = await self.async_get_many(keys)
+        return {
+            "zarr_consolidated_format": 1,
+            "metadata": {k: json.loads(v.decode()) for k, v in docs.items()},
+        }
+
+    async def async_get_consolidated_metadata(self):
+        """
+        Return the consolidated document, raise KeyError if the hierarchy was
+        never consolidated.
+        """
+        return json.loads((await self.async_get(CONSOLIDATED_KEY)).decode())
+
     async def async_delete(self, key):
-        # TODO: not good in the base.
-        deln = await self._backend().delete(key)
-        if deln == 0:
-            raise KeyError(key)
+        """
+        default implementation of async_delete/delete that validate the key,
+        rely on `async def _delete(key)` to be implemented and raise a
+        KeyError if the key does not exist.
+        """
+        assert self._valid_path(key)
+        try:
+            if self.instrumentation is None:
+                await self._delete(key)
+            else:
+                await self.instrumentation.observe(
+                    "delete", key, self._delete(key), nbytes=0
+                )
+        finally:
+            self._invalidate([key])
 
 
 class V3DirectoryStore(BaseV3Store):
-    log = []
+    """
+    Store keys as files under a root directory.
+
+    File I/O is done in trio worker threads so that it does not block the
+    event loop, and concurrent or batched requests overlap. At most
+    `io_threads` of those threads are used at once by a given store.
+
+    With `use_mmap`, `map_ranges` (used to read uncompressed chunks) maps
+    files of at least `mmap_threshold` bytes in memory instead of reading
+    them, so a reader only touches the pages it needs and shares the OS page
+    cache with other processes. Other reads, metadata and compressed chunks,
+    are consumed whole once and are always read. A mapping is released when
+    the last reference to the buffer (or to arrays created from it) goes
+    away. Files are written to a temporary name and renamed, so a mapped
+    chunk keeps its content even if the key is rewritten or deleted
+    meanwhile.
+    """
+
+    #: files smaller than this are read even in `use_mmap` mode.
+    mmap_threshold = 64 * 1024
+
+    def __init__(self, path, io_threads=32, use_mmap=False):
+        import trio
 
-    def __init__(self, path):
-        self.log.append("init")
         self.root = Path(path)
+        self.use_mmap = use_mmap
+        self._io_limiter = trio.CapacityLimiter(io_threads)
+
+    async def _run_io(self, fn, *args):
+        import trio
+
+        return await trio.to_thread.run_sync(fn, *args, limiter=self._io_limiter)
 
     async def _get(self, key):
-        self.log.append(f"get {key}")
-        path = self.root / key
+        return await self._run_io(self._read, key)
+
+    async def _set(self, key, value):
+        await self._run_io(self._write, key, value)
+
+    async def _get_buffer(self, key):
+        return memoryview(await self._get(key))
+
+    async def _contains(self, key):
+        return await self._run_io((self.root / key).is_file)
+
+    async def _get_range(self, key, offset, length):
+        (data,) = await self._run_io(self._pread, key, [(offset, length)])
+        return memoryview(data)
+
+    async def _get_ranges(self, requests, limit):
+        by_key = {}
+        for key, offset, length in requests:
+            by_key.setdefault(key, []).append((offset, length))
+
+        async def read(key):
+            return await self._run_io(self._pread, key, by_key[key])
+
+        found = await map_concurrently(read, by_key, limit)
+        return {
+            (key, offset, length): memoryview(data)
+            for key, datas in found.items()
+            for (offset, length), data in zip(by_key[key], datas)
+        }
+
+    async def _map_ranges(self, requests, limit):
+        if not self.use_mmap:
+            return await self._get_ranges(requests, limit)
+        keys = list(dict.fromkeys(key for key, _, _ in requests))
+        found = await map_concurrently(
+            lambda key: self._run_io(self._map, key), keys, limit
+        )
+        return {
+            (key, offset, length): found[key][
+                offset : None if length is None else offset + length
+            ]
+            for key, offset, length in requests
+            if key in found
+        }
+
+    def _pread(self, key, ranges):
+        """
+        Read `(offset, length)` ranges of `key` with a single open.
+        """
+        try:
+            fd = os.open(self.root / key, os.O_RDONLY)
+        except FileNotFoundError:
+            raise KeyError(key)
+        try:
+            size = None
+            result = []
+            for offset, length in ranges:
+                if length is None:
+                    size = os.fstat(fd).st_size if size is None else size
+                    length = max(size - offset, 0)
+                result.append(os.pread(fd, length, offset))
+            return result
+        finally:
+            os.close(fd)
+
+    def _read(self, key):
+        try:
+            return (self.root / key).read_bytes()
+        except FileNotFoundError:
+            raise KeyError(key)
+
+    def _map(self, key):
+        import mmap
+
+        # the mapping stays valid once the file is closed, do not keep a
+        # duplicate of the descriptor open with it where python allows.
+        options = {"trackfd": False} if sys.version_info >= (3, 13) else {}
         try:
-            return path.read_bytes()
+            with open(self.root / key, "rb") as f:
+                if os.fstat(f.fileno()).st_size < self.mmap_threshold:
+                    return memoryview(f.read())
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ, **options)
+                return memoryview(mapping)
         except FileNotFoundError:
-            raise KeyError(path)
+            raise KeyError(key)
 
-    async def _set(self, key, value):
-        self.log.append(f"set {key} {value}")
+    def _write(self, key, value):
         path = self.root / key
-        if not path.parent.exists():
-            path.parent.mkdir(parents=True)
-        return path.write_bytes(value)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # never truncate a file in place: readers would see a partial value,
+        # and accessing a mapping past the new end of file is a SIGBUS.
+        # `~` can not appear in keys, so listings skip temporary files.
+        tmp = path.with_name(f"{path.name}~{uuid.uuid4().hex}")
+        try:
+            tmp.write_bytes(value)
+            os.replace(tmp, path)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+
+    def _remove(self, key):
+        try:
+            os.remove(self.root / key)
+        except FileNotFoundError:
+            raise KeyError(key)
+
+    def _scandir(self, rel):
+        """
+        Return the sorted file and subdirectory names of `root/rel`.
+        """
+        files, dirs = [], []
+        try:
+            with os.scandir(self.root / rel) as it:
+                for entry in it:
+                    if "~" in entry.name:
+                        # a value being written, see `_write`.
+                        continue
+                    (dirs if entry.is_dir() else files).append(entry.name)
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+        return sorted(files), sorted(dirs)
+
+    def _has_files(self, rel):
+        for _, _, files in os.walk(self.root / rel):
+            if any("~" not in f for f in files):
+                return True
+        return False
+
+    async def async_iter_prefix(self, prefix):
+        """
+        Yield keys starting with `prefix` as they are discovered.
+
+        Only the directory containing the last component of `prefix` and the
+        subdirectories matching it are visited, one `os.scandir` at a time,
+        so listing `meta/root/g1/` never looks at `data/`.
+        """
+        head, _, tail = prefix.rpartition("/")
+        files, dirs = await self._run_io(self._scandir, head)
+        head = head + "/" if head else ""
+        for name in files:
+            if name.startswith(tail):
+                yield head + name
+        stack = [head + d for d in reversed(dirs) if d.startswith(tail)]
+        while stack:
+            rel = stack.pop()
+            files, dirs = await self._run_io(self._scandir, rel)
+            for name in files:
+                yield f"{rel}/{name}"
+            stack.extend(f"{rel}/{d}" for d in reversed(dirs))
 
     async def async_list(self):
-        l = []
-        for it in os.walk(self.root):
-            for file in it[2]:
-                l.append(os.path.join(it[0], file)[len(str(self.root)) + 1 :])
-        return l
+        return [k async for k in self.async_iter_prefix("")]
 
-    async def async_delete(self, key):
-        self.log.append(f"delete {key}")
-        path = self.root / key
-        os.remove(path)
+    async def async_list_prefix(self, prefix):
+        return [k async for k in self.async_iter_prefix(prefix)]
+
+    async def async_list_dir(self, prefix):
+        """
+        Same as `MemoryStoreV3.async_list_dir`, from a single `os.scandir`;
+        subdirectories left empty by deletions are not listed.
+        """
+        head, _, tail = prefix.rpartition("/")
+        files, dirs = await self._run_io(self._scandir, head)
+        head = head + "/" if head else ""
+        children = [head + n for n in files if n.startswith(tail)]
+        for d in dirs:
+            if d.startswith(tail) and await self._run_io(self._has_files, head + d):
+                children.append(head + d)
+        return sorted(children)
+
+    async def _delete(self, key):
+        await self._run_io(self._remove, key)
+
+
+# redio command methods not named after the command.
+_REDIO_METHODS = {b"DEL": "delete"}
+# commands whose reply redio checks itself and leaves out of the results.
+_REDIO_CHECKED = {b"SET", b"FLUSHDB"}
+
+
+class _RedisPipeline:
+    """
+    Coalesce Redis commands issued concurrently by several tasks into a
+    single pipelined round-trip.
+
+    The first task to queue a command while no batch is pending becomes the
+    leader: it waits for one of the `connections` pooled connections, during
+    which other tasks keep queuing commands, then sends the whole batch at
+    once and hands each task its own reply.
+
+    A batch which gets no reply within `timeout` seconds fails with a
+    TimeoutError, and its connection is closed.
+    """
+
+    def __init__(self, backend, connections, timeout=30.0):
+        import trio
+
+        self._backend = backend
+        self._limiter = trio.CapacityLimiter(connections)
+        self._pending = []
+        self.timeout = timeout
+
+    async def _send(self, commands):
+        """
+        Pipeline the command tuples on one connection, with redio's command
+        methods, and return one reply per command (None for the commands
+        redio checks itself).
+        """
+        import trio
+
+        db = self._backend()
+        for name, *args in commands:
+            getattr(db, _REDIO_METHODS.get(name, name.decode().lower()))(*args)
+        with trio.move_on_after(self.timeout) as scope:
+            replies = await db
+        if scope.cancelled_caught:
+            raise TimeoutError(f"no reply from redis after {self.timeout}s")
+        expected = sum(name not in _REDIO_CHECKED for name, *_ in commands)
+        if expected == 0:
+            replies = []
+        elif expected == 1:
+            replies = [replies]
+        replies = iter(replies)
+        return [
+            None if name in _REDIO_CHECKED else next(replies)
+            for name, *_ in commands
+        ]
+
+    async def execute(self, commands):
+        """
+        Run a list of command tuples on one pooled connection, and return
+        the list of replies.
+        """
+        async with self._limiter:
+            replies = await self._send(commands)
+        for reply in replies:
+            if isinstance(reply, Exception):
+                raise reply
+        return replies
+
+    async def run(self, *cmd):
+        """
+        Queue a single command tuple, and return its reply once the batch it
+        landed in has been executed.
+        """
+        import trio
+
+        done = trio.Event()
+        slot = [cmd, None, done]
+        self._pending.append(slot)
+        if len(self._pending) == 1:
+            # the batch carries the commands of other tasks, it is not
+            # abandoned when the leader is cancelled, only on timeout.
+            with trio.CancelScope(shield=True):
+                async with self._limiter:
+                    batch, self._pending = self._pending, []
+                    try:
+                        replies = await self._send([p[0] for p in batch])
+                    except Exception as e:
+                        replies = [e] * len(batch)
+                for pending, reply in zip(batch, replies):
+                    pending[1] = reply
+                    pending[2].set()
+        await done.wait()
+        if isinstance(slot[1], Exception):
+            raise slot[1]
+        return slot[1]
 
 
 class RedisStore(BaseV3Store):
-    def __init__(self):
+    """
+    Store backed by a Redis database.
+
+    Commands issued concurrently are pipelined over a pool of at most
+    `pool_size` connections.
+    """
+
+    def __init__(self, url="redis://localhost/", pool_size=8):
         """initialisation is in _async initialize
         for early failure.
         """
-        pass
+        self.url = url
+        self.pool_size = pool_size
 
     def __getstate__(self):
-        return {}
+        return {"url": self.url, "pool_size": self.pool_size}
 
     def __setstate__(self, state):
-        self.__init__()
+        self.__init__(**state)
+        self._connect()
+
+    def _connect(self):
         from redio import Redis
 
-        self._backend = Redis("redis://localhost/")
+        self._backend = Redis(self.url, pool_max=self.pool_size)
+        self._pipeline = _RedisPipeline(self._backend, self.pool_size)
 
     # want to rename this to __await__ ?
     async def async_initialize(self):
-        from redio import Redis
-
-        self._backend = Redis("redis://localhost/")
-        b = self._backend()
-        for k in await self._backend().keys():
-            b.delete(k)
-        await b
+        self._connect()
+        await self._pipeline.execute([(b"FLUSHDB",)])
 
     async def _get(self, key):
-        res = await self._backend().get(key)
+        res = await self._pipeline.run(b"GET", key)
         if res is None:
-            raise KeyError
+            raise KeyError(key)
         return res
 
     async def _set(self, key, value):
-        return await self._backend().set(key, value)
+        await self._pipeline.run(b"SET", key, value)
+
+    async def _delete(self, key):
+        deln = await self._pipeline.run(b"DEL", key)
+        if deln == 0:
+            raise KeyError(key)
+
+    async def _contains(self, key):
+        return bool(await self._pipeline.run(b"EXISTS", key))
+
+    @staticmethod
+    def _range_commands(key, offset, length):
+        # GETRANGE does not tell missing keys from empty values.
+        if length == 0:
+            return [(b"EXISTS", key), (b"EXISTS", key)]
+        end = -1 if length is None else offset + length - 1
+        return [(b"EXISTS", key), (b"GETRANGE", key, offset, end)]
+
+    async def _get_range(self, key, offset, length):
+        exists, data = await self._pipeline.execute(
+            self._range_commands(key, offset, length)
+        )
+        if not exists:
+            raise KeyError(key)
+        return memoryview(data if length != 0 else b"")
+
+    async def _get_ranges(self, requests, limit):
+        if not requests:
+            return {}
+        commands = [c for r in requests for c in self._range_commands(*r)]
+        replies = await self._pipeline.execute(commands)
+        return {
+            request: memoryview(data if request[2] != 0 else b"")
+            for request, exists, data in zip(requests, replies[::2], replies[1::2])
+            if exists
+        }
+
+    async def async_count(self):
+        # the store owns its database, see `async_initialize`.
+        return await self._pipeline.run(b"DBSIZE")
+
+    async def _get_many(self, keys, limit):
+        if not keys:
+            return {}
+        values = await self._pipeline.run(b"MGET", *keys)
+        return {k: v for k, v in zip(keys, values) if v is not None}
+
+    async def _set_many(self, mapping, limit):
+        if mapping:
+            await self._pipeline.execute([(b"SET", k, v) for k, v in mapping.items()])
+
+    async def _delete_many(self, keys, limit):
+        if not keys:
+            return []
+        deln = await self._pipeline.execute([(b"DEL", k) for k in keys])
+        return [k for k, n in zip(keys, deln) if n == 0]
+
+    #: COUNT hint passed to SCAN, ie. roughly how many keys are visited per call.
+    scan_count = 1000
+
+    async def async_iter_prefix(self, prefix):
+        """
+        Yield keys starting with `prefix`, using `SCAN ... MATCH prefix*`
+        cursors so the server filters the keys and never blocks other
+        clients for the whole keyspace.
+
+        As with SCAN, a key modified during the iteration may be yielded more
+        than once, the list methods remove those duplicates.
+        """
+        pattern = "".join("\\" + c if c in "*?[]\\" else c for c in prefix) + "*"
+        cursor = b"0"
+        while True:
+            cursor, keys = await self._pipeline.run(
+                b"SCAN", cursor, b"MATCH", pattern, b"COUNT", self.scan_count
+            )
+            for key in keys:
+                yield key.decode()
+            if cursor in (b"0", 0):
+                break
 
     async def async_list(self):
-        return await self._backend().keys()
+        return await self.async_list_prefix("")
+
+    async def async_list_prefix(self, prefix):
+        return list(dict.fromkeys([k async for k in self.async_iter_prefix(prefix)]))
 
 
 class MemoryStoreV3(BaseV3Store):
+    """
+    In memory store.
+
+    Keys are also kept in a sorted index, so that prefix and directory
+    listings cost O(log N + matches) instead of a scan of all the keys.
+    """
+
     def __init__(self):
+        from sortedcontainers import SortedList
+
         self._backend = dict()
+        self._index = SortedList()
 
     async def _get(self, key):
-        return self._backend[key]
+        value = self._backend[key]
+        return value if isinstance(value, bytes) else bytes(value)
+
+    async def _get_buffer(self, key):
+        return memoryview(self._backend[key]).toreadonly()
+
+    async def _contains(self, key):
+        return key in self._backend
+
+    async def async_count(self):
+        return len(self._backend)
 
     async def _set(self, key, value):
-        self._backend[key] = value
+        if key not in self._backend:
+            self._index.add(key)
+        self._backend[key] = frozen(value)
 
-    async def async_delete(self, key):
+    async def _delete(self, key):
         del self._backend[key]
+        self._index.remove(key)
+
+    async def _get_many(self, keys, limit):
+        backend = self._backend
+        return {k: bytes(backend[k]) for k in keys if k in backend}
+
+    async def _set_many(self, mapping, limit):
+        self._index.update(k for k in mapping if k not in self._backend)
+        self._backend.update((k, frozen(v)) for k, v in mapping.items())
+
+    async def _delete_many(self, keys, limit):
+        missing = []
+        for key in keys:
+            if self._backend.pop(key, None) is None:
+                missing.append(key)
+            else:
+                self._index.remove(key)
+        return missing
 
     async def async_list(self):
         return list(self._backend.keys())
 
+    async def async_list_prefix(self, prefix):
+        keys = self._index.islice(self._index.bisect_left(prefix))
+        return list(takewhile(lambda k: k.startswith(prefix), keys))
+
     async def async_list_dir(self, prefix):
         """
         Note: carefully test this with trailing/leading slashes
-        """
 
-        all_keys = await self.async_list_prefix(prefix)
+        Once a child with nested keys is found, the index jumps directly past
+        its subtree (`child + "0"` is the first key sorting after
+        `child + "/..."`), so the cost is proportional to the number of
+        children and not to the number of keys below `prefix`.
+        """
+        index = self._index
         len_prefix = len(prefix)
-        trail = {k[len_prefix:].split("/", maxsplit=1)[0] for k in all_keys}
+        trail = {}
+        i = index.bisect_left(prefix)
+        while i < len(index) and index[i].startswith(prefix):
+            child, *nested = index[i][len_prefix:].split("/", maxsplit=1)
+            trail[child] = None
+            if nested:
+                i = index.bisect_left(prefix + child + "0")
+            else:
+                i += 1
         return [prefix + k for k in trail]
 
 
 class ZarrProtocolV3(AutoSync):
-    def __init__(self, store=MemoryStoreV3):
+    def __init__(
+        self,
+        store=MemoryStoreV3,
+        codec_threads=None,
+        consolidated=False,
+        write_empty_chunks=False,
+    ):
+        """
+        `codec_threads` bounds the number of worker threads compressing and
+        decompressing chunks (default: the number of CPUs).
+
+        With `consolidated`, every group or array created also updates the
+        consolidated metadata document (see
+        `BaseV3Store.async_consolidate_metadata`). Updates are gathered in
+        memory and written by `save_consolidated()`; until then the stored
+        document is removed, so readers never use a stale one.
+
+        Unless `write_empty_chunks` is set, chunks holding only the fill value
+        are deleted instead of stored, and read back as missing chunks.
+        """
+        import trio
+
         self._store = store()
+        self._codec_limiter = trio.CapacityLimiter(codec_threads or os.cpu_count())
+        self._consolidated = consolidated
+        self._consolidate_lock = trio.Lock()
+        # consolidated document with the unsaved updates, None if it has to
+        # be rebuilt from the store.
+        self._consolidated_doc = None
+        self._consolidated_dirty = False
+        self.write_empty_chunks = write_empty_chunks
+        #: chunks not stored because they only held the fill value, and
+        #: missing chunks read as the fill value.
+        self.elided_chunks = 0
+        self.filled_chunks = 0
+        # shard key -> index of a sharded array, see `_shard_index`.
+        self._shard_indexes = OrderedDict()
         self.init_hierarchy()
 
+    #: number of shard indexes kept in memory.
+    shard_index_cache_size = 4096
+
     def init_hierarchy(self):
         basic_info = {
             "zarr_format": "https://purl.org/zarr/spec/protocol/core/3.0",
@@ -276,6 +1087,54 @@ class ZarrProtocolV3(AutoSync):
     def _a_meta_key(self, key):
         return "meta/" + key + ".array"
 
+    async def _set_metadata(self, key, document: dict):
+        data = json.dumps(document).encode()
+        await self._store.async_set(key, data)
+        if not self._consolidated:
+            return
+        async with self._consolidate_lock:
+            if self._consolidated_dirty:
+                if self._consolidated_doc is not None:
+                    self._consolidated_doc["metadata"][key] = document
+                return
+            try:
+                doc = await self._store.async_get_consolidated_metadata()
+            except KeyError:
+                # rebuilt from the store on save.
+                doc = None
+            else:
+                doc["metadata"][key] = document
+                await self._store.async_delete_many([CONSOLIDATED_KEY])
+            self._consolidated_doc = doc
+            self._consolidated_dirty = True
+
+    async def async_save_consolidated(self):
+        """
+        Write the consolidated metadata document updated by the groups and
+        arrays created since the last save, and return it; return None if
+        there was nothing to save.
+        """
+        async with self._consolidate_lock:
+            if not self._consolidated_dirty:
+                return None
+            if self._consolidated_doc is None:
+                self._consolidated_doc = await self._store.async_consolidate_metadata()
+            else:
+                await self._store.async_set(
+                    CONSOLIDATED_KEY, json.dumps(self._consolidated_doc).encode()
+                )
+            self._consolidated_dirty = False
+            return self._consolidated_doc
+
+    async def async_consolidate(self):
+        """
+        (Re)build the consolidated metadata document of the hierarchy.
+        """
+        async with self._consolidate_lock:
+            self._consolidated_doc = await self._store.async_consolidate_metadata()
+            self._consolidated_dirty = False
+            return self._consolidated_doc
+
     async def async_create_group(self, group_path: str):
         """
         create a goup at `group_path`, 
@@ -288,38 +1147,63 @@ class ZarrProtocolV3(AutoSync):
 
         we could also assume that protocol implementation never do that.
         """
-        DEFAULT_GROUP = """{
-        "attributes": {
-            "spam": "ham",
-            "eggs": 42,
-        }  }
+        DEFAULT_GROUP = {
+            "attributes": {
+                "spam": "ham",
+                "eggs": 42,
+            }
+        }
+        await self._set_metadata(self._g_meta_key(group_path), DEFAULT_GROUP)
+
+    def _create_array_metadata(
+        self,
+        shape=(10,),
+        dtype="<f8",
+        chunk_shape=(1,),
+        fill_value="NaN",
+        compressor=None,
+        chunks_per_shard=None,
+    ):
         """
-        await self._store.async_set(
-            self._g_meta_key(group_path), DEFAULT_GROUP.encode()
-        )
+        `compressor` is a numcodecs codec config, like `{"id": "zstd", "level": 3}`,
+        or None to store chunks uncompressed.
 
-    def _create_array_metadata(self, shape=(10,), dtype="<f64", chunk_shape=(1,)):
+        With `chunks_per_shard`, each block of that many chunks (per
+        dimension) is stored as a single value, see `zarr3.sharding`.
+        """
         metadata = {
-            "shape": shape,
+            "shape": list(shape),
             "data_type": dtype,
             "chunk_grid": {
                 "type": "regular",
-                "chunk_shape": chunk_shape,
+                "chunk_shape": list(chunk_shape),
                 "separator": "/",
             },
             "chunk_memory_layout": "C",
-            "compressor": {
-                "codec": "https://none",
-                "configuration": {},
-                "fill_value": "NaN",
-            },
+            "compressor": compressor_from_v2(compressor),
+            "fill_value": fill_value,
             "extensions": [],
             "attributes": {},
         }
-
-    async def create_array(self, array_path: str):
+        if chunks_per_shard is not None:
+            from .sharding import sharding_transformer
+
+            metadata["storage_transformers"] = [sharding_transformer(chunks_per_shard)]
+        return metadata
+
+    async def async_create_array(
+        self,
+        array_path: str,
+        shape=(10,),
+        dtype="<f8",
+        chunk_shape=(1,),
+        fill_value="NaN",
+        compressor=None,
+        chunks_per_shard=None,
+    ):
         """
-        create a goup at `array_path`, 
+        create an array at `array_path`, and return its metadata.
+
         we need to make sure none of the subpath of array_path are arrays. 
 
         say  path is g1/g2/d3, we want to check
@@ -329,14 +1213,412 @@ class ZarrProtocolV3(AutoSync):
 
         we could also assume that protocol implementation never do that.
         """
-        DEFAULT_ARRAY = """{
-                "extensions": [],
-        "attributes": {
-            "spam": "ham",
-            "eggs": 42,
-        }  }
+        metadata = self._create_array_metadata(
+            shape, dtype, chunk_shape, fill_value, compressor, chunks_per_shard
+        )
+        await self._set_metadata(self._a_meta_key(array_path), metadata)
+        return metadata
+
+    async def async_get_array_metadata(self, array_path: str):
+        data = await self._store.async_get(self._a_meta_key(array_path))
+        return json.loads(data.decode())
+
+    @staticmethod
+    def _fill_value(metadata):
+        fill_value = metadata.get("fill_value")
+        if fill_value is None:
+            return 0
+        if isinstance(fill_value, str):
+            # "NaN", "Infinity" and "-Infinity", which JSON can not represent.
+            return float(fill_value)
+        return fill_value
+
+    @staticmethod
+    def _is_fill(chunk, fill_value):
+        """
+        Whether every element of `chunk` is `fill_value` (NaN included).
+        """
+        import numpy as np
+
+        if chunk.size == 0:
+            return True
+        if isinstance(fill_value, float) and np.isnan(fill_value):
+            if chunk.dtype.kind not in "fc":
+                return False
+            # most chunks are rejected by their first element.
+            return bool(np.isnan(chunk.flat[0]) and np.isnan(chunk).all())
+        return bool(chunk.flat[0] == fill_value and (chunk == fill_value).all())
+
+    @staticmethod
+    def _decode_chunk(metadata, codec, data):
+        """
+        Return an array view of the stored chunk `data`, decompressed with
+        `codec` (None for uncompressed).
         """
-        await self._store.set(self._g_meta_key(array_path), DEFAULT_ARRAY.encode())
+        import numpy as np
+
+        if codec is not None:
+            data = codec.decode(data)
+        return np.frombuffer(data, dtype=metadata["data_type"]).reshape(
+            metadata["chunk_grid"]["chunk_shape"],
+            order=metadata["chunk_memory_layout"],
+        )
+
+    @staticmethod
+    def _encode_chunk(metadata, codec, chunk):
+        """
+        Return the buffer to store for `chunk`, without copying an
+        uncompressed chunk which is already laid out as stored.
+        """
+        import numpy as np
+
+        if metadata["chunk_memory_layout"] == "F":
+            chunk = chunk.T
+        chunk = np.ascontiguousarray(chunk)
+        return chunk if codec is None else codec.encode(chunk)
+
+    async def _run_codec(self, codec, fn, *args):
+        """
+        Run the chunk (de)compression step `fn(*args)` in a worker thread,
+        or inline for uncompressed chunks which only need a memory copy.
+
+        The codecs supported by numcodecs (blosc, zstd, gzip) release the GIL,
+        so while workers compress or decompress, the event loop keeps issuing
+        store requests for the following chunks.
+        """
+        if codec is None:
+            return fn(*args)
+        import trio
+
+        return await trio.to_thread.run_sync(fn, *args, limiter=self._codec_limiter)
+
+    @staticmethod
+    def _chunk_strides(metadata, dtype):
+        """
+        Byte strides of a stored, uncompressed chunk.
+        """
+        shape = metadata["chunk_grid"]["chunk_shape"]
+        order = range(len(shape))
+        if metadata["chunk_memory_layout"] == "C":
+            order = reversed(order)
+        strides, step = [0] * len(shape), dtype.itemsize
+        for axis in order:
+            strides[axis] = step
+            step *= shape[axis]
+        return strides
+
+    def _chunk_selections(self, array_path, metadata, selection):
+        from .indexing import normalize_selection, chunk_selections, chunk_key
+
+        ranges, dropped = normalize_selection(selection, metadata["shape"])
+        separator = metadata["chunk_grid"]["separator"]
+        selections = {
+            chunk_key(array_path, coords, separator): (coords, in_chunk, in_out)
+            for coords, in_chunk, in_out in chunk_selections(
+                ranges, metadata["chunk_grid"]["chunk_shape"]
+            )
+        }
+        return [len(r) for r in ranges], dropped, selections
+
+    async def _shard_index(self, shard_key, n_chunks):
+        """
+        Index of the shard at `shard_key`, fetched once and cached; raise
+        KeyError if the shard does not exist.
+
+        The cache is updated by writes through this protocol instance, call
+        `clear_shard_index_cache` if shards are modified by other writers.
+        """
+        from .sharding import decode_index, index_nbytes
+
+        try:
+            self._shard_indexes.move_to_end(shard_key)
+            return self._shard_indexes[shard_key]
+        except KeyError:
+            pass
+        data = await self._store.async_get_range(shard_key, 0, index_nbytes(n_chunks))
+        index = decode_index(data, n_chunks)
+        self._cache_shard_index(shard_key, index)
+        return index
+
+    def _cache_shard_index(self, shard_key, index):
+        self._shard_indexes[shard_key] = index
+        self._shard_indexes.move_to_end(shard_key)
+        while len(self._shard_indexes) > self.shard_index_cache_size:
+            self._shard_indexes.popitem(last=False)
+
+    def clear_shard_index_cache(self):
+        self._shard_indexes.clear()
+
+    def _shards(self, array_path, metadata, selections):
+        """
+        Group the chunk keys of `selections` by shard, as
+        `{shard_key: {chunk_key: position_in_shard}}`.
+        """
+        from .indexing import chunk_key
+        from .sharding import chunks_per_shard, shard_position
+
+        shard_shape = chunks_per_shard(metadata)
+        separator = metadata["chunk_grid"]["separator"]
+        shards = {}
+        for key, (coords, _, _) in selections.items():
+            shard, position = shard_position(coords, shard_shape)
+            shard_key = chunk_key(array_path, shard, separator)
+            shards.setdefault(shard_key, {})[key] = position
+        return shards
+
+    async def async_read_array(self, array_path: str, selection=Ellipsis, limit=None):
+        """
+        Read `array[selection]` from the array at `array_path`.
+
+        `selection` is made of integers and slices (with positive steps), as
+        for NumPy basic indexing. All the chunks touched by the selection are
+        fetched concurrently, at most `limit` at once (default: the store's
+        `batch_concurrency`), and copied into the result with one slice
+        assignment per chunk. Missing chunks are read as `fill_value`, assigned
+        as a scalar without materializing the chunk.
+
+        Decompression of each chunk runs in a worker thread as soon as it is
+        fetched, overlapping with the requests for other chunks.
+
+        For sharded arrays, the index of each touched shard is fetched first,
+        then only the bytes of the selected chunks. For uncompressed arrays,
+        only the bytes spanned by the selection in each chunk are fetched.
+        """
+        import numpy as np
+        from .sharding import MISSING, chunks_per_shard
+
+        metadata = await self.async_get_array_metadata(array_path)
+        codec = get_codec(metadata.get("compressor"))
+        shape, dropped, selections = self._chunk_selections(
+            array_path, metadata, selection
+        )
+        out = np.empty(shape, dtype=metadata["data_type"])
+        fill_value = self._fill_value(metadata)
+        limit = limit or self._store.batch_concurrency
+
+        # chunk key -> (store key, offset, length) of the stored chunk, and
+        # groups of chunks fetched together.
+        locate = lambda key: (key, 0, None)
+        groups = [(key,) for key in selections]
+        shard_shape = chunks_per_shard(metadata)
+        if shard_shape is not None:
+            shards = self._shards(array_path, metadata, selections)
+            n_chunks = int(np.prod(shard_shape))
+            indexes = await map_concurrently(
+                lambda k: self._shard_index(k, n_chunks), shards, limit
+            )
+            ranges = {}
+            for shard_key, positions in shards.items():
+                if shard_key in indexes:
+                    for key, position in positions.items():
+                        offset, length = indexes[shard_key][position]
+                        if offset != MISSING:
+                            ranges[key] = shard_key, int(offset), int(length)
+            locate = ranges.__getitem__
+            groups = [tuple(positions) for positions in shards.values()]
+
+        def request(key):
+            store_key, offset, length = locate(key)
+            if codec is not None:
+                return store_key, offset, length
+            # only fetch the bytes spanned by the selection in the chunk.
+            in_chunk = selections[key][1]
+            first = sum(s.start * st for s, st in zip(in_chunk, strides))
+            last = sum((s.stop - 1) * st for s, st in zip(in_chunk, strides))
+            return store_key, offset + first, last - first + dtype.itemsize
+
+        def copy_chunk(data, in_chunk, in_out):
+            if codec is None:
+                out[in_out] = np.ndarray(
+                    [len(range(s.start, s.stop, s.step)) for s in in_chunk],
+                    dtype=dtype,
+                    buffer=data,
+                    strides=[st * s.step for s, st in zip(in_chunk, strides)],
+                )
+            else:
+                out[in_out] = self._decode_chunk(metadata, codec, data)[in_chunk]
+
+        dtype = out.dtype
+        strides = self._chunk_strides(metadata, dtype)
+
+        async def read_group(group):
+            requests = {}
+            for key in group:
+                try:
+                    requests[key] = request(key)
+                except KeyError:
+                    # not in the shard index.
+                    out[selections[key][2]] = fill_value
+                    self.filled_chunks += 1
+            if codec is None:
+                # used in place, the store may map them rather than read.
+                found = await self._store.async_map_ranges(requests.values(), limit)
+            elif len(requests) == 1:
+                ((key, req),) = requests.items()
+                try:
+                    found = {req: await self._store.async_get_range(*req)}
+                except KeyError:
+                    found = {}
+            else:
+                found = await self._store.async_get_ranges(requests.values(), limit)
+            for key, req in requests.items():
+                _, in_chunk, in_out = selections[key]
+                if req in found:
+                    await self._run_codec(
+                        codec, copy_chunk, found[req], in_chunk, in_out
+                    )
+                else:
+                    out[in_out] = fill_value
+                    self.filled_chunks += 1
+
+        await map_concurrently(read_group, groups, limit)
+        return out[tuple(0 if a in dropped else slice(None) for a in range(out.ndim))]
+
+    async def async_write_array(
+        self, array_path: str, value, selection=Ellipsis, limit=None
+    ):
+        """
+        Write `value` (anything broadcastable to the selection shape) to
+        `array[selection]` for the array at `array_path`.
+
+        Chunks entirely covered by the selection are written directly, other
+        touched chunks are read, updated and written back. Chunks are
+        processed concurrently, at most `limit` at once, and compressed in
+        worker threads.
+
+        For sharded arrays, each touched shard is rebuilt and written with a
+        single set, reading it first unless the selection covers it entirely.
+
+        Chunks left holding only the fill value are deleted rather than
+        stored, unless `write_empty_chunks` is set; shards left empty too.
+        """
+        import numpy as np
+        from .sharding import MISSING, chunks_per_shard, decode_index, encode_shard
+
+        metadata = await self.async_get_array_metadata(array_path)
+        codec = get_codec(metadata.get("compressor"))
+        shape, dropped, selections = self._chunk_selections(
+            array_path, metadata, selection
+        )
+        array_shape = metadata["shape"]
+        chunk_shape = metadata["chunk_grid"]["chunk_shape"]
+        dtype = np.dtype(metadata["data_type"])
+        fill_value = self._fill_value(metadata)
+        limit = limit or self._store.batch_concurrency
+
+        value = np.asarray(value, dtype=dtype)
+        value = np.broadcast_to(
+            value, [n for axis, n in enumerate(shape) if axis not in dropped]
+        )
+        value = np.expand_dims(value, tuple(sorted(dropped)))
+
+        def coverage(key):
+            """
+            Whether the selection covers the part of the chunk inside the
+            array, and whether that is the whole chunk.
+            """
+            coords, in_chunk, _ = selections[key]
+            in_bounds = [
+                min(size, total - c * size)
+                for c, size, total in zip(coords, chunk_shape, array_shape)
+            ]
+            covered = all(
+                s.start == 0 and s.step == 1 and s.stop == n
+                for s, n in zip(in_chunk, in_bounds)
+            )
+            return covered, covered and in_bounds == chunk_shape
+
+        def encode(chunk):
+            if not self.write_empty_chunks and self._is_fill(chunk, fill_value):
+                return None
+            return self._encode_chunk(metadata, codec, chunk)
+
+        def update_chunk(data, in_chunk, in_out):
+            if data is None:
+                chunk = np.full(chunk_shape, fill_value, dtype=dtype)
+            else:
+                chunk = self._decode_chunk(metadata, codec, data).copy()
+            chunk[in_chunk] = value[in_out]
+            return encode(chunk)
+
+        async def new_chunk(key, get_existing):
+            """
+            Encoded content of chunk `key` after the write, or None if it
+            only holds the fill value and must not be stored. `get_existing`
+            returns its current content or None.
+            """
+            _, in_chunk, in_out = selections[key]
+            covered, whole = coverage(key)
+            if whole:
+                return await self._run_codec(codec, encode, value[in_out])
+            data = None if covered else await get_existing(key)
+            return await self._run_codec(codec, update_chunk, data, in_chunk, in_out)
+
+        async def get_existing(key):
+            try:
+                return await self._store.async_get_buffer(key)
+            except KeyError:
+                return None
+
+        elided = []
+
+        async def write_chunk(key):
+            data = await new_chunk(key, get_existing)
+            if data is None:
+                elided.append(key)
+            else:
+                await self._store.async_set(key, data)
+
+        shard_shape = chunks_per_shard(metadata)
+        if shard_shape is None:
+            await map_concurrently(write_chunk, selections, limit)
+            if elided:
+                # previous content of the chunks, if any.
+                await self._store.async_delete_many(elided, limit)
+                self.elided_chunks += len(elided)
+            return
+
+        n_chunks = int(np.prod(shard_shape))
+
+        async def write_shard(shard_key):
+            positions = shards[shard_key]
+            chunks = {}
+            if len(positions) < n_chunks or not all(
+                coverage(k)[0] for k in positions
+            ):
+                try:
+                    data = await self._store.async_get_buffer(shard_key)
+                except KeyError:
+                    pass
+                else:
+                    for position, (offset, length) in enumerate(
+                        decode_index(data, n_chunks)
+                    ):
+                        if offset != MISSING:
+                            chunks[position] = data[offset : offset + length]
+
+            async def get_in_shard(key):
+                return chunks.get(positions[key])
+
+            updated = await map_concurrently(
+                lambda key: new_chunk(key, get_in_shard), positions, limit
+            )
+            for key, data in updated.items():
+                if data is None:
+                    chunks.pop(positions[key], None)
+                    self.elided_chunks += 1
+                else:
+                    chunks[positions[key]] = data
+            if not chunks:
+                await self._store.async_delete_many([shard_key])
+                self._shard_indexes.pop(shard_key, None)
+                return
+            data, index = encode_shard(chunks, n_chunks)
+            await self._store.async_set(shard_key, data)
+            self._cache_shard_index(shard_key, index)
+
+        shards = self._shards(array_path, metadata, selections)
+        await map_concurrently(write_shard, shards, limit)
 
 
 class V2from3Adapter(MutableMapping):
@@ -344,7 +1626,7 @@ class V2from3Adapter(MutableMapping):
     class to wrap a 3 store and return a V2 interface
     """
 
-    def __init__(self, v3store):
+    def __init__(self, v3store, consolidated=False, write_empty_chunks=True):
         """
 
         Wrapper arround a v3store to give a v2 compatible interface. 
@@ -365,58 +1647,165 @@ class V2from3Adapter(MutableMapping):
 
         THere will ikley need to be _some_
 
+        With `consolidated`, the consolidated metadata document is read once
+        here, and metadata reads and listings are served from it instead of
+        fetching every `.group`/`.array` document; metadata writes through
+        the adapter update it in memory, and `save_consolidated()` (or
+        `close()`) writes it back. Until then the stored document is removed,
+        so other readers never use a stale one. If the hierarchy was never
+        consolidated, the document is built in memory, and only stored by an
+        explicit `consolidate()` or once metadata is written. The chunk keys
+        are listed from the store once, when first asked for, then kept up
+        to date by the writes through the adapter.
+
+        Unless `write_empty_chunks` is set, chunks written through the
+        adapter are decoded and deleted instead of stored when they only hold
+        the fill value of their array; zarr reads them back as missing
+        chunks. `elided_chunks` counts them.
+
         """
         self._v3store = v3store
+        self._write_empty_chunks = write_empty_chunks
+        self.elided_chunks = 0
+        # v3 key -> parsed v3 metadata document.
+        self._v3_meta = {}
+        # v2 key -> rendered v2 metadata document.
+        self._v2_meta = {}
+        # v2 chunk directory -> v3 key of its array metadata, or None.
+        self._chunk_arrays = {}
+        self._consolidated = None
+        self._consolidated_dirty = False
+        # v3 chunk keys in consolidated mode, None until listed.
+        self._chunk_keys = None
+        if consolidated:
+            try:
+                doc = v3store.get_consolidated_metadata()
+            except KeyError:
+                doc = v3store.build_consolidated_metadata()
+            self._consolidated = doc["metadata"]
+
+    def consolidate(self):
+        """
+        Rebuild the consolidated metadata document from the store and reload it.
+        """
+        self.clear_metadata_cache()
+        self._consolidated = self._v3store.consolidate_metadata()["metadata"]
+        self._consolidated_dirty = False
+        return self._consolidated
+
+    def _get_v3_doc(self, v3key):
+        """
+        Parsed v3 metadata document, fetched and decoded once per adapter.
+        """
+        if self._consolidated is not None:
+            try:
+                return self._consolidated[v3key]
+            except KeyError:
+                raise KeyError(v3key) from None
+        try:
+            return self._v3_meta[v3key]
+        except KeyError:
+            pass
+        doc = json.loads(self._v3store.get(v3key).decode())
+        self._v3_meta[v3key] = doc
+        return doc
+
+    def _set_v3(self, v3key, data, doc=None):
+        self._v3store.set(v3key, data)
+        if not BaseV3Store._is_metadata(v3key):
+            if self._chunk_keys is not None:
+                self._chunk_keys.add(v3key)
+            return
+        if doc is None:
+            doc = json.loads(bytes(data))
+        self._v3_meta[v3key] = doc
+        self._v2_meta.clear()
+        self._chunk_arrays.clear()
+        if self._consolidated is not None:
+            self._consolidated[v3key] = doc
+            self._consolidated_changed()
+
+    def _consolidated_changed(self):
+        # the stored document is stale until the next save, remove it once
+        # rather than rewriting all of it on every metadata write.
+        if not self._consolidated_dirty:
+            self._v3store.delete_many([CONSOLIDATED_KEY])
+            self._consolidated_dirty = True
+
+    def save_consolidated(self):
+        """
+        Write the consolidated metadata document if metadata was modified
+        through the adapter since it was loaded or last saved.
+        """
+        if self._consolidated is not None and self._consolidated_dirty:
+            document = {"zarr_consolidated_format": 1, "metadata": self._consolidated}
+            self._v3store.set(CONSOLIDATED_KEY, json.dumps(document).encode())
+            self._consolidated_dirty = False
+
+    def close(self):
+        self.save_consolidated()
+
+    def clear_metadata_cache(self):
+        """
+        Forget the cached metadata, needed only if the underlying store was
+        modified without going through this adapter.
+        """
+        self._v3_meta.clear()
+        self._v2_meta.clear()
+        self._chunk_arrays.clear()
+        self._chunk_keys = None
 
     def __getitem__(self, key):
         """
         In v2  both metadata and data are mixed so we'll need to convert things that ends with .z to the metadata path.
+
+        Rendered v2 metadata documents are cached until the next metadata
+        write through the adapter.
         """
         assert isinstance(key, str), f"expecting string got {key!r}"
+        try:
+            return self._v2_meta[key]
+        except KeyError:
+            pass
         v3key = self._convert_2_to_3_keys(key)
+        if not key.endswith((".zattrs", ".zarray", ".zgroup")):
+            res = self._v3store.get(v3key)
+            assert isinstance(res, bytes)
+            return res
+
         if key.endswith(".zattrs"):
             try:
-                res = self._v3store.get(v3key)
+                data = self._get_v3_doc(v3key)
             except KeyError:
-                v3key = v3key.replace(".array", ".group")
-        res = self._v3store.get(v3key)
-
-        assert isinstance(res, bytes)
-        if key.endswith(".zattrs"):
-            data = json.loads(res.decode())["attributes"]
-            data = json.loads(res.decode())["attributes"]
-            res = json.dumps(data, indent=4).encode()
+                data = self._get_v3_doc(v3key.replace(".array", ".group"))
+            data = data["attributes"]
         elif key.endswith(".zarray"):
-            data = json.loads(res.decode())
+            data = dict(self._get_v3_doc(v3key))
             for target, source in RENAMED_MAP.items():
                 tmp = data[source]
                 del data[source]
                 data[target] = tmp
             data["chunks"] = data["chunk_grid"]["chunk_shape"]
             del data["chunk_grid"]
+            data["compressor"] = compressor_to_v2(data.get("compressor"))
 
             data["zarr_format"] = 2
             data["filters"] = None
             del data["extensions"]
             del data["attributes"]
-            res = json.dumps(data, indent=4).encode()
-
-        if v3key.endswith(".group") or v3key == "zarr.json":
-            data = json.loads(res.decode())
+        else:
+            data = dict(self._get_v3_doc(v3key))
             data["zarr_format"] = 2
             if data.get("attributes") is not None:
                 del data["attributes"]
-            res = json.dumps(data, indent=4).encode()
-        assert isinstance(res, bytes)
+        res = json.dumps(data, indent=4).encode()
+        self._v2_meta[key] = res
         return res
 
     def __setitem__(self, key, value):
         """
         In v2  both metadata and data are mixed so we'll need to convert things that ends with .z to the metadata path.
         """
-        # TODO convert to bytes if needed
-        from numcodecs.compat import ensure_bytes
-
         parts = key.split("/")
         v3key = self._convert_2_to_3_keys(key)
         # convert chunk separator from ``.`` to ``/``
@@ -434,29 +1823,30 @@ class V2from3Adapter(MutableMapping):
             data["chunk_grid"]["chunk_shape"] = data["chunks"]
             data["chunk_grid"]["type"] = "rectangular"
             data["chunk_grid"]["separator"] = "/"
+            data["compressor"] = compressor_from_v2(data.get("compressor"))
             assert data["zarr_format"] == 2
             del data["zarr_format"]
             assert data["filters"] in ([], None), f"found filters: {data['filters']}"
             del data["filters"]
             data["extensions"] = []
             try:
-                attrs = json.loads(self._v3store.get(v3key).decode())["attributes"]
+                attrs = self._get_v3_doc(v3key)["attributes"]
             except KeyError:
-                attrs = []
+                attrs = {}
             data["attributes"] = attrs
-            data = json.dumps(data, indent=4).encode()
+            doc, data = data, json.dumps(data, indent=4).encode()
         elif key.endswith(".zattrs"):
             try:
                 # try zarray first...
-                data = json.loads(self._v3store.get(v3key).decode())
+                data = dict(self._get_v3_doc(v3key))
             except KeyError:
                 try:
                     v3key = v3key.replace(".array", ".group")
-                    data = json.loads(self._v3store.get(v3key).decode())
+                    data = dict(self._get_v3_doc(v3key))
                 except KeyError:
                     data = {}
             data["attributes"] = json.loads(value.decode())
-            self._v3store.set(v3key, json.dumps(data, indent=4).encode())
+            self._set_v3(v3key, json.dumps(data, indent=4).encode(), data)
             return
         # todo: we want to keep the .zattr which i sstored in the  group/array file.
         # so to set, we need to get from the store assign update.
@@ -464,20 +1854,82 @@ class V2from3Adapter(MutableMapping):
             # todo: this is wrong, the top md document is zarr.json.
             data = json.loads(value.decode())
             data["zarr_format"] = "https://purl.org/zarr/spec/protocol/core/3.0"
-            data = json.dumps(data, indent=4).encode()
+            doc, data = data, json.dumps(data, indent=4).encode()
         elif v3key.endswith("/.group"):
             data = json.loads(value.decode())
             del data["zarr_format"]
             if "attributes" not in data:
                 data["attributes"] = {}
-            data = json.dumps(data).encode()
+            doc, data = data, json.dumps(data).encode()
         else:
-            data = value
+            if not self._write_empty_chunks and self._is_fill_chunk(key, value):
+                self._v3store.delete_many([v3key])
+                if self._chunk_keys is not None:
+                    self._chunk_keys.discard(v3key)
+                self.elided_chunks += 1
+                return
+            doc, data = None, value
         assert not isinstance(data, dict)
-        self._v3store.set(v3key, ensure_bytes(data))
+        # chunks are passed through as is, the store accepts any buffer.
+        self._set_v3(v3key, data, doc)
+
+    def _is_fill_chunk(self, key, value):
+        """
+        Whether the v2 chunk `value` at `key` only holds the fill value of
+        its array. Chunks of arrays without a numeric fill value never do.
+        """
+        import numpy as np
+
+        directory = key.rpartition("/")[0]
+        try:
+            array_key = self._chunk_arrays[directory]
+        except KeyError:
+            array_key = self._chunk_arrays[directory] = self._array_of(directory)
+        if array_key is None:
+            return False
+        doc = self._get_v3_doc(array_key)
+        dtype = np.dtype(doc["data_type"])
+        if doc.get("fill_value") is None or dtype.kind not in "biufc":
+            return False
+        codec = get_codec(doc.get("compressor"))
+        if codec is not None:
+            value = codec.decode(value)
+        return ZarrProtocolV3._is_fill(
+            np.frombuffer(value, dtype=dtype), ZarrProtocolV3._fill_value(doc)
+        )
+
+    def _array_of(self, directory):
+        """
+        v3 metadata key of the array holding the chunks of v2 `directory`,
+        or None.
+        """
+        parts = directory.split("/") if directory else []
+        # chunk keys of nested arrays have several components.
+        while True:
+            v3key = self._convert_2_to_3_keys("/".join(parts + [".zarray"]))
+            try:
+                self._get_v3_doc(v3key)
+                return v3key
+            except KeyError:
+                if not parts:
+                    return None
+                parts.pop()
 
     def __contains__(self, key):
-        return self._convert_2_to_3_keys(key) in self._v3store.list()
+        # not a key the store could hold, checked without relying on asserts.
+        if key.startswith("/"):
+            return False
+        v3key = self._convert_2_to_3_keys(key)
+        try:
+            if not self._v3store._valid_path(v3key):
+                return False
+        except ValueError:
+            return False
+        if self._consolidated is not None and BaseV3Store._is_metadata(v3key):
+            return v3key in self._consolidated
+        if v3key in self._v3_meta:
+            return True
+        return self._v3store.contains(v3key)
 
     def _convert_3_to_2_keys(self, v3key: str) -> str:
         """
@@ -518,12 +1970,20 @@ class V2from3Adapter(MutableMapping):
         return "data/root/" + v2key
 
     def __len__(self):
-        return len(self._v3store.list())
+        if self._consolidated is not None:
+            return len(self.keys())
+        # like `keys()`, whether or not the hierarchy was consolidated.
+        return self._v3store.count() - self._v3store.contains(CONSOLIDATED_KEY)
 
     def clear(self):
         keys = self._v3store.list()
         for k in keys:
             self._v3store.delete(k)
+        self.clear_metadata_cache()
+        if self._consolidated is not None:
+            self._consolidated = {}
+            self._consolidated_dirty = True
+            self._chunk_keys = set()
 
     def __delitem__(self, key):
         item3 = self._convert_2_to_3_keys(key)
@@ -531,22 +1991,42 @@ class V2from3Adapter(MutableMapping):
         items = self._v3store.list_prefix(item3)
         if not items:
             raise KeyError(f"{key} not found in store (converted key to {item3}")
-        for _item in self._v3store.list_prefix(item3):
+        for _item in items:
             self._v3store.delete(_item)
+            if self._chunk_keys is not None:
+                self._chunk_keys.discard(_item)
+        for k in [k for k in self._v3_meta if k.startswith(item3)]:
+            del self._v3_meta[k]
+        self._v2_meta.clear()
+        self._chunk_arrays.clear()
+        if self._consolidated is not None:
+            stale = [k for k in self._consolidated if k.startswith(item3)]
+            if stale:
+                for k in stale:
+                    del self._consolidated[k]
+                self._consolidated_changed()
 
     def keys(self):
         # TODO: not as stritforward.
         # we need to actually poke internally at .group/.array to potentially return '.zattrs'
         # if attribute is set.
         # it also seem in soem case zattrs is set in arrays even if the rest of the infomation is not set.
-        key = self._v3store.list()
+        if self._consolidated is not None:
+            if self._chunk_keys is None:
+                self._chunk_keys = set(self._v3store.list_prefix("data/"))
+            return self._to_v2_keys(list(self._consolidated) + list(self._chunk_keys))
+        return self._to_v2_keys(self._v3store.list())
+
+    def _to_v2_keys(self, v3keys):
         fixed_paths = []
-        for p in key:
+        for p in v3keys:
+            if p == CONSOLIDATED_KEY:
+                continue
+            v2key = self._convert_3_to_2_keys(p)
             if p.endswith(".group"):
-                res = self._v3store.get(p)
-                if json.loads(res.decode()).get("attributes"):
-                    fixed_paths.append(".zattrs")
-            fixed_paths.append(self._convert_3_to_2_keys(p))
+                if self._get_v3_doc(p).get("attributes"):
+                    fixed_paths.append(v2key[: -len(".zgroup")] + ".zattrs")
+            fixed_paths.append(v2key)
 
         return list(set(fixed_paths))
 
@@ -555,7 +2035,18 @@ class V2from3Adapter(MutableMapping):
         This_will be wrong as we also need to list meta/prefix, but need to
         be carefull and use list-prefix in that case with the right optiosn
         to convert the chunks separators.
+
+        In consolidated mode, groups are listed from the document, the store
+        is only listed for the chunks of an array.
         """
+        if self._consolidated is not None:
+            prefix = path.strip("/") + "/" if path.strip("/") else ""
+            keys = self._to_v2_keys(self._consolidated)
+            if prefix + ".zarray" in keys:
+                chunks = self._v3store.list_prefix(self._convert_2_to_3_keys(prefix))
+                keys += [self._convert_3_to_2_keys(k) for k in chunks]
+            keys = [k[len(prefix) :] for k in keys if k.startswith(prefix)]
+            return sorted({k.split("/")[0] for k in keys} - {""})
         v3path = self._convert_2_to_3_keys(path)
         if not v3path.endswith("/"):
             v3path = v3path + "/"
@@ -563,8 +2054,7 @@ class V2from3Adapter(MutableMapping):
         fixed_paths = []
         for p in ps:
             if p == ".group":
-                res = self._v3store.get(path + "/.group")
-                if json.loads(res.decode())["attributes"]:
+                if self._get_v3_doc(path + "/.group")["attributes"]:
                     fixed_paths.append(".zattrs")
             fixed_paths.append(self._convert_3_to_2_keys(p))
 
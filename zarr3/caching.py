@@ -0,0 +1,221 @@
+"""
+Read cache in front of any v3 store.
+"""
+from collections import OrderedDict
+
+from . import BaseV3Store
+
+
+class _LRU:
+    """
+    Mapping of key to bytes, evicting least recently used entries once the
+    total size of the values exceeds `max_bytes`.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+
+    def get(self, key):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            raise
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.pop(key)
+        if len(value) > self.max_bytes:
+            return
+        self._data[key] = value
+        self.nbytes += len(value)
+        while self.nbytes > self.max_bytes:
+            _, evicted = self._data.popitem(last=False)
+            self.nbytes -= len(evicted)
+            self.evictions += 1
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def pop(self, key):
+        value = self._data.pop(key, None)
+        if value is not None:
+            self.nbytes -= len(value)
+
+    def clear(self):
+        self._data.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._data),
+            "bytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+class CachingStoreV3(BaseV3Store):
+    """
+    Wrap a store and keep recently read values in memory.
+
+    Metadata (`meta/` keys and `zarr.json`) and chunks (`data/` keys) are
+    cached in two separate LRUs bounded by total value size, so that a large
+    chunk scan can not evict the metadata documents.
+
+    Writes go through to the wrapped store, then update the cache; deletes
+    evict. A value fetched while the same key is being written is not cached,
+    so a slow read can not put a stale value back in the cache.
+
+    Values are validated by the wrapped store, this wrapper does not repeat
+    the metadata checks.
+
+    Values are cached as stored, not decoded: a store sees neither the
+    dtype nor the codec of a chunk, and the same bytes serve `get`,
+    `get_buffer` and `get_range`. Parsed metadata documents are cached one
+    level up, by `V2from3Adapter`.
+    """
+
+    validation = "off"
+
+    def __init__(
+        self, store, max_bytes=256 * 2 ** 20, max_meta_bytes=16 * 2 ** 20
+    ):
+        self._store = store
+        self._meta = _LRU(max_meta_bytes)
+        self._data = _LRU(max_bytes)
+        self._inflight = {}
+        self._stale = set()
+
+    def _lru(self, key):
+        return self._data if key.startswith("data/") else self._meta
+
+    def cache_stats(self):
+        return {"meta": self._meta.stats(), "data": self._data.stats()}
+
+    def clear_cache(self):
+        self._meta.clear()
+        self._data.clear()
+
+    def _begin_fetch(self, keys):
+        for key in keys:
+            self._inflight[key] = self._inflight.get(key, 0) + 1
+
+    def _end_fetch(self, found, keys):
+        for key in keys:
+            if key in found and key not in self._stale:
+                self._lru(key).put(key, found[key])
+            self._inflight[key] -= 1
+            if not self._inflight[key]:
+                del self._inflight[key]
+                self._stale.discard(key)
+
+    def _written(self, keys, mapping=None):
+        for key in keys:
+            if key in self._inflight:
+                self._stale.add(key)
+            if mapping is None:
+                self._lru(key).pop(key)
+            else:
+                # the cache outlives the call, do not alias the caller's buffer.
+                self._lru(key).put(key, bytes(mapping[key]))
+
+    async def async_initialize(self):
+        await self._store.async_initialize()
+        self.clear_cache()
+
+    async def _get(self, key):
+        try:
+            return self._lru(key).get(key)
+        except KeyError:
+            pass
+        self._begin_fetch([key])
+        found = {}
+        try:
+            found[key] = await self._store.async_get(key)
+        finally:
+            self._end_fetch(found, [key])
+        return found[key]
+
+    async def _contains(self, key):
+        if key in self._lru(key):
+            return True
+        return await self._store.async_contains(key)
+
+    async def async_count(self):
+        return await self._store.async_count()
+
+    async def _get_range(self, key, offset, length):
+        # partial values are not cached, but a cached value serves any range.
+        try:
+            data = memoryview(self._lru(key).get(key))
+        except KeyError:
+            return await self._store.async_get_range(key, offset, length)
+        return data[offset : None if length is None else offset + length]
+
+    async def _set(self, key, value):
+        try:
+            await self._store.async_set(key, value)
+        except BaseException:
+            self._written([key])
+            raise
+        self._written([key], {key: value})
+
+    async def _delete(self, key):
+        try:
+            await self._store.async_delete(key)
+        finally:
+            self._written([key])
+
+    async def _get_many(self, keys, limit):
+        found, missing = {}, []
+        for key in keys:
+            try:
+                found[key] = self._lru(key).get(key)
+            except KeyError:
+                missing.append(key)
+        if missing:
+            self._begin_fetch(missing)
+            fetched = {}
+            try:
+                fetched = await self._store.async_get_many(missing, limit)
+            finally:
+                self._end_fetch(fetched, missing)
+            found.update(fetched)
+        return found
+
+    async def _set_many(self, mapping, limit):
+        try:
+            await self._store.async_set_many(mapping, limit)
+        except BaseException:
+            self._written(mapping)
+            raise
+        self._written(mapping, mapping)
+
+    async def _delete_many(self, keys, limit):
+        try:
+            return await self._store.async_delete_many(keys, limit)
+        finally:
+            self._written(keys)
+
+    async def async_list(self):
+        return await self._store.async_list()
+
+    async def async_list_prefix(self, prefix):
+        return await self._store.async_list_prefix(prefix)
+
+    async def async_list_dir(self, prefix):
+        return await self._store.async_list_dir(prefix)
+
+    async def async_iter_prefix(self, prefix):
+        async for key in self._store.async_iter_prefix(prefix):
+            yield key
@@ -0,0 +1,65 @@
+"""
+Resolve the `compressor` block of v3 array metadata to numcodecs codecs.
+
+A v3 compressor is `{"codec": <uri>, "configuration": {...}}`, where the uri
+is `https://purl.org/zarr/spec/codec/<id>/1.0` and `<id>` a numcodecs codec
+id (gzip, zstd, blosc, ...). `https://none` means no compression.
+"""
+
+NONE_URI = "https://none"
+CODEC_URI_PREFIX = "https://purl.org/zarr/spec/codec/"
+
+
+def codec_uri(codec_id) -> str:
+    if codec_id is None:
+        return NONE_URI
+    return f"{CODEC_URI_PREFIX}{codec_id}/1.0"
+
+
+def codec_id(uri):
+    """
+    numcodecs codec id for a v3 codec uri, None for no compression.
+    """
+    if uri is None or uri == NONE_URI:
+        return None
+    if uri.startswith(CODEC_URI_PREFIX):
+        return uri[len(CODEC_URI_PREFIX) :].split("/", 1)[0]
+    raise ValueError(f"unknown codec {uri!r}")
+
+
+def get_codec(compressor):
+    """
+    numcodecs codec instance for a v3 compressor block, None for no
+    compression.
+    """
+    if compressor is None:
+        return None
+    cid = codec_id(compressor["codec"])
+    if cid is None:
+        return None
+    import numcodecs
+
+    return numcodecs.get_codec({"id": cid, **compressor.get("configuration", {})})
+
+
+def compressor_from_v2(config):
+    """
+    Convert a v2 / numcodecs compressor config (`{"id": "zstd", "level": 3}`
+    or None) to a v3 compressor block.
+    """
+    if config is None:
+        return {"codec": NONE_URI, "configuration": {}}
+    config = dict(config)
+    return {"codec": codec_uri(config.pop("id")), "configuration": config}
+
+
+def compressor_to_v2(compressor):
+    """
+    Convert a v3 compressor block back to a v2 / numcodecs config.
+    """
+    if compressor is None:
+        return None
+    cid = codec_id(compressor["codec"])
+    if cid is None:
+        return None
+    return {"id": cid, **compressor.get("configuration", {})}
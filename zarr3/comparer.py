@@ -38,10 +38,7 @@ class StoreComparer(MutableMapping):
         return k1
 
     def __setitem__(self, key, value):
-        # todo : not quite happy about casting here, maybe we shoudl stay strict ?
-        from numcodecs.compat import ensure_bytes
-
-        values = ensure_bytes(value)
+        # values are handed to both stores as is, v3 stores accept any buffer.
         try:
             self.reference[key] = value
         except Exception as e:
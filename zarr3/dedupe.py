@@ -0,0 +1,250 @@
+"""
+Content addressed deduplication of chunks in front of any v3 store.
+"""
+import hashlib
+
+from . import BaseV3Store
+
+#: keys used by the wrapper itself, hidden from listings.
+DEDUPE_PREFIX = "data/.dedupe/"
+_MAGIC = b"\x00zarr3-dedupe\x00"
+_DIGEST_SIZE = 20
+_REF_SIZE = len(_MAGIC) + 2 * _DIGEST_SIZE
+
+
+def _escaped(value):
+    """
+    Whether a stored value starts with the reference marker: it is then
+    either a reference or a plain value stored behind an extra marker.
+    """
+    return bytes(value[: len(_MAGIC)]) == _MAGIC
+
+
+def _plain(value):
+    """
+    Plain value of a stored value which is not a reference.
+    """
+    return value[len(_MAGIC) :] if _escaped(value) else value
+
+
+class DedupeStoreV3(BaseV3Store):
+    """
+    Wrap a store and keep a single copy of identical chunks.
+
+    Each chunk (`data/` key) of at least `min_size` bytes is hashed with
+    blake2b and stored once under `data/.dedupe/blobs/<digest>`; the chunk
+    key itself only holds a small reference to it. The number of chunk keys
+    referring to a blob is kept under `data/.dedupe/refs/<digest>`, and the
+    blob is deleted with its last reference. Metadata and smaller chunks are
+    stored as is, except chunks which happen to start like a reference: they
+    are stored behind an extra copy of the reference marker. Keys under
+    `data/.dedupe/` are reserved, and invalid through this wrapper.
+
+    Writing a chunk which is already stored costs a few small writes instead
+    of the whole value. To also share the cache entry of duplicates, put the
+    cache under this wrapper: `DedupeStoreV3(CachingStoreV3(store))`.
+
+    Reference counts are cached in memory, so the wrapped store must only be
+    written through one `DedupeStoreV3` at a time. Blobs are written before
+    the references to them and released after, so an interrupted write can
+    leave an unreferenced blob behind, never a dangling reference.
+    """
+
+    validation = "off"
+
+    def __init__(self, store, min_size=128, lock_stripes=64):
+        import trio
+
+        self._store = store
+        self.min_size = min_size
+        # digest -> reference count.
+        self._counts = {}
+        # writes of a same chunk key, or updates of a same reference count,
+        # are serialized; the two are never held in the reverse order.
+        self._key_locks = [trio.Lock() for _ in range(lock_stripes)]
+        self._digest_locks = [trio.Lock() for _ in range(lock_stripes)]
+        #: chunks written which were already stored, and the bytes not written.
+        self.duplicates = 0
+        self.bytes_saved = 0
+
+    @staticmethod
+    def _valid_path(key):
+        if key.startswith(DEDUPE_PREFIX):
+            return False
+        return BaseV3Store._valid_path(key)
+
+    @staticmethod
+    def _blob_key(digest):
+        return f"{DEDUPE_PREFIX}blobs/{digest}"
+
+    @staticmethod
+    def _count_key(digest):
+        return f"{DEDUPE_PREFIX}refs/{digest}"
+
+    @staticmethod
+    def _digest_of(reference):
+        """
+        Digest a stored value refers to, None if it is not a reference.
+        """
+        if len(reference) != _REF_SIZE or not _escaped(reference):
+            return None
+        # hexadecimal digests never start with the NUL ending the marker.
+        if reference[len(_MAGIC)] == 0:
+            return None
+        return bytes(reference[len(_MAGIC) :]).decode()
+
+    async def _hash(self, value):
+        import trio
+
+        if len(value) < 2 ** 20:
+            return hashlib.blake2b(value, digest_size=_DIGEST_SIZE).hexdigest()
+        # hashlib releases the GIL on large buffers.
+        return await trio.to_thread.run_sync(
+            lambda: hashlib.blake2b(value, digest_size=_DIGEST_SIZE).hexdigest()
+        )
+
+    def _lock(self, locks, name):
+        return locks[hash(name) % len(locks)]
+
+    async def _count(self, digest):
+        try:
+            return self._counts[digest]
+        except KeyError:
+            pass
+        try:
+            count = int(await self._store.async_get(self._count_key(digest)))
+        except KeyError:
+            count = 0
+        self._counts[digest] = count
+        return count
+
+    async def _incref(self, digest, value):
+        async with self._lock(self._digest_locks, digest):
+            count = await self._count(digest)
+            if count:
+                self.duplicates += 1
+                self.bytes_saved += len(value)
+            else:
+                await self._store.async_set(self._blob_key(digest), value)
+            await self._store.async_set(self._count_key(digest), b"%d" % (count + 1))
+            self._counts[digest] = count + 1
+
+    async def _decref(self, digest):
+        async with self._lock(self._digest_locks, digest):
+            count = await self._count(digest) - 1
+            if count > 0:
+                await self._store.async_set(self._count_key(digest), b"%d" % count)
+                self._counts[digest] = count
+            else:
+                await self._store.async_delete_many(
+                    [self._blob_key(digest), self._count_key(digest)]
+                )
+                self._counts.pop(digest, None)
+
+    async def _current(self, key):
+        """
+        Digest referred to by the chunk `key`, None if it holds a plain value;
+        raise KeyError if it does not exist.
+        """
+        if not key.startswith("data/"):
+            return None
+        head = await self._store.async_get_range(key, 0, _REF_SIZE + 1)
+        return self._digest_of(head)
+
+    async def async_initialize(self):
+        await self._store.async_initialize()
+        self._counts.clear()
+
+    async def _get(self, key):
+        value = await self._store.async_get(key)
+        digest = self._digest_of(value)
+        if digest is None:
+            return _plain(value)
+        return await self._store.async_get(self._blob_key(digest))
+
+    async def _get_buffer(self, key):
+        value = await self._store.async_get_buffer(key)
+        digest = self._digest_of(value)
+        if digest is None:
+            return _plain(value)
+        return await self._store.async_get_buffer(self._blob_key(digest))
+
+    async def _get_range(self, key, offset, length):
+        if key.startswith("data/"):
+            head = await self._store.async_get_range(key, 0, _REF_SIZE + 1)
+            digest = self._digest_of(head)
+            if digest is not None:
+                key = self._blob_key(digest)
+            elif _escaped(head):
+                offset += len(_MAGIC)
+        return await self._store.async_get_range(key, offset, length)
+
+    async def _contains(self, key):
+        return await self._store.async_contains(key)
+
+    async def _get_many(self, keys, limit):
+        found = await self._store.async_get_many(keys, limit)
+        digests = {k: self._digest_of(v) for k, v in found.items()}
+        # duplicates are fetched once.
+        blobs = await self._store.async_get_many(
+            {self._blob_key(d) for d in digests.values() if d is not None}, limit
+        )
+        result = {}
+        for key, digest in digests.items():
+            if digest is None:
+                result[key] = _plain(found[key])
+            elif self._blob_key(digest) in blobs:
+                result[key] = blobs[self._blob_key(digest)]
+        return result
+
+    async def _set(self, key, value):
+        digest = None
+        if key.startswith("data/") and len(value) >= self.min_size:
+            digest = await self._hash(value)
+        async with self._lock(self._key_locks, key):
+            try:
+                previous = await self._current(key)
+            except KeyError:
+                previous = None
+            if digest is not None and digest == previous:
+                self.duplicates += 1
+                self.bytes_saved += len(value)
+                return
+            if digest is None:
+                if key.startswith("data/") and _escaped(value):
+                    value = _MAGIC + bytes(value)
+                await self._store.async_set(key, value)
+            else:
+                await self._incref(digest, value)
+                await self._store.async_set(key, _MAGIC + digest.encode())
+            if previous is not None:
+                await self._decref(previous)
+
+    async def _delete(self, key):
+        async with self._lock(self._key_locks, key):
+            previous = await self._current(key)
+            await self._store.async_delete(key)
+            if previous is not None:
+                await self._decref(previous)
+
+    async def async_list_prefix(self, prefix):
+        return [
+            k
+            for k in await self._store.async_list_prefix(prefix)
+            if not k.startswith(DEDUPE_PREFIX)
+        ]
+
+    async def async_list(self):
+        return await self.async_list_prefix("")
+
+    async def async_iter_prefix(self, prefix):
+        async for key in self._store.async_iter_prefix(prefix):
+            if not key.startswith(DEDUPE_PREFIX):
+                yield key
+
+    async def async_list_dir(self, prefix):
+        return [
+            k
+            for k in await self._store.async_list_dir(prefix)
+            if not (k + "/").startswith(DEDUPE_PREFIX)
+        ]
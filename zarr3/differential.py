@@ -0,0 +1,261 @@
+"""
+Differential testing of a v3 store implementation against a reference one.
+"""
+import json
+import zlib
+
+from . import BaseV3Store
+from .instrumentation import StoreInstrumentation
+
+
+class AsyncStoreComparer(BaseV3Store):
+    """
+    Store forwarding every operation to both a `reference` and a `tested`
+    store, concurrently, and raising an AssertionError as soon as they
+    disagree on a value or on the exception raised. Values and exceptions of
+    the reference are returned.
+
+    Metadata documents are compared as JSON and always verified. With
+    `sample` lower than 1, only that fraction of the `data/` keys is read
+    from the tested store; the sample is a deterministic function of the key
+    and `seed`, so reruns verify the same chunks. Writes always go to both
+    stores to keep them identical.
+
+    Latency of both stores is recorded side by side in `reference_stats` and
+    `tested_stats`, see `latency()`, so the comparer doubles as an A/B
+    benchmark harness.
+    """
+
+    validation = "off"
+
+    def __init__(self, reference, tested, sample=1.0, seed=0):
+        self.reference = reference
+        self.tested = tested
+        self.sample = sample
+        self.seed = seed
+        self.reference_stats = StoreInstrumentation()
+        self.tested_stats = StoreInstrumentation()
+        #: number of data keys read from both stores, and from the reference only.
+        self.verified = 0
+        self.skipped = 0
+
+    def _sampled(self, key):
+        if self.sample >= 1 or not key.startswith("data/"):
+            return True
+        return zlib.crc32(key.encode(), self.seed) < self.sample * 2 ** 32
+
+    async def _both(self, op, key, call, nbytes=None, tested_key=None):
+        """
+        Run `call(store)` on both stores concurrently, check they raise the
+        same exception type, and return both results.
+
+        `tested_key` is what the tested store is recorded as reading, when it
+        is not given the same keys as the reference.
+        """
+        import trio
+
+        outcomes = {}
+        recorded = {True: key, False: key if tested_key is None else tested_key}
+
+        async def run(store, stats):
+            is_reference = store is self.reference
+            try:
+                result = await stats.observe(
+                    op, recorded[is_reference], call(store), nbytes=nbytes
+                )
+                outcomes[store is self.reference] = result, None
+            except Exception as e:
+                outcomes[store is self.reference] = None, e
+
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(run, self.reference, self.reference_stats)
+            nursery.start_soon(run, self.tested, self.tested_stats)
+        (ref, ref_error), (tested, tested_error) = outcomes[True], outcomes[False]
+        if ref_error is not None:
+            if not isinstance(tested_error, type(ref_error)):
+                raise AssertionError(
+                    f"{op} {key!r}: expecting {type(ref_error).__name__}, "
+                    f"got {tested_error!r}"
+                ) from tested_error
+            raise ref_error
+        if tested_error is not None:
+            raise AssertionError(
+                f"{op} {key!r}: expecting {ref!r}, got {tested_error!r}"
+            ) from tested_error
+        return ref, tested
+
+    def _compare(self, key, ref, tested):
+        if self._is_metadata(key):
+            ref, tested = json.loads(ref.decode()), json.loads(tested.decode())
+        assert ref == tested, f"{key!r}: expecting {ref!r}, got {tested!r}"
+
+    async def async_initialize(self):
+        await self._both("initialize", "", lambda s: s.async_initialize(), 0)
+
+    async def _get(self, key):
+        if not self._sampled(key):
+            self.skipped += 1
+            return await self.reference_stats.observe(
+                "get", key, self.reference.async_get(key)
+            )
+        ref, tested = await self._both("get", key, lambda s: s.async_get(key))
+        self._compare(key, ref, tested)
+        self.verified += key.startswith("data/")
+        return ref
+
+    async def _get_range(self, key, offset, length):
+        if not self._sampled(key):
+            self.skipped += 1
+            return await self.reference_stats.observe(
+                "get_range", key, self.reference.async_get_range(key, offset, length)
+            )
+        ref, tested = await self._both(
+            "get_range", key, lambda s: s.async_get_range(key, offset, length)
+        )
+        assert (
+            ref == tested
+        ), f"{key!r} range {offset}+{length}: expecting {ref!r}, got {tested!r}"
+        self.verified += key.startswith("data/")
+        return ref
+
+    async def _set(self, key, value):
+        await self._both("set", key, lambda s: s.async_set(key, value), len(value))
+
+    async def _delete(self, key):
+        await self._both("delete", key, lambda s: s.async_delete(key), 0)
+
+    async def _contains(self, key):
+        ref, tested = await self._both(
+            "contains", key, lambda s: s.async_contains(key), 0
+        )
+        assert ref == tested, f"contains {key!r}: expecting {ref}, got {tested}"
+        return ref
+
+    async def async_count(self):
+        ref, tested = await self._both("count", [], lambda s: s.async_count(), 0)
+        assert ref == tested, f"count: expecting {ref}, got {tested}"
+        return ref
+
+    async def _get_many(self, keys, limit):
+        sampled = [k for k in keys if self._sampled(k)]
+        self.skipped += sum(k.startswith("data/") for k in keys) - sum(
+            k.startswith("data/") for k in sampled
+        )
+
+        def call(store):
+            # the tested store only fetches the sample.
+            batch = keys if store is self.reference else sampled
+            return store.async_get_many(batch, limit)
+
+        ref, tested = await self._both("get_many", keys, call, tested_key=sampled)
+        expected = {k: ref[k] for k in sampled if k in ref}
+        assert (
+            expected.keys() == tested.keys()
+        ), f"get_many: expecting keys {sorted(expected)}, got {sorted(tested)}"
+        for key, value in expected.items():
+            self._compare(key, value, tested[key])
+        self.verified += sum(k.startswith("data/") for k in expected)
+        return ref
+
+    async def _set_many(self, mapping, limit):
+        nbytes = sum(len(v) for v in mapping.values())
+        await self._both(
+            "set_many",
+            list(mapping),
+            lambda s: s.async_set_many(mapping, limit),
+            nbytes,
+        )
+
+    async def _delete_many(self, keys, limit):
+        ref, tested = await self._both(
+            "delete_many", keys, lambda s: s.async_delete_many(keys, limit), 0
+        )
+        assert set(ref) == set(
+            tested
+        ), f"delete_many: expecting {sorted(ref)} missing, got {sorted(tested)}"
+        return ref
+
+    async def async_compare_listing(self, prefix=""):
+        """
+        Compare the keys of both stores starting with `prefix`, and return a
+        pair of sorted lists: keys only in the reference, keys only in the
+        tested store.
+
+        Both listings are consumed concurrently through `async_iter_prefix`
+        and matched as they arrive, so memory is proportional to how far the
+        two streams drift apart, not to the number of keys.
+        """
+        only_ref, only_tested, _ = await self._compare_listing(prefix)
+        return only_ref, only_tested
+
+    async def _compare_listing(self, prefix, keep=False):
+        # with `keep`, also return the reference listing, in order.
+        import trio
+
+        pending = {True: set(), False: set()}
+        listed = []
+
+        async def consume(store):
+            is_reference = store is self.reference
+            mine, theirs = pending[is_reference], pending[not is_reference]
+            async for key in store.async_iter_prefix(prefix):
+                if keep and is_reference:
+                    listed.append(key)
+                if key in theirs:
+                    theirs.remove(key)
+                else:
+                    mine.add(key)
+
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(consume, self.reference)
+            nursery.start_soon(consume, self.tested)
+        return sorted(pending[True]), sorted(pending[False]), listed
+
+    async def async_list_prefix(self, prefix):
+        only_ref, only_tested, listed = await self._compare_listing(
+            prefix, keep=True
+        )
+        assert not (
+            only_ref or only_tested
+        ), f"listing {prefix!r}: missing {only_ref}, unexpected {only_tested}"
+        # iterators may yield a key twice, the list methods do not.
+        return list(dict.fromkeys(listed))
+
+    async def async_list(self):
+        return await self.async_list_prefix("")
+
+    async def async_list_dir(self, prefix):
+        ref, tested = await self._both(
+            "list_dir", prefix, lambda s: s.async_list_dir(prefix), 0
+        )
+        assert sorted(ref) == sorted(
+            tested
+        ), f"list_dir {prefix!r}: expecting {sorted(ref)}, got {sorted(tested)}"
+        return ref
+
+    def latency(self) -> dict:
+        """
+        Side by side latency of both stores, as
+        `{op: {key_class: {"reference": ..., "tested": ...}}}` where each
+        side has the operation `count` and `mean` seconds, plus the
+        `ratio` of the tested mean over the reference one.
+        """
+        ref = self.reference_stats.snapshot()["ops"]
+        tested = self.tested_stats.snapshot()["ops"]
+        result = {}
+        for op in sorted(set(ref) | set(tested)):
+            for cls in sorted(set(ref.get(op, {})) | set(tested.get(op, {}))):
+                entry = {}
+                for side, ops in (("reference", ref), ("tested", tested)):
+                    stats = ops.get(op, {}).get(cls)
+                    if stats is not None and stats["count"]:
+                        entry[side] = {
+                            "count": stats["count"],
+                            "mean": stats["seconds"] / stats["count"],
+                        }
+                if "reference" in entry and "tested" in entry:
+                    ref_mean = entry["reference"]["mean"]
+                    if ref_mean:
+                        entry["ratio"] = entry["tested"]["mean"] / ref_mean
+                result.setdefault(op, {})[cls] = entry
+        return result
@@ -0,0 +1,107 @@
+"""
+Map NumPy style selections on an array onto its regular chunk grid.
+
+Everything here works per dimension and per chunk, never per element: the
+actual data movement is left to vectorised NumPy slice assignments.
+"""
+import itertools
+
+import numpy as np
+
+
+def normalize_selection(selection, shape):
+    """
+    Convert a selection made of integers, slices and at most one Ellipsis to
+    a tuple of one `range` per dimension, plus the set of axes selected with
+    an integer (which are dropped from the result shape).
+
+    Only positive slice steps are supported.
+    """
+    if not isinstance(selection, tuple):
+        selection = (selection,)
+    if sum(s is Ellipsis for s in selection) > 1:
+        raise IndexError("an index can only have a single ellipsis ('...')")
+    if Ellipsis in selection:
+        i = selection.index(Ellipsis)
+        fill = (slice(None),) * (len(shape) - len(selection) + 1)
+        selection = selection[:i] + fill + selection[i + 1 :]
+    if len(selection) > len(shape):
+        raise IndexError(
+            f"too many indices for array: array is {len(shape)}-dimensional, "
+            f"but {len(selection)} were indexed"
+        )
+    selection = selection + (slice(None),) * (len(shape) - len(selection))
+
+    ranges, dropped = [], set()
+    for axis, (sel, size) in enumerate(zip(selection, shape)):
+        if isinstance(sel, slice):
+            start, stop, step = sel.indices(size)
+            if step < 1:
+                raise IndexError("only positive slice steps are supported")
+            ranges.append(range(start, stop, step))
+        elif isinstance(sel, (int, np.integer)):
+            index = int(sel) + size if sel < 0 else int(sel)
+            if not 0 <= index < size:
+                raise IndexError(
+                    f"index {sel} is out of bounds for axis {axis} with size {size}"
+                )
+            ranges.append(range(index, index + 1))
+            dropped.add(axis)
+        else:
+            raise IndexError(f"unsupported selection {sel!r} for axis {axis}")
+    return tuple(ranges), dropped
+
+
+def _dim_chunk_selections(rng, chunk_size):
+    """
+    For one dimension, yield `(chunk_index, slice_in_chunk, slice_in_output)`
+    for every chunk holding at least one selected index.
+    """
+    if not len(rng):
+        return
+    step = rng.step
+    if step >= chunk_size:
+        # at most one selected index per chunk.
+        for out, index in enumerate(rng):
+            c, local = divmod(index, chunk_size)
+            yield c, slice(local, local + 1, 1), slice(out, out + 1)
+        return
+    for c in range(rng.start // chunk_size, rng[-1] // chunk_size + 1):
+        lo = c * chunk_size
+        hi = min(lo + chunk_size, rng.stop)
+        # first selected index in this chunk.
+        first = rng.start
+        if lo > rng.start:
+            first -= (rng.start - lo) // step * step
+        count = len(range(first, hi, step))
+        if not count:
+            continue
+        out = (first - rng.start) // step
+        local = first - lo
+        yield c, slice(local, local + (count - 1) * step + 1, step), slice(
+            out, out + count
+        )
+
+
+def chunk_selections(ranges, chunk_shape):
+    """
+    Yield `(chunk_coords, selection_in_chunk, selection_in_output)` for every
+    chunk touched by `ranges` (as returned by `normalize_selection`).
+
+    `selection_in_output` indexes an output of shape `[len(r) for r in ranges]`,
+    that is before dropping integer indexed axes.
+    """
+    per_dim = [
+        list(_dim_chunk_selections(rng, size)) for rng, size in zip(ranges, chunk_shape)
+    ]
+    for combination in itertools.product(*per_dim):
+        coords, in_chunk, in_out = zip(*combination) if combination else ((), (), ())
+        yield tuple(coords), tuple(in_chunk), tuple(in_out)
+
+
+def chunk_key(array_path: str, coords, separator: str = "/") -> str:
+    """
+    Key of the chunk at `coords` of the array at `array_path`.
+    """
+    prefix = "data/root/" + array_path.strip("/") + "/c"
+    return prefix + separator.join(map(str, coords))
@@ -0,0 +1,121 @@
+"""
+Operation instrumentation for v3 stores.
+
+Assign an instance to `store.instrumentation` to start recording, leave it to
+`None` (the default) for no overhead beyond one attribute check per
+operation.
+"""
+import time
+from collections import deque, defaultdict
+
+
+def key_class(key) -> str:
+    """
+    Classify a key, or a list of keys, for aggregation: `zarr.json`, `meta`
+    or `data`. A batch spanning several classes is `mixed`.
+    """
+    if not isinstance(key, str):
+        classes = {key_class(k) for k in key}
+        return classes.pop() if len(classes) == 1 else "mixed"
+    if key == "zarr.json":
+        return "zarr.json"
+    return key.split("/", 1)[0]
+
+
+def _nbytes(result) -> int:
+    if isinstance(result, dict):
+        return sum(_nbytes(v) for v in result.values())
+    if isinstance(result, list):
+        return sum(_nbytes(v) for v in result)
+    if isinstance(result, bytes):
+        return len(result)
+    try:
+        return memoryview(result).nbytes
+    except TypeError:
+        return 0
+
+
+def _new_stats():
+    return {
+        "count": 0,
+        "errors": 0,
+        "keys": 0,
+        "bytes": 0,
+        "seconds": 0.0,
+        "histogram": defaultdict(int),
+    }
+
+
+class StoreInstrumentation:
+    """
+    Per `(operation, key class)` counters, byte counts and latency histograms,
+    plus a bounded ring buffer of the most recent operations.
+
+    Latency histograms use power of two buckets starting at 1µs, so their
+    size is bounded whatever the number of operations. Recent operations only
+    record the key, size and timing, never the values themselves.
+    """
+
+    def __init__(self, recent=1000, clock=time.perf_counter):
+        self.clock = clock
+        self.recent = deque(maxlen=recent)
+        self.reset()
+
+    def reset(self):
+        self._stats = defaultdict(_new_stats)
+        self.recent.clear()
+
+    def record(self, op, key, nbytes, seconds, error=None):
+        cls = key_class(key)
+        stats = self._stats[(op, cls)]
+        stats["count"] += 1
+        stats["keys"] += 1 if isinstance(key, str) else len(key)
+        stats["bytes"] += nbytes
+        stats["seconds"] += seconds
+        stats["histogram"][int(seconds * 1e6).bit_length()] += 1
+        if error is not None:
+            stats["errors"] += 1
+        self.recent.append(
+            {
+                "time": time.time(),
+                "op": op,
+                "key": key if isinstance(key, str) else f"<{len(key)} keys>",
+                "key_class": cls,
+                "bytes": nbytes,
+                "seconds": seconds,
+                "error": None if error is None else type(error).__name__,
+            }
+        )
+
+    async def observe(self, op, key, coro, nbytes=None):
+        """
+        Await `coro` and record it as `op` on `key` (a key or list of keys).
+
+        When `nbytes` is not given it is computed from the result: the size
+        of a bytes or buffer result (memoryview, mmap...), or the total size
+        of a dict or list of them; other results, such as keys, count as 0.
+        """
+        t0 = self.clock()
+        try:
+            result = await coro
+        except Exception as e:
+            self.record(op, key, nbytes or 0, self.clock() - t0, error=e)
+            raise
+        if nbytes is None:
+            nbytes = _nbytes(result)
+        self.record(op, key, nbytes, self.clock() - t0)
+        return result
+
+    def snapshot(self) -> dict:
+        """
+        Plain dict view of the current counters, suitable for a metrics
+        exporter. Histogram buckets are keyed by their upper bound in seconds.
+        """
+        ops = {}
+        for (op, cls), stats in sorted(self._stats.items()):
+            entry = {k: v for k, v in stats.items() if k != "histogram"}
+            entry["histogram"] = {
+                (2 ** b) * 1e-6: n for b, n in sorted(stats["histogram"].items())
+            }
+            ops.setdefault(op, {})[cls] = entry
+        return {"ops": ops, "recent": list(self.recent)}
@@ -0,0 +1,274 @@
+"""
+Copy a zarr v2 store onto a v3 store.
+
+Keys and metadata documents are translated the same way as `V2from3Adapter`
+does, so the result reads back identically through an adapter. Chunks are
+copied concurrently while the v2 listing is still being walked, metadata
+documents are converted and written last, so an interrupted migration never
+exposes an array whose chunks are not all there.
+
+    $ python -m zarr3.migrate path/to/v2 path/to/v3 --checkpoint progress.txt
+"""
+import itertools
+import sys
+import time
+
+from . import V2from3Adapter, MemoryStoreV3
+from .utils import as_buffer, background_loop
+
+V2_METADATA = (".zarray", ".zgroup", ".zattrs")
+
+
+class MigrationReport:
+    """
+    Progress of a migration: keys and bytes copied, keys skipped because the
+    checkpoint recorded them as done, and elapsed time.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.start = clock()
+        self.keys = 0
+        self.bytes = 0
+        self.metadata = 0
+        self.skipped = 0
+
+    @property
+    def elapsed(self):
+        return self.clock() - self.start
+
+    def snapshot(self) -> dict:
+        elapsed = self.elapsed
+        return {
+            "keys": self.keys,
+            "bytes": self.bytes,
+            "metadata": self.metadata,
+            "skipped": self.skipped,
+            "elapsed": elapsed,
+            "keys_per_second": self.keys / elapsed if elapsed else 0.0,
+            "bytes_per_second": self.bytes / elapsed if elapsed else 0.0,
+        }
+
+    def __str__(self):
+        s = self.snapshot()
+        return (
+            f"{s['keys']} chunks ({s['bytes'] / 2 ** 20:.1f} MiB), "
+            f"{s['metadata']} metadata documents, {s['skipped']} skipped "
+            f"in {s['elapsed']:.1f}s: {s['keys_per_second']:.0f} keys/s, "
+            f"{s['bytes_per_second'] / 2 ** 20:.1f} MiB/s"
+        )
+
+
+class _ByteBudget:
+    """
+    Bound the size of the values read but not yet written.
+
+    Sizes are only known once a value is read, so a reader waits for the
+    budget to be under its limit and then accounts for what it got: at most
+    `max_bytes` plus one value per concurrent reader are held at once.
+    """
+
+    def __init__(self, max_bytes):
+        import trio
+
+        self.max_bytes = max_bytes
+        self.used = 0
+        self._changed = trio.Condition()
+
+    async def wait(self):
+        async with self._changed:
+            while self.used >= self.max_bytes:
+                await self._changed.wait()
+
+    def acquire(self, nbytes):
+        self.used += nbytes
+
+    async def release(self, nbytes):
+        async with self._changed:
+            self.used -= nbytes
+            self._changed.notify_all()
+
+
+def _load_checkpoint(path):
+    if path is None:
+        return set()
+    try:
+        with open(path) as f:
+            return {line.rstrip("\n") for line in f}
+    except FileNotFoundError:
+        return set()
+
+
+def _append_checkpoint(path, keys):
+    with open(path, "a") as f:
+        f.writelines(k + "\n" for k in keys)
+
+
+def _convert_metadata(documents):
+    """
+    Translate v2 metadata documents into `{v3key: value}` by writing them
+    through an adapter over a scratch memory store.
+    """
+    staging = MemoryStoreV3()
+    adapter = V2from3Adapter(staging)
+    # attributes are merged into the .array/.group document, which must exist.
+    for key in sorted(documents, key=lambda k: k.endswith(".zattrs")):
+        adapter[key] = documents[key]
+    return staging.get_many(staging.list())
+
+
+async def async_migrate(
+    source,
+    target,
+    limit=32,
+    max_inflight_bytes=256 * 2 ** 20,
+    checkpoint=None,
+    progress=None,
+    progress_interval=1.0,
+    list_batch=1000,
+):
+    """
+    Copy every key of the v2 mapping `source` to the v3 store `target`.
+
+    - `limit`: number of chunks read and written concurrently.
+    - `max_inflight_bytes`: bound on the chunk bytes read but not yet written.
+    - `checkpoint`: path of a file recording the keys already copied; keys
+      listed there are skipped, so re-running an interrupted migration with
+      the same checkpoint resumes it.
+    - `progress`: called with the `MigrationReport` every `progress_interval`
+      seconds and once at the end.
+
+    `source` is read from worker threads as v2 stores are synchronous. Return
+    the final `MigrationReport`.
+    """
+    import trio
+
+    convert_key = V2from3Adapter(target)._convert_2_to_3_keys
+    done = await trio.to_thread.run_sync(_load_checkpoint, checkpoint)
+    report = MigrationReport()
+    budget = _ByteBudget(max_inflight_bytes)
+    metadata = {}
+    completed = []
+    send, receive = trio.open_memory_channel(limit * 4)
+
+    async def flush_checkpoint():
+        if checkpoint is not None and completed:
+            keys = completed[:]
+            del completed[:]
+            await trio.to_thread.run_sync(_append_checkpoint, checkpoint, keys)
+        if progress is not None:
+            progress(report)
+
+    async def lister():
+        async with send:
+            keys = iter(source)
+            while True:
+                batch = await trio.to_thread.run_sync(
+                    list, itertools.islice(keys, list_batch)
+                )
+                if not batch:
+                    break
+                for key in batch:
+                    if key in done:
+                        report.skipped += 1
+                    elif key.endswith(V2_METADATA):
+                        metadata[key] = await trio.to_thread.run_sync(
+                            source.__getitem__, key
+                        )
+                    else:
+                        await send.send(key)
+
+    async def copier(receive):
+        async with receive:
+            async for key in receive:
+                await budget.wait()
+                value = as_buffer(
+                    await trio.to_thread.run_sync(source.__getitem__, key)
+                )
+                budget.acquire(len(value))
+                try:
+                    await target.async_set(convert_key(key), value)
+                finally:
+                    await budget.release(len(value))
+                report.keys += 1
+                report.bytes += len(value)
+                completed.append(key)
+
+    async def reporter():
+        while True:
+            await trio.sleep(progress_interval)
+            await flush_checkpoint()
+
+    try:
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(reporter)
+            async with trio.open_nursery() as copiers:
+                copiers.start_soon(lister)
+                for _ in range(limit):
+                    copiers.start_soon(copier, receive.clone())
+                await receive.aclose()
+            nursery.cancel_scope.cancel()
+
+        if metadata:
+            await target.async_set_many(_convert_metadata(metadata))
+            report.metadata += len(metadata)
+            completed.extend(metadata)
+    finally:
+        with trio.CancelScope(shield=True):
+            await flush_checkpoint()
+    return report
+
+
+def migrate(source, target, **kwargs):
+    """
+    Synchronous version of `async_migrate`.
+    """
+    return background_loop.run(async_migrate, source, target, **kwargs)
+
+
+def _open_target(url):
+    if url.startswith("redis://"):
+        from . import RedisStore
+
+        store = RedisStore(url)
+        store._connect()
+        return store
+    from . import V3DirectoryStore
+
+    return V3DirectoryStore(url)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="python -m zarr3.migrate",
+        description="Copy a zarr v2 directory store onto a v3 store.",
+    )
+    parser.add_argument("source", help="path of the v2 directory store")
+    parser.add_argument("target", help="v3 directory path, or redis:// url")
+    parser.add_argument("--limit", type=int, default=32)
+    parser.add_argument("--max-inflight-mb", type=float, default=256)
+    parser.add_argument("--checkpoint", default=None)
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args(argv)
+
+    from zarr.storage import DirectoryStore
+
+    def progress(report):
+        if not args.quiet:
+            print(report, file=sys.stderr)
+
+    report = migrate(
+        DirectoryStore(args.source),
+        _open_target(args.target),
+        limit=args.limit,
+        max_inflight_bytes=int(args.max_inflight_mb * 2 ** 20),
+        checkpoint=args.checkpoint,
+        progress=progress,
+    )
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
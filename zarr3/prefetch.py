@@ -0,0 +1,392 @@
+"""
+Read-ahead of chunks in front of any v3 store.
+"""
+import re
+
+from . import BaseV3Store
+from .utils import background_loop
+
+# chunk keys: v3 `.../c0/1` or v2 `.../0.1`, coordinates joined by a single
+# separator.
+_CHUNK_KEY = re.compile(r"(.*?/c?)(\d+(?:([./])\d+(?:\3\d+)*)?)$")
+
+
+def _parse_chunk_key(key):
+    """
+    Split a chunk key into `(prefix, separator, coords)`, None if it does not
+    look like one.
+    """
+    match = _CHUNK_KEY.match(key)
+    if match is None or not key.startswith("data/"):
+        return None
+    prefix, coords, separator = match.groups()
+    separator = separator or "/"
+    return prefix, separator, tuple(int(c) for c in coords.split(separator))
+
+
+class _Prefetch:
+    def __init__(self):
+        import trio
+
+        self.done = trio.Event()
+        self.value = None
+        self.error = None
+        # whether the value is accounted in the buffered bytes.
+        self.counted = False
+
+
+class _Stream:
+    """
+    Chunk coordinates last read in an array, and the number of chunks along
+    the axes learned from the reads wrapping around them.
+    """
+
+    def __init__(self, coords):
+        self.coords = coords
+        self.extents = {}
+        self.sequential = False
+
+    def step(self, coords):
+        """
+        Record a read of `coords`, and whether it follows the previous one in
+        C order.
+        """
+        previous, self.coords = self.coords, coords
+        self.sequential = False
+        if len(coords) != len(previous):
+            return
+        for axis in range(len(coords)):
+            if coords[axis] != previous[axis]:
+                break
+        else:
+            return
+        if coords[axis] != previous[axis] + 1 or any(coords[axis + 1 :]):
+            return
+        # the axes after `axis` wrapped around: their extent is now known.
+        for after in range(axis + 1, len(coords)):
+            self.extents[after] = previous[after] + 1
+        self.sequential = True
+
+    def upcoming(self, n):
+        """
+        Coordinates of the next `n` chunks in C order. Axes of unknown extent
+        are assumed to go on, reads past their end only cost a missing key.
+        """
+        coords = list(self.coords)
+        result = []
+        for _ in range(n):
+            axis = len(coords) - 1
+            coords[axis] += 1
+            while axis > 0 and coords[axis] == self.extents.get(axis):
+                coords[axis] = 0
+                axis -= 1
+                coords[axis] += 1
+            result.append(tuple(coords))
+        return result
+
+
+class PrefetchingStoreV3(BaseV3Store):
+    """
+    Wrap a store and fetch the chunks about to be read ahead of time.
+
+    Once two chunks of an array are read one after the other in C order
+    (`data/root/a/c0/0` then `c0/1`, or `0.0` then `0.1` for keys written by
+    `V2from3Adapter`), the following ones are requested concurrently in the
+    background, so a sequential scan no longer waits for a full round trip
+    per chunk. The number of chunks along each axis is learned when the scan
+    wraps around it. Alternatively, `set_plan(keys)` gives the exact order in
+    which keys will be read.
+
+    At most `window` chunks are read ahead, and new ones are only requested
+    while the values fetched but not read yet, plus the fetches in flight
+    counted at the size of the last value fetched, total less than
+    `max_bytes`.
+
+    Range reads (such as the index then the chunks of a shard) follow the
+    access pattern too, and are sliced from the value read ahead; the last
+    value read is kept, outside of `max_bytes`, to serve the following
+    ranges of the same key.
+
+    Fetches run in `run_prefetcher` (for example
+    `nursery.start_soon(store.run_prefetcher)`), or `start_background_prefetcher`
+    when using the sync API; without it, reads go straight to the wrapped
+    store. Writes and deletes through the wrapper drop any value read ahead
+    for their keys, and their keys are not read ahead until they complete.
+    """
+
+    validation = "off"
+
+    def __init__(self, store, window=16, max_bytes=64 * 2 ** 20):
+        import trio
+
+        self._store = store
+        self.window = window
+        self.max_bytes = max_bytes
+        # key -> _Prefetch, in flight or not read yet.
+        self._pending = {}
+        self._buffered = 0
+        self._inflight = 0
+        # size of the last value fetched, None until the first one.
+        self._estimate = None
+        # keys expected to be read next, in order.
+        self._upcoming = []
+        self._wanted = set()
+        self._streams = {}
+        self._plan = None
+        # key -> number of writes or deletes in progress.
+        self._writing = {}
+        self._writes = 0
+        # (key, value) of the last value read ahead and consumed.
+        self._current = None
+        self._wakeup = trio.Event()
+        self.hits = 0
+        self.misses = 0
+        self.wasted = 0
+
+    def prefetch_stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "wasted": self.wasted,
+            "pending": len(self._pending),
+            "buffered_bytes": self._buffered,
+        }
+
+    async def async_set_plan(self, keys):
+        """
+        Read ahead `keys` in this order as they are consumed, instead of
+        guessing from the access pattern; None goes back to guessing.
+        """
+        if keys is None:
+            self._plan = None
+            self._expect([])
+            return
+        keys = list(keys)
+        self._plan = keys, {key: i for i, key in enumerate(keys)}
+        self._expect(keys[: self.window])
+
+    def _expect(self, keys):
+        self._upcoming = keys
+        self._wanted = set(keys)
+        for key in [k for k, e in self._pending.items() if k not in self._wanted]:
+            entry = self._pending[key]
+            if entry.done.is_set():
+                self._forget([key])
+                self.wasted += 1
+        self._wakeup.set()
+
+    def _advance(self, key):
+        """
+        Update the keys expected next after a read of `key`.
+        """
+        if self._plan is not None:
+            keys, positions = self._plan
+            if key in positions:
+                position = positions[key] + 1
+                self._expect(keys[position : position + self.window])
+            return
+        parsed = _parse_chunk_key(key)
+        if parsed is None:
+            return
+        prefix, separator, coords = parsed
+        stream = self._streams.get(prefix)
+        if stream is None:
+            self._streams[prefix] = _Stream(coords)
+            return
+        stream.step(coords)
+        if stream.sequential:
+            self._expect(
+                [
+                    prefix + separator.join(map(str, c))
+                    for c in stream.upcoming(self.window)
+                ]
+            )
+
+    def _forget(self, keys):
+        for key in keys:
+            if self._current is not None and self._current[0] == key:
+                self._current = None
+            entry = self._pending.pop(key, None)
+            if entry is not None and entry.counted:
+                self._buffered -= len(entry.value)
+                entry.counted = False
+
+    async def _take(self, key):
+        """
+        Value of `key` if it was read ahead (waiting for it if in flight),
+        None otherwise.
+        """
+        entry = self._pending.pop(key, None)
+        self._advance(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        await entry.done.wait()
+        if entry.counted:
+            self._buffered -= len(entry.value)
+        self._wakeup.set()
+        if entry.error is not None:
+            self.misses += 1
+            raise entry.error
+        if entry.value is None:
+            # the fetch was cancelled.
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry.value
+
+    async def _value(self, key):
+        """
+        Same as `_take`, also serving repeated reads of the last key taken.
+        """
+        if self._current is not None and self._current[0] == key:
+            self.hits += 1
+            return self._current[1]
+        writes = self._writes
+        value = await self._take(key)
+        # a write which started meanwhile makes the value stale once read.
+        fresh = value is not None and writes == self._writes
+        self._current = (key, value) if fresh else None
+        return value
+
+    async def _write(self, keys, coro):
+        """
+        Await the write or delete `coro` of `keys`, which are not read ahead
+        while it runs.
+        """
+        self._writes += 1
+        self._forget(keys)
+        for key in keys:
+            self._writing[key] = self._writing.get(key, 0) + 1
+        try:
+            return await coro
+        finally:
+            for key in keys:
+                self._writing[key] -= 1
+                if not self._writing[key]:
+                    del self._writing[key]
+            self._wakeup.set()
+
+    def _budget_left(self):
+        if self._estimate is None:
+            return not self._inflight
+        return self._buffered + self._inflight * self._estimate < self.max_bytes
+
+    async def _fetch(self, key, entry):
+        try:
+            entry.value = await self._store.async_get(key)
+            self._estimate = len(entry.value)
+        except Exception as e:
+            entry.error = e
+        finally:
+            self._inflight -= 1
+            self._abandon(key, entry)
+            entry.done.set()
+        if self._pending.get(key) is entry:
+            if key not in self._wanted:
+                del self._pending[key]
+                self.wasted += 1
+            elif entry.error is None:
+                entry.counted = True
+                self._buffered += len(entry.value)
+        self._wakeup.set()
+
+    def _abandon(self, key, entry):
+        """
+        Drop `entry` if its fetch did not complete, so that readers of `key`
+        go to the wrapped store instead of waiting for it.
+        """
+        if entry.value is None and entry.error is None:
+            if self._pending.get(key) is entry:
+                del self._pending[key]
+            entry.done.set()
+
+    async def run_prefetcher(self):
+        """
+        Fetch the expected keys as they are announced, until cancelled.
+        """
+        import trio
+
+        try:
+            async with trio.open_nursery() as nursery:
+                while True:
+                    self._wakeup = trio.Event()
+                    # at most `window` keys, stale fetches only count in the budget.
+                    for key in self._upcoming:
+                        if not self._budget_left():
+                            break
+                        if key not in self._pending and key not in self._writing:
+                            entry = self._pending[key] = _Prefetch()
+                            self._inflight += 1
+                            nursery.start_soon(self._fetch, key, entry)
+                    await self._wakeup.wait()
+        finally:
+            # fetches which never started are not cancelled by the nursery.
+            for key, entry in list(self._pending.items()):
+                self._abandon(key, entry)
+
+    def start_background_prefetcher(self):
+        """
+        Run the prefetcher on the loop used by the sync API.
+        """
+        background_loop.spawn(self.run_prefetcher)
+
+    async def async_initialize(self):
+        await self._store.async_initialize()
+        self._forget(list(self._pending))
+        self._current = None
+        self._streams.clear()
+
+    async def _get(self, key):
+        value = await self._value(key)
+        if value is None:
+            value = await self._store.async_get(key)
+        return value
+
+    async def _get_buffer(self, key):
+        value = await self._value(key)
+        if value is None:
+            return await self._store.async_get_buffer(key)
+        return memoryview(value).toreadonly()
+
+    async def _get_range(self, key, offset, length):
+        value = await self._value(key)
+        if value is None:
+            return await self._store.async_get_range(key, offset, length)
+        end = None if length is None else offset + length
+        return memoryview(value)[offset:end].toreadonly()
+
+    async def _contains(self, key):
+        return await self._store.async_contains(key)
+
+    async def async_count(self):
+        return await self._store.async_count()
+
+    async def _get_many(self, keys, limit):
+        return await self._store.async_get_many(keys, limit)
+
+    async def _set(self, key, value):
+        await self._write([key], self._store.async_set(key, value))
+
+    async def _delete(self, key):
+        await self._write([key], self._store.async_delete(key))
+
+    async def _set_many(self, mapping, limit):
+        await self._write(list(mapping), self._store.async_set_many(mapping, limit))
+
+    async def _delete_many(self, keys, limit):
+        keys = list(keys)
+        return await self._write(keys, self._store.async_delete_many(keys, limit))
+
+    async def async_list(self):
+        return await self._store.async_list()
+
+    async def async_list_prefix(self, prefix):
+        return await self._store.async_list_prefix(prefix)
+
+    async def async_list_dir(self, prefix):
+        return await self._store.async_list_dir(prefix)
+
+    async def async_iter_prefix(self, prefix):
+        async for key in self._store.async_iter_prefix(prefix):
+            yield key
@@ -0,0 +1,77 @@
+"""
+Sharding storage transformer: store the chunks of a block of
+`chunks_per_shard` chunks as a single value.
+
+A shard value starts with an index of one `(offset, length)` pair of
+little-endian uint64 per chunk of the block, in C order, followed by the
+chunk bytes. Missing chunks have both set to `MISSING`. The index has a
+fixed size, so readers can fetch it and then only the chunks they need:
+the array engine reads each touched shard's index once, then the ranges of
+the selected chunks in a single `get_ranges` call.
+"""
+import numpy as np
+
+from .utils import as_buffer
+
+SHARDING_URI = "https://purl.org/zarr/spec/storage_transformers/sharding/1.0"
+MISSING = 2 ** 64 - 1
+
+
+def sharding_transformer(chunks_per_shard) -> dict:
+    """
+    Storage transformer entry of the array metadata.
+    """
+    return {
+        "extension": SHARDING_URI,
+        "type": "indexed",
+        "configuration": {"chunks_per_shard": list(chunks_per_shard)},
+    }
+
+
+def chunks_per_shard(metadata):
+    """
+    Shape of a shard in chunks, or None if the array is not sharded.
+    """
+    for transformer in metadata.get("storage_transformers", []):
+        if transformer.get("extension") == SHARDING_URI:
+            return tuple(transformer["configuration"]["chunks_per_shard"])
+    return None
+
+
+def index_nbytes(n_chunks) -> int:
+    return 16 * n_chunks
+
+
+def shard_position(coords, shard_shape):
+    """
+    Return the coordinates of the shard holding the chunk at `coords`, and
+    the position of the chunk in the shard index.
+    """
+    shard = tuple(c // s for c, s in zip(coords, shard_shape))
+    within = tuple(c % s for c, s in zip(coords, shard_shape))
+    return shard, int(np.ravel_multi_index(within, shard_shape)) if within else 0
+
+
+def decode_index(buffer, n_chunks):
+    """
+    `(n_chunks, 2)` array of offsets and lengths from the start of a shard.
+    """
+    index = np.frombuffer(buffer, dtype="<u8", count=2 * n_chunks)
+    # copy, so that caching the index does not keep the whole shard alive.
+    return index.reshape(n_chunks, 2).copy()
+
+
+def encode_shard(chunks, n_chunks):
+    """
+    Pack `{position: buffer}` into a shard value, return it with its index.
+    """
+    index = np.full((n_chunks, 2), MISSING, dtype="<u8")
+    parts = [None]
+    offset = index_nbytes(n_chunks)
+    for position in sorted(chunks):
+        data = as_buffer(chunks[position])
+        index[position] = offset, len(data)
+        offset += len(data)
+        parts.append(data)
+    parts[0] = index.tobytes()
+    return b"".join(parts), index
@@ -0,0 +1,248 @@
+"""
+Two tier store: a fast store in front of a slow, durable one.
+"""
+import atexit
+import functools
+import threading
+
+from . import BaseV3Store
+from .utils import background_loop, frozen
+
+
+class TieredStoreV3(BaseV3Store):
+    """
+    Serve reads from a `fast` store (typically `MemoryStoreV3`) with fallback
+    to a `slow` one (typically `V3DirectoryStore` or `RedisStore`), and
+    acknowledge writes as soon as they land in the fast tier.
+
+    Writes and deletes are recorded as dirty and written behind to the slow
+    tier in batches of at most `flush_batch` keys, either by the flusher task
+    (`run_flusher`, or `start_background_flusher` when using the sync API) or
+    by `async_flush()`, which returns once everything written before the call
+    is durable.
+
+    Dirty values are bounded by `max_dirty_bytes`: a write that would exceed
+    it first flushes batches itself, so writers slow down to the speed of the
+    slow tier instead of growing memory without limit.
+
+    Reads and writes work from any trio loop, so the sync and async APIs can
+    be mixed. Flushes are serialized on the loop which first flushed, and
+    handed over to it when started from another loop, as long as it runs;
+    so do not call the sync API from a coroutine of that loop, it would wait
+    on itself.
+    """
+
+    validation = "off"
+
+    def __init__(
+        self,
+        fast,
+        slow,
+        max_dirty_bytes=64 * 2 ** 20,
+        flush_batch=256,
+        flush_interval=0.1,
+        promote=True,
+    ):
+        """
+        `promote`: copy values read from the slow tier into the fast one.
+        """
+        self.fast = fast
+        self.slow = slow
+        self.max_dirty_bytes = max_dirty_bytes
+        self.flush_batch = flush_batch
+        self.flush_interval = flush_interval
+        self.promote = promote
+        # key -> (version, value), value is None for a pending delete.
+        self._dirty = {}
+        self._dirty_bytes = 0
+        self._version = 0
+        # guards the dirty set, which any loop (and thread) may update.
+        self._dirty_lock = threading.Lock()
+        # created in the loop flushing the store, see `_flush_batch`.
+        self._loop = None
+        self._flush_lock = None
+        self._flush_error = None
+
+    @property
+    def dirty_bytes(self):
+        return self._dirty_bytes
+
+    @staticmethod
+    def _size(key, value):
+        return len(key) if value is None else len(value)
+
+    async def _mark_dirty(self, key, value):
+        with self._dirty_lock:
+            previous = self._dirty.get(key)
+            if previous is not None:
+                self._dirty_bytes -= self._size(key, previous[1])
+            self._version += 1
+            self._dirty[key] = (self._version, value)
+            self._dirty_bytes += self._size(key, value)
+        while self._dirty_bytes > self.max_dirty_bytes and self._dirty:
+            await self._flush_batch()
+
+    async def _flush_batch(self, keys=None):
+        """
+        Write one batch of dirty keys to the slow tier: the first
+        `flush_batch` ones, or those of `keys` still dirty.
+
+        Flushes of a same key must not overlap, they run under a lock of the
+        loop which first flushed; other loops hand their flushes over to it
+        while it runs, and take over once it is gone.
+        """
+        import trio
+
+        token = trio.lowlevel.current_trio_token()
+        if self._loop is not None and self._loop is not token:
+            flush = functools.partial(
+                trio.from_thread.run, self._flush_here, keys, trio_token=self._loop
+            )
+            try:
+                return await trio.to_thread.run_sync(flush)
+            except trio.RunFinishedError:
+                pass
+        if self._loop is not token:
+            self._loop, self._flush_lock = token, trio.Lock()
+        await self._flush_here(keys)
+
+    async def _flush_here(self, keys):
+        async with self._flush_lock:
+            with self._dirty_lock:
+                if keys is None:
+                    keys = list(self._dirty)[: self.flush_batch]
+                batch = {k: self._dirty[k] for k in keys if k in self._dirty}
+            if not batch:
+                return
+            sets = {k: v for k, (_, v) in batch.items() if v is not None}
+            deletes = [k for k, (_, v) in batch.items() if v is None]
+            if sets:
+                await self.slow.async_set_many(sets)
+            if deletes:
+                await self.slow.async_delete_many(deletes)
+            with self._dirty_lock:
+                for key, (version, value) in batch.items():
+                    # keys written again during the flush stay dirty.
+                    if self._dirty.get(key, (None,))[0] == version:
+                        del self._dirty[key]
+                        self._dirty_bytes -= self._size(key, value)
+
+    async def async_flush(self):
+        """
+        Write every change made before the call to the slow tier, and
+        re-raise the error which stopped the background flusher, if any.
+
+        Keys dirty at the call are flushed once each, with their latest
+        value; writes made meanwhile are left to the flusher, so concurrent
+        writers can not keep the call from returning.
+        """
+        if self._flush_error is not None:
+            error, self._flush_error = self._flush_error, None
+            raise error
+        with self._dirty_lock:
+            keys = list(self._dirty)
+        for start in range(0, len(keys), self.flush_batch):
+            await self._flush_batch(keys[start : start + self.flush_batch])
+
+    async def run_flusher(self):
+        """
+        Flush dirty keys every `flush_interval` seconds, forever.
+
+        Run it in a nursery, for example `nursery.start_soon(store.run_flusher)`.
+        """
+        import trio
+
+        while True:
+            await trio.sleep(self.flush_interval)
+            while self._dirty:
+                await self._flush_batch()
+
+    def start_background_flusher(self):
+        """
+        Run the flusher on the loop used by the sync API. An error stops it
+        and is re-raised by the next `flush()`.
+
+        Pending writes are flushed at interpreter exit, before the loop is
+        shut down.
+        """
+
+        async def flusher():
+            try:
+                await self.run_flusher()
+            except Exception as e:
+                self._flush_error = e
+
+        background_loop.spawn(flusher)
+        # atexit runs the hooks in reverse order, this one before the
+        # shutdown of the loop registered on import.
+        atexit.register(self._flush_at_exit)
+
+    def _flush_at_exit(self):
+        if background_loop.running and (self._dirty or self._flush_error):
+            self.flush()
+
+    async def async_initialize(self):
+        await self.fast.async_initialize()
+        await self.slow.async_initialize()
+
+    async def _get(self, key):
+        try:
+            return await self.fast.async_get(key)
+        except KeyError:
+            if key in self._dirty:
+                # pending delete, the slow tier is not up to date.
+                raise
+        version = self._version
+        value = await self.slow.async_get(key)
+        # do not promote a value which may have been overwritten meanwhile.
+        if self.promote and version == self._version:
+            await self.fast.async_set(key, value)
+        return value
+
+    async def _get_range(self, key, offset, length):
+        try:
+            return await self.fast.async_get_range(key, offset, length)
+        except KeyError:
+            if key in self._dirty:
+                raise
+        # partial values are not promoted.
+        return await self.slow.async_get_range(key, offset, length)
+
+    async def _contains(self, key):
+        entry = self._dirty.get(key)
+        if entry is not None:
+            return entry[1] is not None
+        return await self.fast.async_contains(key) or await self.slow.async_contains(
+            key
+        )
+
+    async def _set(self, key, value):
+        # the value is written behind, after the caller got control back.
+        value = frozen(value)
+        await self.fast.async_set(key, value)
+        await self._mark_dirty(key, value)
+
+    async def _delete(self, key):
+        try:
+            await self.fast.async_delete(key)
+        except KeyError:
+            if key in self._dirty:
+                raise
+            # also raise KeyError if the key is not in the slow tier.
+            await self.slow.async_get(key)
+        await self._mark_dirty(key, None)
+
+    async def _set_many(self, mapping, limit):
+        mapping = {k: frozen(v) for k, v in mapping.items()}
+        await self.fast.async_set_many(mapping, limit)
+        for key, value in mapping.items():
+            await self._mark_dirty(key, value)
+
+    async def async_list_prefix(self, prefix):
+        keys = dict.fromkeys(await self.fast.async_list_prefix(prefix))
+        keys.update(dict.fromkeys(await self.slow.async_list_prefix(prefix)))
+        # a pending delete hides the key.
+        return [k for k in keys if self._dirty.get(k, (None, k))[1] is not None]
+
+    async def async_list(self):
+        return await self.async_list_prefix("")
@@ -1,5 +1,9 @@
+import os
+import atexit
 import inspect
 import functools
+import threading
+import concurrent.futures
 
 from contextlib import contextmanager
 
@@ -36,6 +40,128 @@ def nested_run():
             GLOBAL_RUN_CONTEXT.__dict__.update(_dict)
 
 
+class BackgroundLoop:
+    """
+    A single trio event loop living in a dedicated daemon thread.
+
+    Sync wrappers generated by `AutoSync` submit their coroutines to this loop
+    instead of paying for a full `trio.run` startup and teardown on every
+    call. The thread is started lazily on first use, restarted after a fork,
+    and stopped at interpreter exit (or explicitly with `shutdown()`).
+
+    Calls made from the loop thread itself (a coroutine running here calling
+    a sync wrapper) can not block on the loop, and fall back to a nested
+    `trio.run`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._token = None
+        self._nursery = None
+        self._pid = None
+
+    @property
+    def running(self):
+        return (
+            self._thread is not None
+            and self._thread.is_alive()
+            and self._pid == os.getpid()
+        )
+
+    def _start(self):
+        with self._lock:
+            if self.running:
+                return
+            started = threading.Event()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._main, args=(started,), name="zarr3-trio", daemon=True
+            )
+            self._thread.start()
+            started.wait()
+
+    def _main(self, started):
+        import trio
+
+        async def main():
+            async with trio.open_nursery() as nursery:
+                self._token = trio.lowlevel.current_trio_token()
+                self._nursery = nursery
+                started.set()
+                await trio.sleep_forever()
+
+        try:
+            trio.run(main)
+        finally:
+            self._token = None
+            self._nursery = None
+            started.set()
+
+    @staticmethod
+    async def _run_task(future, afn):
+        import trio
+
+        try:
+            result = await afn()
+        except trio.Cancelled:
+            future.set_exception(RuntimeError("zarr3 event loop was shut down"))
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    def run(self, afn, *args, **kwargs):
+        """
+        Run `afn(*args, **kwargs)` on the background loop and block until
+        it returns, re-raising any exception in the calling thread.
+        """
+        afn = functools.partial(afn, *args, **kwargs)
+        if self.running and threading.current_thread() is self._thread:
+            import trio
+
+            with nested_run():
+                return trio.run(afn)
+
+        self._start()
+        future = concurrent.futures.Future()
+        self._token.run_sync_soon(
+            lambda: self._nursery.start_soon(self._run_task, future, afn)
+        )
+        return future.result()
+
+    def spawn(self, afn, *args):
+        """
+        Start `afn(*args)` as a background task on the loop without waiting
+        for it. It is cancelled on `shutdown()`; `afn` must handle its own
+        errors as an exception would stop the loop.
+        """
+        self._start()
+        self._token.run_sync_soon(lambda: self._nursery.start_soon(afn, *args))
+
+    def shutdown(self):
+        """
+        Cancel all pending work and stop the loop thread, it will be
+        restarted on next use.
+        """
+        with self._lock:
+            if not self.running:
+                return
+            nursery, thread = self._nursery, self._thread
+            try:
+                self._token.run_sync_soon(nursery.cancel_scope.cancel)
+            except Exception:
+                # loop already finished.
+                pass
+            thread.join()
+            self._thread = None
+
+
+background_loop = BackgroundLoop()
+atexit.register(background_loop.shutdown)
+
+
 class AutoSync:
     def __init_subclass__(cls, *args, **kwargs):
         attrs = [c for c in cls.__dict__.keys() if c.startswith("async_")]
@@ -50,12 +176,76 @@ class AutoSync:
                         
                         See {attr} documentation.
                         """
-                        import trio
-
-                        with nested_run():
-                            return trio.run(meth, self, *args)
+                        return background_loop.run(meth, self, *args, **kwargs)
 
                     sync_version.__doc__ = f"Automatically generated sync version of {attr}.\n\n{meth.__doc__}"
                     return sync_version
 
                 setattr(cls, attr[6:], cl(meth))
+
+
+def as_buffer(value):
+    """
+    Return `value` unchanged if it is `bytes`, otherwise a flat unsigned byte
+    memoryview over any buffer-protocol object (bytearray, memoryview, NumPy
+    array...) without copying it.
+
+    Buffers which can not be viewed as flat bytes (non contiguous, exotic
+    formats) are copied to `bytes` in memory order. Raise a TypeError for
+    objects not supporting the buffer protocol.
+    """
+    if isinstance(value, bytes):
+        return value
+    try:
+        view = memoryview(value)
+    except TypeError:
+        raise TypeError(f"expected bytes or a buffer, got {type(value)}") from None
+    if view.ndim == 1 and view.format == "B":
+        return view
+    try:
+        return view.cast("B")
+    except (TypeError, ValueError):
+        return view.tobytes(order="A")
+
+
+def frozen(value):
+    """
+    Return `value` if it can not change behind our back (`bytes` or a view of
+    `bytes`), otherwise a `bytes` copy. Stores keeping references to values
+    after a set returns use it to not alias the caller's buffers.
+
+    A read-only buffer is not enough: a read-only numpy view still sees the
+    writes made through the array it was taken from.
+    """
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, memoryview) and isinstance(value.obj, bytes):
+        return value
+    return bytes(value)
+
+
+async def map_concurrently(afn, items, limit):
+    """
+    Await `afn(item)` for every item in a trio nursery, with at most `limit`
+    calls in flight.
+
+    Return a dict mapping each item to its result, items for which `afn`
+    raised a `KeyError` are left out of the result instead of aborting the
+    others.
+    """
+    import trio
+
+    results = {}
+    limiter = trio.CapacityLimiter(limit)
+
+    async def one(item):
+        async with limiter:
+            try:
+                results[item] = await afn(item)
+            except KeyError:
+                pass
+
+    async with trio.open_nursery() as nursery:
+        for item in items:
+            nursery.start_soon(one, item)
+    return results